@@ -9,16 +9,132 @@ Plot area plot. Provides methods to generate either static or interactive plots.
 
 # General imports
 from random import random 
-import sys
+import base64
+import hashlib
+import json
 
 # specific imports that must be pre-installed
+import numpy as np
+import pandas as pd
 import matplotlib.patches as mpatches
-from matplotlib import pyplot as plt
+from matplotlib.colors import colorConverter, rgb2hex
+from scipy.cluster import hierarchy
+from scipy.spatial.distance import squareform
 
-MAX_DATA_POINTS = 20 # Maximum number of attributes that can be plotted on the area plot. Anymore and the plot is not legible and very slow to create.
+# internal imports
+import distances
+import rendering
+import render_cache
+import timing
+import generate_html
+
+MAX_DATA_POINTS = 20 # Default number of attributes plotted on the area plot, the rest are summed into "Other". Any more and the plot is not legible.
 
 WIDTH = 0.8 # Width of the bars
 
+OTHER = "Other" # Label of the layer summing all attributes that are not plotted individually.
+
+RASTER_SAMPLES = 5000 # Above this many samples the static area plot is drawn as an image instead of bars.
+
+RASTER_DPI = 150 # Resolution of raster area plots, the image already averages samples into pixel columns.
+
+INTERACTIVE_SIZE = (900, 500) # Width, height in pixels of the canvas of an interactive area plot.
+
+# Draws an interactive area plot from its JSON payload, defined once per page
+AREA_PLOT_JS = """
+if (typeof areaPlot === "undefined") {
+  var areaPlot = function(id) {
+    var data = JSON.parse(document.getElementById(id + "_data").textContent);
+    var canvas = document.getElementById(id + "_canvas");
+    var tip = document.getElementById(id + "_tip");
+    var ctx = canvas.getContext("2d");
+    
+    // cumulative abundances, samples x layers, scaled to 0..data.scale
+    var raw = atob(data.tops), bytes = new Uint8Array(raw.length);
+    for (var i = 0; i < raw.length; i++) { bytes[i] = raw.charCodeAt(i); }
+    var tops = new Uint16Array(bytes.buffer);
+    var n = data.samples.length, m = data.attributes.length;
+    
+    // one slot per sample, classes separated by an empty slot
+    var slots = new Int32Array(n), separators = [], starts = [], k = 0, s = 0;
+    data.sizes.forEach(function(size, c) {
+      starts.push(s);
+      for (var j = 0; j < size; j++) { slots[k++] = s++; }
+      if (c < data.sizes.length - 1) { separators.push(s++); }
+    });
+    var total = s, sampleAt = new Int32Array(total).fill(-1);
+    for (var i = 0; i < n; i++) { sampleAt[slots[i]] = i; }
+    
+    var labelHeight = 20, view = [0, total];
+    
+    function top(i, l) { return l < 0 ? 0 : tops[i * m + l] / data.scale; }
+    
+    function draw() {
+      var w = canvas.width, h = canvas.height - labelHeight, scale = w / (view[1] - view[0]);
+      var first = Math.max(0, Math.floor(view[0])), last = Math.min(total, Math.ceil(view[1]));
+      ctx.clearRect(0, 0, canvas.width, canvas.height);
+      
+      for (var l = 0; l < m; l++) {
+        ctx.fillStyle = data.colors[l];
+        ctx.beginPath();
+        for (var x = first; x < last; x++) {
+          var i = sampleAt[x];
+          if (i < 0) { continue; }
+          var y0 = top(i, l - 1), y1 = top(i, l);
+          ctx.rect((x - view[0]) * scale, h * (1 - y1), Math.max(scale, 1), h * (y1 - y0));
+        }
+        ctx.fill();
+      }
+      
+      ctx.fillStyle = "black";
+      separators.forEach(function(x) { ctx.fillRect((x - view[0]) * scale, 0, Math.max(scale, 1), h); });
+      
+      ctx.textAlign = "center";
+      ctx.font = "14px sans-serif";
+      data.classes.forEach(function(name, c) {
+        var center = (starts[c] + data.sizes[c] / 2 - view[0]) * scale;
+        if (center >= 0 && center <= w) { ctx.fillText(name, center, h + labelHeight - 4); }
+      });
+    }
+    
+    function slotAt(event) {
+      var rect = canvas.getBoundingClientRect();
+      var x = (event.clientX - rect.left) * canvas.width / rect.width;
+      return [view[0] + x / canvas.width * (view[1] - view[0]), (event.clientY - rect.top) * canvas.height / rect.height];
+    }
+    
+    canvas.onmousemove = function(event) {
+      var pos = slotAt(event), i = sampleAt[Math.floor(pos[0])];
+      var frac = 1 - pos[1] / (canvas.height - labelHeight);
+      if (i === undefined || i < 0 || frac < 0 || frac > 1) { tip.style.display = "none"; return; }
+      for (var l = 0; l < m && top(i, l) < frac; l++) {}
+      var text = data.samples[i];
+      if (l < m) { text += ": " + data.attributes[l] + " (" + (100 * (top(i, l) - top(i, l - 1))).toFixed(1) + "%)"; }
+      tip.textContent = text;
+      tip.style.left = (event.offsetX + 12) + "px";
+      tip.style.top = (event.offsetY + 12) + "px";
+      tip.style.display = "block";
+    };
+    
+    canvas.onmouseleave = function() { tip.style.display = "none"; };
+    
+    // zoom on the samples with the mouse wheel, double click to reset
+    canvas.onwheel = function(event) {
+      event.preventDefault();
+      var center = slotAt(event)[0], factor = event.deltaY > 0 ? 1.25 : 0.8;
+      var width = Math.min(total, Math.max(10, (view[1] - view[0]) * factor));
+      var left = Math.max(0, Math.min(total - width, center - (center - view[0]) * width / (view[1] - view[0])));
+      view = [left, left + width];
+      draw();
+    };
+    
+    canvas.ondblclick = function() { view = [0, total]; draw(); };
+    
+    draw();
+  };
+}
+"""
+
 # Colors for area plot:
 # blue, yellow, red, green, magenta, aqua, orange, purple, lime green,
 # hot pink, cyan, dark red, dark blue, peach, gray, dark green, lavendar
@@ -29,40 +145,40 @@ colors = ["#0000ff", "#ffff00", "#ff0000", "#00ff00", "#ff0066", "#99ff99", "#ff
 
 # Helper methods
 
-def __find_most_abundant(df, row_label):
-    """ Finds the most abundant attribute in this row of the DataFrame.
+def __order_by_most_abundant(values):
+    """ Order the rows of this class by the most abundant column of its first row.
     
     Requires:
-        DataFrame entries are non-negative numbers.
+        Entries are non-negative numbers.
     
     Args:
-        df: pandas DataFrame
-        row_label: label of the row to search for the most abundant attribute in.
+        values: samples x attributes numpy array of one class, in plotting order.
 
     Returns:
-        Label of the most abundant column value in this row_label.
+        Array of row indices, ascending in the most abundant column of the first row.
+        Of equally abundant columns, the first in plotting order is used.
     """
-    sample = df.loc[row_label]
-    maximum = 0
-    max_name = ""
-    for k in sample.index:
-        if sample[k] >= maximum:
-            max_name = k
-            maximum = sample[k]
-    
-    return max_name
+    column = np.argmax(values[0])
+    return np.argsort(values[:, column], kind="mergesort")
 
-def __sort_by_most_abundant(df):
-    """ Sorts the DataFrame rows by the most abundant column.
+def __order_by_clustering(data, dist_type):
+    """ Order the rows of this class by average linkage hierarchical clustering, 
+    so that similar samples are next to each other.
     
     Args:
-        df: pandas DataFrame.
+        data: pandas DataFrame of one class (samples x attributes).
+        dist_type: distance metric used for the clustering.
 
-    Effects:
-        df rows are now sorted by the DataFrame's most abundant column.
+    Returns:
+        Array of row indices, the leaf order of the dendrogram.
     """
-    column_label = __find_most_abundant(df, df.index[0])
-    df.sort(columns=column_label, axis=0, inplace=True)
+    if len(data.index) < 3:
+        return np.arange(len(data.index))
+    
+    dist = distances.distance_matrix(data, dist_type)
+    tree = hierarchy.linkage(squareform(np.nan_to_num(dist), checks=False), method="average")
+    
+    return hierarchy.leaves_list(tree)
 
 def __generate_colors(n):
     """ Generate a list of n colors from a predefined color list.
@@ -86,29 +202,51 @@ def __generate_colors(n):
 
     return colors
     
-def __sort_for_plot(df):
-    """ Sorts the columns in roughly reverse order such that
-    the first column in the DataFrame has the largest numerical
-    entries. 
-
+def __top_features(profile, n, rank_by="overall"):
+    """ Keep the n most abundant attributes and sum the rest into an "Other" column.
+    
     Args:
-        df: pandas DataFrame.
-
+        profile: metagenomic profile instance.
+        n: number of attributes to keep.
+        rank_by: "overall" to rank attributes by their mean abundance over all samples,
+            "class" to rank them by their highest mean abundance in any one class.
+    
     Returns:
-        A list of the new order of the columns. 
+        New DataFrame with "Other" (if any attributes were dropped) followed by the kept 
+        attributes from least to most abundant. 
     """
-    series = df.iloc[0]
-    series.sort(ascending=False)
-    return list(series.index)
+    df = profile.abundance_data
+    values = df.values
+    
+    if rank_by == "class":
+        codes = np.zeros(len(df.index), dtype=int)
+        for i, cls in enumerate(profile.references.keys()):
+            codes[df.index.isin(profile.references[cls])] = i
+        design = np.eye(len(profile.references))[codes] # samples x classes
+        means = (design.T.dot(values) / design.sum(axis=0)[:, np.newaxis]).max(axis=0)
+    else:
+        means = values.mean(axis=0)
+    
+    order = np.argsort(-means, kind="mergesort")[:n][::-1]
+    columns = [df.columns[i] for i in order]
+    
+    if len(df.columns) <= n:
+        return pd.DataFrame(values[:, order], index=df.index, columns=columns)
+    
+    kept = values[:, order]
+    other = values.sum(axis=1) - kept.sum(axis=1)
+    
+    return pd.DataFrame(np.column_stack((other, kept)), index=df.index, columns=[OTHER] + columns)
 
-def __get_xticks(profile):
+def __get_xticks(ax, profile):
     """ Get xticks for this plot.
     
     Args:
+        ax: matplotlib Axes of the plot.
         profile: metagenomic profile instance.
 
     Effects:
-        Plots separating line on current axes. 
+        Plots separating line on ax. 
 
     Returns:
         List of values to put ticks at.
@@ -123,196 +261,316 @@ def __get_xticks(profile):
     for cls in list(profile.references.keys()):
         running += len(profile.references[cls])*WIDTH
         ticks.append(running)
-        plt.axvline(x=running, color='black')
+        ax.axvline(x=running + WIDTH/2, color='black')
+        running += WIDTH # separating bar
 
     for i in range(len(ticks) - 1): # center the labels
         ticks[i] = (ticks[i] + ticks[i + 1]) / 2
+        ticks[i + 1] += WIDTH
 
-    return ticks
+    return ticks[:-1]
 
-def __plot_bars(profile, colors, interactive=False):
-    """ Plot bars for area plot.
+def __stack(df, references, sample_order="abundance", data=None, dist_type="braycurtis"):
+    """ Arrange the abundance data in plotting order. Within each class samples are 
+    sorted by the most abundant attribute of the class's first sample (or by clustering), and the columns 
+    are reversed so the first attribute is plotted on top. An empty row is inserted 
+    between classes for the separating bar. df is not modified.
+    
+    Args:
+        df: pandas DataFrame of the abundances to plot.
+        references: dict mapping class names to sample labels.
+        sample_order (str, default="abundance"): "abundance" or "cluster".
+        data (default=None): pandas DataFrame the samples are clustered on, defaults to df.
+        dist_type (str, default="braycurtis"): distance metric used for clustering.
+        
+    Returns:
+        samples x attributes numpy array of abundances, list of row labels (None for
+        separators), list of attribute labels in plotting order.
+    """
+    blocks = list()
+    labels = list()
+    
+    class_names = list(references.keys())
+    attributes = list(df.columns)[::-1]
+    
+    if data is None:
+        data = df
+    
+    for cls in class_names:
+        values = df.loc[references[cls], attributes].values
+        
+        if sample_order == "cluster":
+            order = __order_by_clustering(data.loc[references[cls]], dist_type)
+        else:
+            order = __order_by_most_abundant(values)
+        
+        blocks.append(values[order])
+        names = list(references[cls])
+        labels += [names[k] for k in order]
+        
+        if cls != class_names[-1]:
+            blocks.append(np.zeros((1, len(attributes))))
+            labels.append(None)
+            
+    return np.vstack(blocks), labels, attributes
+
+def __plot_bars(ax, df, references, colors, **order):
+    """ Plot bars for area plot. Each attribute is drawn as one filled step area on top 
+    of the cumulative sum of the layers below it.
 
     Args:
-        profile: metagenomic_profile instance 
+        ax: matplotlib Axes to plot on.
+        df: pandas DataFrame of the abundances to plot.
+        references: dict mapping class names to sample labels.
         colors: list of colors to use to plot bars
-        interactive: 
+        order: sample ordering options passed on to __stack.
     
     Effects:
-        Plots bars on current axes.
+        Plots bars on ax.
 
     Returns:
-        legend labels, and list of labels, ids for use with interactive plotting
+        legend labels
     """
+    values, samples, attributes = __stack(df, references, **order)
     
-    if interactive:
-        import mpld3
+    tops = np.cumsum(values, axis=1)
+    bottoms = tops - values
     
-    w = 0 # x-coordinate to plot each new bar on    
-    prev = dict()
-    plt.clf()
+    x = np.arange(len(samples)) * WIDTH # left edge of each bar
+    edges = np.append(x, len(samples) * WIDTH)
+    separators = np.array([s is None for s in samples])
     
     lgd_labels = dict() #(keys, values) = (labels, handles) for plotting legend
     
-    # interactive specific data structures
-    interactive_labels = list()
-    ids = []
+    for i in range(len(attributes)):
+        ax.fill_between(edges, np.append(bottoms[:, i], bottoms[-1, i]), np.append(tops[:, i], tops[-1, i]),
+                        step='post', linewidth=0, color=colors[i])
+        lgd_labels[attributes[i]] = mpatches.Patch(color=colors[i], label=attributes[i])
     
-    last_class = list(profile.references.keys())[-1]
-
-    for cls in list(profile.references.keys()):
-        class_df = profile.abundance_data.loc[profile.references[cls]]
-        __sort_by_most_abundant(class_df)
-
-        # change order of columns so most abundant attribute is plotted first
-        l = list(class_df.columns)[::-1]
-        class_df = class_df[l]
-
-        last_sample = class_df.index[-1]
-
-        for sample in class_df.index:
-            for i in range(len(class_df.columns)):
-                attr = class_df.columns[i]
-                if i == 0:
-                    prev[sample] = 0
-                bars = plt.bar(w, profile.abundance_data.loc[sample, attr], linewidth=0, 
-                               bottom=prev[sample], color=colors[i])
-                if interactive:
-                    ids.extend([mpld3.utils.get_id(bar) for bar in bars])
-                prev[sample] += class_df.loc[sample, attr]
-                if attr not in list(lgd_labels.keys()):
-                    lgd_labels[attr] = mpatches.Patch(color=colors[i], label=attr)
-                #interactive_labels.append(attr + " ("+cls+", " + sample + ")")
-                interactive_labels.append(sample)
-            
-            # plot separating line 
-            if sample == last_sample and cls != last_class:
-                w += WIDTH
-                plt.bar(w, 1, linewidth=0, color='black')
-            w += WIDTH
+    # plot separating lines 
+    if separators.any():
+        ax.bar(x[separators], np.ones(separators.sum()), width=WIDTH, linewidth=0, color='black', align='edge')
             
-    return lgd_labels, interactive_labels, ids
+    return lgd_labels
+
+def __payload(values, samples, attributes, references, colors):
+    """ Encode the composition matrix of an interactive area plot as JSON. The cumulative
+    abundances are quantized to 16 bit integers and base64 encoded, so the payload grows
+    by about 2.7 characters per sample and attribute. 
 
+    Args:
+        values: samples x attributes numpy array in plotting order, from __stack.
+        samples: row labels from __stack (None for separators).
+        attributes: attribute labels in plotting order.
+        references: dict mapping class names to sample labels.
+        colors: list of colors to use for the attributes.
+    
+    Returns:
+        JSON string.
+    """
+    rows = np.array([s is not None for s in samples])
+    tops = np.clip(np.cumsum(values[rows], axis=1), 0, 1)
+    scale = np.iinfo(np.uint16).max
+    
+    payload = {"samples": [str(s) for s in samples if s is not None],
+               "classes": [str(c) for c in references.keys()],
+               "sizes": [len(references[c]) for c in references.keys()],
+               "attributes": [str(a) for a in attributes],
+               "colors": [rgb2hex(colorConverter.to_rgb(c)) for c in colors[:len(attributes)]],
+               "scale": int(scale),
+               "tops": base64.b64encode(np.round(tops * scale).astype('<u2').tobytes()).decode('ascii')}
+    
+    return json.dumps(payload).replace("</", "<\\/")
+    
+def __plot_raster(ax, df, references, colors, dpi, **order):
+    """ Plot the area plot as a single image with one pixel per pixel of the axes in the
+    saved file. Samples are averaged into the pixel columns and each pixel is colored by 
+    the attribute whose layer covers it. Columns containing a separating bar are drawn black. 
+
+    Args:
+        ax: matplotlib Axes to plot on.
+        dpi (int): resolution the figure is saved at.
+        df: pandas DataFrame of the abundances to plot.
+        references: dict mapping class names to sample labels.
+        colors: list of colors to use for the attributes.
+        order: sample ordering options passed on to __stack.
+    
+    Effects:
+        Draws the image on ax.
+
+    Returns:
+        legend labels
+    """
+    values, samples, attributes = __stack(df, references, **order)
+    separators = np.array([s is None for s in samples])
+    
+    # size of the axes in pixels of the saved figure
+    bbox = ax.get_window_extent()
+    n_columns = min(len(samples), max(1, int(round(bbox.width * dpi / ax.figure.dpi))))
+    n_rows = max(1, int(round(bbox.height * dpi / ax.figure.dpi)))
+    
+    # average consecutive samples into pixel columns
+    column = (np.arange(len(samples)) * n_columns) // len(samples)
+    starts = np.flatnonzero(np.diff(np.append(-1, column)))
+    counts = np.diff(np.append(starts, len(samples)))
+    
+    tops = np.cumsum(np.add.reduceat(values, starts, axis=0) / counts[:, np.newaxis], axis=1)
+    black = np.add.reduceat(separators.astype(int), starts) > 0
+    
+    # index of the layer covering each pixel; len(attributes) above the stack, +1 for separators
+    y = (np.arange(n_rows) + 0.5) / n_rows
+    layer = np.zeros((n_rows, n_columns), dtype=int)
+    for i in range(len(attributes)):
+        layer += y[:, np.newaxis] >= tops[np.newaxis, :, i]
+    layer[:, black] = len(attributes) + 1
+    
+    palette = np.array([colorConverter.to_rgb(c) for c in colors[:len(attributes)]] + [(1, 1, 1), (0, 0, 0)])
+    
+    ax.imshow(palette[layer], origin='lower', aspect='auto', interpolation='nearest',
+              extent=(0, len(samples) * WIDTH, 0, 1))
+    
+    lgd_labels = dict()
+    for i in range(len(attributes)):
+        lgd_labels[attributes[i]] = mpatches.Patch(color=colors[i], label=attributes[i])
+    
+    return lgd_labels
     
 # Public methods
 
-def area_plot(profile, output_dir):
-    """ Create a png area plot of the attributes on this data. Assumes that
+def area_plot(profile, output_dir, number_of_features=MAX_DATA_POINTS, rank_by="overall", 
+              sample_order="abundance", dist_type="braycurtis", raster=None, output=None):
+    """ Create an area plot image of the attributes on this data. Assumes that
     the data is already normalized. 
 
     Args:
         profile: metagenomic profile instance.
-        output_dir: output directory where png will be saved.
-    
-    Raises:
-        ValueError: if the number of attributes is greater than MAX_DATA_POINTS.
+        output_dir: output directory where the image will be saved.
+        number_of_features (int, default=MAX_DATA_POINTS): number of attributes to plot,
+            the remaining attributes are summed into "Other".
+        rank_by (str, default="overall"): rank attributes by mean abundance "overall" or 
+            by their highest mean abundance in a "class".
+        sample_order (str, default="abundance"): order samples within a class by their most 
+            abundant attribute ("abundance") or by hierarchical clustering ("cluster").
+        dist_type (str, default="braycurtis"): distance metric used for clustering.
+        raster (bool, default=None): draw the plot as a single image instead of bars. By default
+            only profiles with more than RASTER_SAMPLES samples are drawn as an image.
+        output (dict, default=None): output options of the test block, see rendering.save_figure.
         
     Returns:
         path to output image
     """
     
-    plt.clf()
+    df = __top_features(profile, number_of_features, rank_by)
+    colors = __generate_colors(len(df.columns))
     
-    df = profile.abundance_data
-    if len(df.columns) > MAX_DATA_POINTS:
-        raise ValueError("Too many attributes to generate area plot.")
+    if raster is None:
+        raster = len(profile.abundance_data.index) > RASTER_SAMPLES
     
-    col_label = __sort_for_plot(df)
-    df.sort(columns=col_label, axis=0, inplace=True)
-    colors = __generate_colors(len(df.columns))
+    fname = rendering.plot_file(output_dir, "area_plot", output)
+    
+    # colors beyond the palette are random, so a plot is only reused with the same colors
+    cache_key = render_cache.key("area_plot", df, colors[:len(df.columns)], profile.references, sample_order, raster, 
+                                 rendering.relative_path(fname), output,
+                                 (profile.abundance_data, dist_type) if sample_order == "cluster" else None)
+    if render_cache.fetch(cache_key, [fname]):
+        return fname
+    
+    fig = rendering.new_figure()
+    ax = fig.add_subplot(111)
     
-    lgd_labels = __plot_bars(profile, colors)[0]
+    dpi = RASTER_DPI if raster else 400
+    if output is not None and output["dpi"] is not None:
+        dpi = output["dpi"]
+    
+    if raster:
+        lgd_labels = __plot_raster(ax, df, profile.references, colors, dpi, sample_order=sample_order, 
+                                   data=profile.abundance_data, dist_type=dist_type)
+    else:
+        lgd_labels = __plot_bars(ax, df, profile.references, colors, sample_order=sample_order, 
+                                 data=profile.abundance_data, dist_type=dist_type)
 
-    ticks = __get_xticks(profile)
+    ticks = __get_xticks(ax, profile)
 
-    plt.xticks(ticks, list(profile.references.keys()))
+    ax.set_xticks(ticks)
+    ax.set_xticklabels(list(profile.references.keys()))
 
-    plt.xlim(0, len(profile.abundance_data.index)*WIDTH)
-    plt.ylim(0, 1)
+    ax.set_xlim(0, len(profile.abundance_data.index)*WIDTH + WIDTH*(len(list(profile.references.keys())) - 1)) # last part of sum to account for separating line
+    ax.set_ylim(0, 1)
 
-    plt.xlabel("Samples")
-    plt.ylabel("Relative Abundance")
+    ax.set_xlabel("Samples")
+    ax.set_ylabel("Relative Abundance")
 
-    lgd = plt.legend(title="Features", handles=list(lgd_labels.values()),
-                     loc='upper center', bbox_to_anchor=(0.5, -0.1), ncol=2,
-                     fontsize=8)
+    lgd = ax.legend(title="Features", handles=list(lgd_labels.values()),
+                    loc='upper center', bbox_to_anchor=(0.5, -0.1), ncol=2,
+                    fontsize=8)
+    
+    rendering.save_figure(fig, fname, output, dpi=dpi, 
+                          bbox_extra_artists=(lgd,), bbox_inches='tight')
     
-    fname = output_dir + "/" + "area_plot.png"
-    plt.savefig(fname, bbox_extra_artists=(lgd,),
-                bbox_inches='tight', dpi=(400), figsize=(24,24))
+    render_cache.store(cache_key, [fname])
                 
     return fname
     
-def area_plot_interactive(profile, output_dir):
+def area_plot_interactive(profile, output_dir, number_of_features=MAX_DATA_POINTS, rank_by="overall", 
+                          sample_order="abundance", dist_type="braycurtis"):
     """ Create an interactive area plot of the attributes on this data.
-    Assumes that the data is already normalized. 
+    Assumes that the data is already normalized. The composition matrix is saved 
+    once as a compact JSON payload and drawn on a canvas in the browser, with the 
+    sample, attribute and abundance shown on hover.
 
     Args:
         profile: a metagenomic profile instance.
         output_dir: output directory to save html file. 
+        number_of_features (int, default=MAX_DATA_POINTS): number of attributes to plot,
+            the remaining attributes are summed into "Other".
+        rank_by (str, default="overall"): rank attributes by mean abundance "overall" or 
+            by their highest mean abundance in a "class".
+        sample_order (str, default="abundance"): order samples within a class by their most 
+            abundant attribute ("abundance") or by hierarchical clustering ("cluster").
+        dist_type (str, default="braycurtis"): distance metric used for clustering.
     
     Returns:
-        path to output, path to legend
-    
-    Raises:
-        ValueError: if the number of attributes is greater than MAX_DATA_POINTS.
+        path to output
     """
-    try:
-        import mpld3
-        import plugins
-    except ImportError:
-        print("Error: Could not import mpld3. Please install mpld3 or set 'interactive_plots' option to 'false.'")
-        sys.exit(0)
-        
-    plt.clf() 
-    plt.figure(figsize=(12,12))
-    
-    df = profile.abundance_data
-    if len(df.columns) > MAX_DATA_POINTS:
-        raise ValueError("Too many attributes to generate area plot.")
-    
-    # Do some sorting
-    col_label = __sort_for_plot(df)
-    df.sort(columns=col_label, axis=0, inplace=True)
+    df = __top_features(profile, number_of_features, rank_by)
     colors = __generate_colors(len(df.columns))
     
-    # Main plotting
-    lgd_labels, interactive_labels, ids = __plot_bars(profile, colors, interactive=True)
-    
-    plt.xticks([])    
-    
-    plt.xlim(0, len(profile.abundance_data.index)*WIDTH + WIDTH*(len(list(profile.references.keys())) - 1)) # last part of sum to account for separating line
-    plt.ylim(0, 1)
-    
-    # Padding for x and y labels 
-    ax = plt.gca()
-    ax.tick_params(axis='both', which='major', pad=15)
-    
-    plt.ylabel("Relative Abundance", fontsize=16)
-    
-    # add plugins
-    fig = plt.gcf()
-
-    # plugin for labels on bar plot
-    mpld3.plugins.connect(fig, plugins.BarLabelToolTip(ids, interactive_labels))
-    
-    # plugin to unhide toolbar        
-    mpld3.plugins.connect(fig, plugins.TweakToolbar()) 
-    
     fname = output_dir + "/" + "area_plot_interactive.html"
-    mpld3.save_html(plt.gcf(), fname)
-    
-    lgd_fig = plt.figure(figsize=(10,8))
-
-    # save legend as separate feature
-    lf = lgd_fig.legend(title="Features", handles=list(lgd_labels.values()),
-                        labels=list(lgd_labels.keys()), loc="center", ncol=2, fontsize=12)
-    
-    lf.get_frame().set_linewidth(0.0) # remove box around legend
     
-    lgd_fig.canvas.draw()
+    cache_key = render_cache.key("area_plot_interactive", df, colors[:len(df.columns)], profile.references, sample_order, 
+                                 rendering.relative_path(fname),
+                                 (profile.abundance_data, dist_type) if sample_order == "cluster" else None)
+    if render_cache.fetch(cache_key, [fname]):
+        return fname
+    
+    values, samples, attributes = __stack(df, profile.references, sample_order=sample_order, 
+                                          data=profile.abundance_data, dist_type=dist_type)
+    payload = __payload(values, samples, attributes, profile.references, colors)
+    
+    plot_id = "area_" + hashlib.md5(rendering.relative_path(fname).encode("utf-8")).hexdigest()[:8]
+    
+    with timing.timed("save", fname):
+        f = open(fname, 'w')
+        f.write('<div style="position:relative; width:' + str(INTERACTIVE_SIZE[0]) + 'px; margin:auto">\n')
+        f.write('<div style="font-size:14px">Relative Abundance (scroll to zoom, double click to reset)</div>\n')
+        f.write('<canvas id="' + plot_id + '_canvas" width="' + str(INTERACTIVE_SIZE[0]) + '" height="' + 
+                str(INTERACTIVE_SIZE[1]) + '"></canvas>\n')
+        f.write('<div id="' + plot_id + '_tip" style="position:absolute; display:none; pointer-events:none; ' + 
+                'background:white; border:1px solid gray; padding:2px 4px; font-size:12px"></div>\n')
+        
+        # legend
+        f.write('<div style="font-size:12px; columns:2">\n')
+        for attribute, color in reversed(list(zip(attributes, colors))):
+            f.write('<div><span style="display:inline-block; width:12px; height:12px; background:' + 
+                    rgb2hex(colorConverter.to_rgb(color)) + '"></span> ' + str(attribute) + '</div>\n')
+        f.write('</div>\n')
         
-    lgd_fname = output_dir + "/" + "legend.png"
-    lgd_fig.savefig(lgd_fname, bbox_inches=lf.get_window_extent().transformed(lgd_fig.dpi_scale_trans.inverted()))
+        f.write('<script type="application/json" id="' + plot_id + '_data">' + payload + '</script>\n')
+        f.write(generate_html.shared_script("areaPlot", AREA_PLOT_JS))
+        f.write(generate_html.run_script(plot_id + "_canvas", "areaPlot", [plot_id]))
+        f.write('</div>\n')
+        f.close()
+    
+    render_cache.store(cache_key, [fname])
                 
-    return fname, lgd_fname
\ No newline at end of file
+    return fname
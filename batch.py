@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the comparative analysis of many parameters files in one process, so the packages
+are imported once and data shared by the files is read, filtered, normalized and
+compared once. The parameters files are listed in a manifest, one path per line:
+
+    python batch.py manifest.txt
+
+Blank lines and lines starting with "#" are skipped. Each file gets its own results
+folder, as if it was run on its own, and a summary of all runs is printed at the end.
+"""
+
+# General imports
+from sys import argv
+
+# Internal imports
+import bounded_cache
+import comparative_analysis
+
+MAX_STAGE_BYTES = 1024 * 1024 * 1024 # Memory budget of the stages kept between parameters files.
+
+# Helper methods
+
+def __read_manifest(fname):
+    """ Return the paths of the parameters files listed in a manifest.
+    """
+    with open(fname) as f:
+        lines = [line.strip() for line in f]
+    return [line for line in lines if line != "" and line[0] != "#"]
+
+def __print_summary(summaries):
+    """ Print one line for each parameters file and the totals of the batch.
+
+    Args:
+        summaries (list): (parameters file, summary of its run or None if it failed), as
+            returned by run.
+    """
+    print("Batch complete.")
+    finished = [s for f, s in summaries if s is not None]
+    for f, s in summaries:
+        if s is None:
+            print((f + ": failed."))
+        else:
+            print((f + ": " + str(s["finished"]) + " of " + str(s["blocks"]) + " test blocks finished in %.1f seconds" % s["seconds"] +
+                   ", " + str(s["saved"]) + " plot files saved, " + str(s["cached"]) + " reused. Output saved at " + s["output"]))
+    print((str(len(finished)) + " of " + str(len(summaries)) + " parameters files finished in %.1f seconds" % sum(s["seconds"] for s in finished) +
+           ": " + str(sum(s["finished"] for s in finished)) + " of " + str(sum(s["blocks"] for s in finished)) + " test blocks finished, " +
+           str(sum(s["saved"] for s in finished)) + " plot files saved, " + str(sum(s["cached"] for s in finished)) +
+           " reused from the render cache, %.1f MB of memory saved by sharing data." % (sum(s["shared"] for s in finished) / 1048576.0)))
+
+# Public methods
+
+def run(filenames):
+    """ Run the comparative analysis of each parameters file, one after the other. Data read,
+    normalized and compared for one file is reused by the files after it (see scheduler),
+    as are the distance matrices and PCoA fits. Once a file has finished, the stages used
+    least recently are dropped until the rest fit in MAX_STAGE_BYTES. A file that fails
+    is reported and the others still run.
+
+    Args:
+        filenames (list[str]): paths to the parameters files.
+
+    Returns:
+        List of (parameters file, summary of its run or None if it failed). See
+        comparative_analysis.run for the summary.
+    """
+    stages = bounded_cache.bounded_cache(MAX_STAGE_BYTES)
+    summaries = list()
+    for i, f in enumerate(filenames):
+        print(("Running " + f + " (" + str(i + 1) + " of " + str(len(filenames)) + ")."))
+        try:
+            # a run reads its stages back after adding others, so none are dropped until it ends
+            with stages.hold():
+                summary = comparative_analysis.run(f, stages=stages)
+        except SystemExit: # invalid parameters file, reported by check_parameters
+            summary = None
+        except Exception as e:
+            print(("Warning: " + f + " failed: " + repr(e)))
+            summary = None
+        summaries.append((f, summary))
+    return summaries
+
+def main():
+    """ Main script for running a batch of parameters files from the command line.
+    """
+    script, manifest = argv
+    __print_summary(run(__read_manifest(manifest)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Bootstrap stability of a PCoA or PCA. Samples or features are resampled, each
+replicate is ordinated in a worker process and aligned to the reference
+ordination with a Procrustes rotation. The spread of the aligned replicates
+gives confidence ellipses for the samples and intervals for the variance
+explained by each axis.
+"""
+
+# General imports
+import multiprocessing
+
+# Specific imports that must be pre-installed
+import numpy as np
+from scipy.linalg import orthogonal_procrustes
+from sklearn.metrics.pairwise import pairwise_distances
+
+# Internal imports
+from ordination import gower_matrix
+
+CHI2_95 = 5.991 # 95% quantile of the chi-squared distribution with 2 degrees of freedom
+
+# data shared by the replicates, set once per worker process
+__worker_state = dict()
+
+# Helper methods
+
+def __init_worker(values, dist_matrix, reference, dist_type, by):
+    """ Store the data for this bootstrap in the worker process.
+
+    Args:
+        values (numpy.ndarray): samples x features abundance matrix.
+        dist_matrix (numpy.ndarray): distances between all samples.
+        reference (numpy.ndarray): samples x 2 reference coordinates.
+        dist_type (str): distance metric ("euclidean" for a PCA).
+        by (str): "samples" or "features", what is resampled.
+    """
+    __worker_state["values"] = values
+    __worker_state["dist_matrix"] = dist_matrix
+    __worker_state["reference"] = reference
+    __worker_state["dist_type"] = dist_type
+    __worker_state["by"] = by
+
+def __principal_coordinates(dist_matrix):
+    """ First two principal coordinates of a distance matrix.
+
+    Returns:
+        Tuple (n x 2 coordinates, fraction of the variance on each of the two axes).
+    """
+    eig_vals, eig_vecs = np.linalg.eigh(gower_matrix(dist_matrix)[0])
+    eig_vals, eig_vecs = eig_vals[::-1], eig_vecs[:, ::-1]
+    positive = eig_vals[eig_vals > 0]
+
+    coords = eig_vecs[:, :2] * np.sqrt(np.clip(eig_vals[:2], 0, None))
+
+    return coords, eig_vals[:2] / positive.sum()
+
+def __replicate(seed):
+    """ Ordinate one bootstrap replicate and align it to the reference.
+
+    Resampled samples are drawn with replacement and a sample drawn k times is kept
+    k times, so its weight in the replicate's ordination is k. The replicate's distance
+    matrix is taken from the full (cached) distance matrix; copies of a sample are at
+    distance 0 from each other and get the same coordinates. Resampled features are
+    drawn with replacement and the distances recomputed.
+
+    Args:
+        seed (int): seed for the resampling.
+
+    Returns:
+        Tuple (indices of the samples in the replicate, aligned coordinates of those
+        samples, fraction of the variance on each of the two axes).
+    """
+    values = __worker_state["values"]
+    reference = __worker_state["reference"]
+    n, p = values.shape
+    rng = np.random.RandomState(seed)
+
+    if __worker_state["by"] == "samples":
+        draws = np.sort(rng.randint(0, n, n))
+        dist_matrix = __worker_state["dist_matrix"][draws][:, draws]
+    else:
+        draws = np.arange(n)
+        dist_matrix = pairwise_distances(values[:, rng.randint(0, p, p)], metric=__worker_state["dist_type"])
+
+    coords, variance = __principal_coordinates(dist_matrix)
+
+    # rotate/reflect onto the reference positions of the same samples, copies included
+    target = reference[draws]
+    coords = coords - coords.mean(axis=0)
+    rotation = orthogonal_procrustes(coords, target - target.mean(axis=0))[0]
+    coords = coords.dot(rotation) + target.mean(axis=0)
+
+    idx, first = np.unique(draws, return_index=True)
+
+    return idx, coords[first], variance
+
+# Public methods
+
+def bootstrap(values, dist_matrix, reference, dist_type, replicates=100, by="samples", workers=None, seed=None):
+    """ Run a bootstrap of a PCoA (or of a PCA, as a PCoA with Euclidean distances).
+
+    Args:
+        values (numpy.ndarray): samples x features abundance matrix.
+        dist_matrix (numpy.ndarray): distances between all samples, reused when samples are resampled.
+        reference (numpy.ndarray): samples x 2 coordinates of the reference ordination.
+        dist_type (str): distance metric.
+        replicates (int, default=100): number of bootstrap replicates.
+        by (str, default="samples"): resample "samples" or "features".
+        workers (int, default=None): number of processes. Defaults to the number of cores.
+        seed (int, default=None): seed for the resampling.
+
+    Returns:
+        Tuple (replicates x samples x 2 array of aligned coordinates, NaN where a sample was
+        not drawn; replicates x 2 array of the fraction of variance on each axis).
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    seeds = np.random.RandomState(seed).randint(0, 2**31 - 1, size=replicates)
+    state = (values, dist_matrix, reference, dist_type, by)
+
+    if workers <= 1:
+        __init_worker(*state)
+        results = [__replicate(s) for s in seeds]
+    else:
+        pool = multiprocessing.Pool(min(workers, replicates), initializer=__init_worker, initargs=state)
+        try:
+            results = pool.map(__replicate, seeds)
+        finally:
+            pool.close()
+            pool.join()
+
+    coords = np.full((replicates, values.shape[0], 2), np.nan)
+    variance = np.zeros((replicates, 2))
+    for b, (idx, aligned, var) in enumerate(results):
+        coords[b, idx] = aligned
+        variance[b] = var
+
+    return coords, variance
+
+def confidence_ellipses(coords):
+    """ 95% confidence ellipse of each sample's replicate positions.
+
+    Args:
+        coords (numpy.ndarray): replicates x samples x 2 aligned coordinates (NaN if absent).
+
+    Returns:
+        samples x 5 array of (center x, center y, width, height, angle in degrees).
+        Rows are NaN for samples drawn in fewer than 3 replicates.
+    """
+    n = coords.shape[1]
+    result = np.full((n, 5), np.nan)
+
+    present = ~np.isnan(coords[:, :, 0])
+    counts = present.sum(axis=0)
+    centers = np.nanmean(np.where(present[:, :, np.newaxis], coords, np.nan), axis=0)
+
+    # per-sample 2 x 2 covariance, computed for all samples at once
+    dev = np.where(present[:, :, np.newaxis], coords - centers, 0)
+    cov = np.einsum('bni,bnj->nij', dev, dev) / np.maximum(counts - 1, 1)[:, np.newaxis, np.newaxis]
+
+    eig_vals, eig_vecs = np.linalg.eigh(cov)
+    eig_vals = np.clip(eig_vals, 0, None)
+
+    enough = counts >= 3
+    result[enough, 0:2] = centers[enough]
+    result[enough, 2] = 2 * np.sqrt(CHI2_95 * eig_vals[enough, 1])
+    result[enough, 3] = 2 * np.sqrt(CHI2_95 * eig_vals[enough, 0])
+    result[enough, 4] = np.degrees(np.arctan2(eig_vecs[enough, 1, 1], eig_vecs[enough, 0, 1]))
+
+    return result
\ No newline at end of file
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Caches that live for the whole process, such as the distance matrices, PCoA and NMDS
+fits and the stages shared by the parameters files of a batch, are kept within a
+memory budget. When a cache holds more than its budget, the entries used least
+recently are dropped and computed again if they are needed later.
+"""
+
+# General imports
+import collections
+import contextlib
+
+# specific imports that must be pre-installed
+import numpy as np
+import pandas as pd
+
+# Public methods
+
+def nbytes(value):
+    """ Estimate the memory held by the arrays in a value.
+
+    Args:
+        value: numpy array, DataFrame, tuple or list of these, or an object holding them
+            in its attributes.
+
+    Returns:
+        Number of bytes. Values that hold no arrays count as 0.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True))
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(v) for v in value)
+    if hasattr(value, "__dict__"):
+        return sum(nbytes(v) for v in vars(value).values())
+    return 0
+
+class bounded_cache(object):
+    """ A dictionary that drops its least recently used entries when they hold more than
+    max_bytes. The entry added last is always kept, even if it is larger than the budget.
+
+    Attributes:
+        max_bytes (int): memory budget of the cache, or None for no limit.
+        size (int): bytes held by the entries, see nbytes.
+        entries (collections.OrderedDict): the entries, least recently used first.
+        sizes (dict): bytes held by each entry.
+        held (int): number of with-statements of hold the cache is in. It is not trimmed
+            while this is above 0.
+    """
+
+    def __init__(self, max_bytes):
+        """ Create a new, empty bounded_cache.
+
+        Args:
+            max_bytes (int): memory budget of the cache, or None for no limit.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.sizes = dict()
+        self.held = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, key):
+        """ Return an entry and mark it as the most recently used.
+        """
+        value = self.entries[key]
+        self.entries.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        """ Add or replace an entry, then drop the least recently used entries that do not
+        fit in the budget.
+        """
+        if key in self.entries:
+            self.size -= self.sizes[key]
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        self.sizes[key] = nbytes(value)
+        self.size += self.sizes[key]
+        self.trim()
+
+    def get(self, key, default=None):
+        return self[key] if key in self.entries else default
+
+    def keys(self):
+        return self.entries.keys()
+
+    def clear(self):
+        self.entries.clear()
+        self.sizes.clear()
+        self.size = 0
+
+    def trim(self):
+        """ Drop the least recently used entries until the rest fit in the budget. Does
+        nothing inside a with-statement of hold.
+        """
+        while self.held == 0 and self.max_bytes is not None and self.size > self.max_bytes and len(self.entries) > 1:
+            key, value = self.entries.popitem(last=False)
+            self.size -= self.sizes.pop(key)
+
+    @contextlib.contextmanager
+    def hold(self):
+        """ Keep every entry until the end of this with-statement, for callers that read
+        entries back after adding others. The cache is trimmed at the end.
+        """
+        self.held += 1
+        try:
+            yield self
+        finally:
+            self.held -= 1
+            self.trim()
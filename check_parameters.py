@@ -11,6 +11,7 @@ Reads and parses the parameter file.
 import os
 import sys
 import test_block
+import rendering
 import string 
 import datetime
 
@@ -20,7 +21,7 @@ supported_distance_metrics = ["cityblock", "cosine", "euclidean", "braycurtis",
                               "rogerstanimoto", "seuclidean", "sokalmichener", 
                               "sokalsneath", "sqeuclidean"]
                               
-supported_test_types = ["pcoa", "pca", "area_plot", "enrichment"]
+supported_test_types = ["pcoa", "multi_pcoa", "nmds", "pca", "area_plot", "enrichment", "permanova", "permdisp"]
 
 supported_enrichment_tests = ["ttest", "ranksums"]
 
@@ -55,6 +56,30 @@ def __string_to_dict(s, int_keys=True):
     except: 
         raise ValueError("Invalid input. Dictionary could not be parsed.")
 
+def __check_output_options(params):
+    """ Checks the plot_format, dpi and max_file_size options of the general parameters
+    or of a test block.
+    
+    Args:
+        params (dict): general parameters or parameters of a test block.
+    Effects:
+        Prints a warning and falls back to png if the installed matplotlib cannot save
+        plots in this format.
+    Returns:
+        Error message, or None if the options are valid.
+    """
+    if "plot_format" in params:
+        if params["plot_format"] not in rendering.FORMATS:
+            return "Unknown plot_format '" + params["plot_format"] + "'. Options: " + ", ".join(rendering.FORMATS) + "."
+        if params["plot_format"] not in rendering.supported_formats():
+            print(("Warning: plot_format '" + params["plot_format"] + "' is not supported by the installed matplotlib. " + 
+                   "Plots are saved as png."))
+            params["plot_format"] = "png"
+    for option in ["dpi", "max_file_size"]:
+        if option in params and params[option] < 1:
+            return "Invalid " + option + ": " + str(params[option]) + "."
+    return None
+
 def __check_general_parameters(gen_params):
     """Checks if the file names are valid and the necessary parameter options
     are included.
@@ -90,6 +115,11 @@ def __check_general_parameters(gen_params):
         if e not in gen_params: 
             print(("Error: Expected "  + e + " in parameters. Please include " + e + " in parameters file."))
             sys.exit(0)
+            
+    error = __check_output_options(gen_params)
+    if error is not None:
+        print(("Error: " + error))
+        sys.exit(0)
 
 def __check_test(test_block):
     """ Checks that the test block is created correctly 
@@ -102,6 +132,10 @@ def __check_test(test_block):
         True/False
     """
     test_type = test_block.params["test_type"]
+    error = __check_output_options(test_block.params)
+    if error is not None:
+        print(("Warning: Could not run test '" + test_block.params["test_name"] + "'. " + error))
+        return False
     if test_type == "pcoa":
         if "distance_metric" not in test_block.params:
             print("Warning: Could not create PCoA plot. Distance metric not specified.")
@@ -109,6 +143,51 @@ def __check_test(test_block):
         elif test_block.params["distance_metric"] not in supported_distance_metrics:
             print(("Warning: Could not create PCoA plot. Distance metric '" + test_block.params["distance_metric"] + "' not supported."))
             return False
+    if test_type == "nmds":
+        if "distance_metric" not in test_block.params:
+            print("Warning: Could not create NMDS plot. Distance metric not specified.")
+            return False
+        elif test_block.params["distance_metric"] not in supported_distance_metrics:
+            print(("Warning: Could not create NMDS plot. Distance metric '" + test_block.params["distance_metric"] + "' not supported."))
+            return False
+        if "starts" not in test_block.params:
+            test_block.params["starts"] = 20
+        elif test_block.params["starts"] < 1:
+            print(("Warning: Could not create NMDS plot. Invalid number of starts: " + str(test_block.params["starts"])))
+            return False
+    if test_type == "multi_pcoa":
+        if "distance_metrics" not in test_block.params:
+            print("Warning: Could not create PCoA plots. Distance metrics not specified.")
+            return False
+        metrics = [m.strip() for m in test_block.params["distance_metrics"].split(",") if m.strip() != ""]
+        for m in metrics:
+            if m not in supported_distance_metrics:
+                print(("Warning: Could not create PCoA plots. Distance metric '" + m + "' not supported."))
+                return False
+        if len(metrics) < 2:
+            print("Warning: Could not create PCoA plots. At least two distance metrics are needed to compare them.")
+            return False
+        test_block.params["distance_metrics"] = metrics
+        if "permutations" not in test_block.params:
+            test_block.params["permutations"] = 999
+        elif test_block.params["permutations"] < 1:
+            print(("Warning: Could not create PCoA plots. Invalid number of permutations: " + str(test_block.params["permutations"])))
+            return False
+    if test_type == "pcoa" or test_type == "pca":
+        if "reference_ordination" in test_block.params and not os.path.isfile(test_block.params["reference_ordination"]):
+            print(("Warning: Could not create " + test_type.upper() + " plot. Reference ordination '" + 
+                   test_block.params["reference_ordination"] + "' not found."))
+            return False
+        if "bootstrap" in test_block.params and test_block.params["bootstrap"] < 2:
+            print(("Warning: Could not create " + test_type.upper() + " plot. Invalid number of bootstrap replicates: " + 
+                   str(test_block.params["bootstrap"])))
+            return False
+        if "bootstrap_by" not in test_block.params:
+            test_block.params["bootstrap_by"] = "samples"
+        elif test_block.params["bootstrap_by"] not in ["samples", "features"]:
+            print(("Warning: Could not create " + test_type.upper() + " plot. Unknown bootstrap_by option '" + 
+                   test_block.params["bootstrap_by"] + "'. Options: samples, features."))
+            return False
     if test_type == "pca":
         if "number_of_loadings" not in test_block.params:
             test_block.params["number_of_loadings"] = 0
@@ -116,6 +195,47 @@ def __check_test(test_block):
         elif test_block.params["number_of_loadings"] < 0 or test_block.params["number_of_loadings"] > 5:
             print(("Warning: Could not create PCA plot. Invalid number of loadings: " + str(test_block.params["number_of_loadings"])))
             return False
+    if test_type == "permanova" or test_type == "permdisp":
+        if "distance_metric" not in test_block.params:
+            print(("Warning: Could not perform " + test_type.upper() + " test. Distance metric not specified."))
+            return False
+        elif test_block.params["distance_metric"] not in supported_distance_metrics:
+            print(("Warning: Could not perform " + test_type.upper() + " test. Distance metric '" + test_block.params["distance_metric"] + "' not supported."))
+            return False
+        if "permutations" not in test_block.params:
+            test_block.params["permutations"] = 999
+        elif test_block.params["permutations"] < 1:
+            print(("Warning: Could not perform " + test_type.upper() + " test. Invalid number of permutations: " + str(test_block.params["permutations"])))
+            return False
+    if test_type == "area_plot":
+        if "number_of_features" not in test_block.params:
+            test_block.params["number_of_features"] = 20
+        elif test_block.params["number_of_features"] < 1:
+            print(("Warning: Could not create area plot. Invalid number of features: " + str(test_block.params["number_of_features"])))
+            return False
+        if "rank_features_by" not in test_block.params:
+            test_block.params["rank_features_by"] = "overall"
+        elif test_block.params["rank_features_by"] not in ["overall", "class"]:
+            print(("Warning: Could not create area plot. Unknown rank_features_by option '" + 
+                   test_block.params["rank_features_by"] + "'. Options: overall, class."))
+            return False
+        if "sample_order" not in test_block.params:
+            test_block.params["sample_order"] = "abundance"
+        elif test_block.params["sample_order"] not in ["abundance", "cluster"]:
+            print(("Warning: Could not create area plot. Unknown sample_order option '" + 
+                   test_block.params["sample_order"] + "'. Options: abundance, cluster."))
+            return False
+        if "raster" not in test_block.params:
+            test_block.params["raster"] = "auto"
+        elif test_block.params["raster"] not in ["auto", "true", "false"]:
+            print(("Warning: Could not create area plot. Unknown raster option '" +
+                   test_block.params["raster"] + "'. Options: auto, true, false."))
+            return False
+        if "distance_metric" not in test_block.params:
+            test_block.params["distance_metric"] = "braycurtis"
+        elif test_block.params["distance_metric"] not in supported_distance_metrics:
+            print(("Warning: Could not create area plot. Distance metric '" + test_block.params["distance_metric"] + "' not supported."))
+            return False
     if test_type == "enrichment":
         if "test" not in test_block.params:
             print("Warning: Could not perform enrichment test. Enrichment test not specified.")
@@ -131,13 +251,16 @@ def __check_test(test_block):
     
     return True
 
-def __create_output_dir():
-    """ Return a string representing the output directory for the results.
+def __create_output_dir(parent):
+    """ Create a new folder for the results and return its name.
+    
+    Args:
+        parent (str): directory to create the folder in.
     """
     today = datetime.datetime.now()
     dirname = "comparative analysis results "
     dirname += "{0}-{1}-{2}-{3}.{4}.{5}".format(today.month, today.day, today.year, today.hour, today.minute, today.second)
-    os.mkdir(dirname)    
+    os.mkdir(parent + "/" + dirname)    
     return dirname
 
 def __name_tests(result):
@@ -202,13 +325,24 @@ def parse(filename):
                     if line[1].rstrip() == "current":
                         general_parameters[line[0]] = os.getcwd()
                     elif os.path.isdir(line[1].rstrip()):
-                        general_parameters[line[0]] = line[1].rstrip()
+                        general_parameters[line[0]] = os.path.abspath(line[1].rstrip())
                     else:
                         print(("Error: Could not find directory '" + line[1].rstrip() + ".' Please check that directory is correct."))
                         sys.exit(0)
-                    general_parameters[line[0]] += "/" + __create_output_dir()
                 elif line[0] == "class_label" and (line[1].rstrip().lower() == "n/a" or line[1].rstrip().lower() == ""):
                     general_parameters[line[0]] = None
+                elif line[0] == "cache_directory":
+                    general_parameters[line[0]] = os.path.abspath(line[1].rstrip())
+                elif line[0] == "resume":
+                    if not os.path.isdir(line[1].rstrip()):
+                        print(("Error: Could not find results directory '" + line[1].rstrip() + "' to resume. Please check that directory is correct."))
+                        sys.exit(0)
+                    general_parameters[line[0]] = os.path.abspath(line[1].rstrip())
+                elif line[0] in ["workers", "dpi", "max_file_size"]:
+                    try:
+                        general_parameters[line[0]] = int(line[1])
+                    except ValueError:
+                        print(("Warning: Must specify integer value for '" + line[0] + "' (line " + str(line_number) + ")."))
                 elif line[0] != "title" and line[0] != "class_names" and line[0] != "test_type":
                     try:
                         general_parameters[line[0]] = line[1].rstrip().lower()
@@ -248,6 +382,12 @@ def parse(filename):
                     except ValueError:
                         print("Warning: Must specify integer value for 'number_of_loadings' in PCA test.")
                         test_params[line[0]] = 0
+                elif line[0] in ["permutations", "seed", "workers", "starts", "bootstrap", "number_of_features", 
+                                 "dpi", "max_file_size"]:
+                    try:
+                        test_params[line[0]] = int(line[1])
+                    except ValueError:
+                        print(("Warning: Must specify integer value for '" + line[0] + "' (line " + str(line_number) + ")."))
                 elif line[0] == "class_label" and line[1] == "n/a":
                     test_params[line[0]] = None
                 elif line[0] == "class_names":
@@ -277,6 +417,8 @@ def parse(filename):
                     test_params[line[0]] = list(line[1].rstrip().split(","))
                 elif line[0] == "test_name":
                     test_params[line[0]] = line[1].rstrip()
+                elif line[0] == "reference_ordination":
+                    test_params[line[0]] = os.path.abspath(line[1].rstrip())
                 else:
                     test_params[line[0]] = line[1].lower().rstrip()
                 
@@ -296,6 +438,12 @@ def parse(filename):
     __name_tests(result)    
     
     __check_general_parameters(general_parameters)
+    
+    # results go to a new folder, or to the folder of the run being resumed
+    if "resume" in general_parameters:
+        general_parameters["output_directory"] = general_parameters["resume"]
+    else:
+        general_parameters["output_directory"] += "/" + __create_output_dir(general_parameters["output_directory"])
 
     final_result = list()
 
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoints of finished test blocks, so a run that stopped part way can be resumed.
+When a block finishes, its result is saved in its folder along with a fingerprint of
+everything that went into it: its parameters, the general parameters, the contents
+of the input files and the version of the code. A resumed run reuses the result of
+every block whose fingerprint is unchanged, together with the files in its folder, and
+runs only the other blocks. Results are saved as JSON holding the paths to their
+files and their text, so reading a checkpoint never runs code from the resumed folder.
+"""
+
+# General imports
+import glob
+import hashlib
+import json
+import os
+import shutil
+
+# Internal imports
+import render_cache
+import result
+
+CHECKPOINT_FILE = ".checkpoint"
+CHECKPOINT_VERSION = "2" # Change when the format of the checkpoint changes.
+
+# General parameters that do not change the output of a test block
+IGNORED = ["output_directory", "resume", "open_page", "to_html", "workers", "cache_directory"]
+
+# maps (path, size, modification time) of an input file to a hash of its contents
+__digests = dict()
+
+# Helper methods
+
+def __digest(path):
+    """ Hash the contents of an input file, or return None if there is no such file.
+    """
+    if path is None or not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if key not in __digests:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        __digests[key] = h.hexdigest()
+    return __digests[key]
+
+def __code_version():
+    """ Hash the source files of the package, so checkpoints saved by other code are not reused.
+    """
+    sources = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py")))
+    return [(os.path.basename(path), __digest(path)) for path in sources]
+
+def __block_dir(block):
+    """ Folder holding the output of a test block.
+    """
+    return block.gen_params["output_directory"] + "/" + block.get_name()
+
+# Public methods
+
+def fingerprint(block):
+    """ Hash everything that goes into a test block.
+
+    Args:
+        block: test_block instance.
+
+    Returns:
+        Hex digest identifying the block.
+    """
+    gen_params = dict((k, v) for k, v in block.gen_params.items() if k not in IGNORED)
+    files = [__digest(block.gen_params.get(name)) for name in ["abundance_data", "sample_metadata", "feature_metadata"]]
+    return render_cache.key("block", CHECKPOINT_VERSION, __code_version(), sorted(block.params.items()), 
+                            sorted(gen_params.items()), files, __digest(block.params.get("reference_ordination")))
+
+def load(block):
+    """ Return the result of this test block saved by an earlier run into the same folder.
+
+    Args:
+        block: test_block instance.
+
+    Returns:
+        Result instance, or None if the block has no checkpoint, its checkpoint cannot be
+        read, or its fingerprint changed.
+    """
+    path = __block_dir(block) + "/" + CHECKPOINT_FILE
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+        if saved["fingerprint"] != fingerprint(block) or saved["directory"] != __block_dir(block):
+            return None
+        return result.from_data(saved["result"])
+    except Exception:
+        return None
+
+def save(block, res):
+    """ Save the result of a finished test block in its folder. The checkpoint is written
+    under a temporary name and renamed, so a run stopped while writing it leaves no
+    partial checkpoint.
+
+    Args:
+        block: test_block instance.
+        res: result instance of the block.
+    """
+    path = __block_dir(block) + "/" + CHECKPOINT_FILE
+    with open(path + ".tmp", "w") as f:
+        json.dump({"fingerprint": fingerprint(block), "directory": __block_dir(block), "result": res.to_data()}, f)
+    os.replace(path + ".tmp", path)
+
+def clear(block):
+    """ Remove the output of an earlier run of this test block, if there is any, so its
+    folder only holds the output of the new run.
+
+    Args:
+        block: test_block instance.
+    """
+    if os.path.isdir(__block_dir(block)):
+        shutil.rmtree(__block_dir(block))
@@ -9,82 +9,49 @@ Main module for comparative analysis.
 
 # General imports 
 from sys import argv
-script, filename = argv
 import webbrowser
 import os
 import shutil 
+import time
 
 # Internal imports 
 from check_parameters import parse
-import metagenomic_profile as mgp
 import generate_html 
-import normalization 
+import scheduler
+import render_cache
+import timing
 
-def main():
-    """ Main script for running comparative analysis from the command line.
-    """    
+def run(filename, stages=None):
+    """ Run the comparative analysis of one parameters file.
     
-    tests, genparams = parse(filename)      
+    Args:
+        filename (str): path to the parameters file.
+        stages (dict, default=None): stages shared with earlier runs in this process, such 
+            as the data read and normalized for them (see scheduler). None to share nothing.
     
-    # dictionary to hold tests and test results
-    test_results = dict() 
+    Returns:
+        Dictionary summarizing the run: "output" (output directory), "blocks" (number of 
+        test blocks), "finished" (number of blocks that finished), "seconds" (time taken), 
+        "saved" and "cached" (plot files drawn and taken from the render cache) and 
+        "shared" (bytes saved by sharing profiles).
+    """    
+    start = time.time()
+    tests, genparams = parse(filename)      
     
-    abundance_sep = genparams['abundance_sep']
-    metadata_sep = genparams['metadata_sep']
-    abundance_data_path = genparams["abundance_data"]
-    metadata_path = genparams["sample_metadata"]
-    metadata_hdr = genparams["metadata_header"]
     output_dir = genparams["output_directory"]
-    lbl = genparams["class_label"]
-    class_names = genparams["class_names"]
-    
-    # give each test block a copy of the profile
-    
-    run_order = list()
-    
-    master_mp = mgp.metagenomic_profile(abundance_data_path, metadata_path, a_sep=abundance_sep, 
-                                     m_sep=metadata_sep, metadata_header=metadata_hdr, metadata_label=lbl,
-                                     class_names=class_names)
-                                     
-    if genparams["normalization"] == "relative":
-        normalization.relative_normalization(master_mp, output_dir)
-    elif genparams["normalization"] == "musicc":
-        normalization.musicc_normalization(master_mp, abundance_data_path, output_dir)        
-    
-    for tb in tests:
-         
-        tb_class_names = tb.params["class_names"] if "class_names" in list(tb.params.keys()) else genparams["class_names"] 
-        if "class_label" in tb.params:
-            lbl = tb.params["class_label"]
-        
-        rules = tb.params["filter_rules"] if "filter_rules" in tb.params else None
-        labels = tb.params["filter_labels"] if "filter_labels" in tb.params else None
-        mp = mgp.metagenomic_profile(abundance_data_path, metadata_path, a_sep=abundance_sep, 
-                                     m_sep=metadata_sep, metadata_header=metadata_hdr, metadata_label=lbl,
-                                     class_names=tb_class_names, filter_rules=rules, filter_labels=labels)
-                                     
-        if "feature_metadata" in list(genparams.keys()):
-            mp.add_feature_metadata(genparams["feature_metadata"])
-        tb.set_metagenomic_profile(mp)
-        
-        # work around for plug-in issues
-        if "area_plot" in tb.params:
-            run_order.insert(0, tb)
-        else:
-            run_order.append(tb)
     
     # Copy parameters file to new directory.
-    shutil.copyfile(filename, output_dir + "/" + filename)    
+    shutil.copyfile(filename, output_dir + "/" + os.path.basename(filename))    
     
-    os.chdir(output_dir)
+    # Reuse plots rendered by earlier runs
+    render_cache.configure(genparams.get("cache_directory"))
     
-    # Call run on each test.
-    for tb in run_order:
-        result = tb.run()
-        test_results[tb] = result
+    # The results page is written now and updated as each test block finishes
+    status = None
     try:
         if genparams["to_html"][0] == "t":    
-            results_web_page = generate_html.create_page(test_results, output_dir, filename, order=tests)
+            results_web_page = generate_html.start_page(tests, output_dir, filename)
+            status = generate_html.update_page
             try:            
                 if genparams["open_page"][0] == "t":
                     webbrowser.open(results_web_page)
@@ -92,10 +59,34 @@ def main():
                 print("Warning: HTML page could not be opened. Value for 'open_page' missing in parameters file.")
     except IndexError:
         print("Warning: HTML page could not be created. Value for 'to_html' missing in parameters file.")
+    
+    # Run the test blocks, sharing the stages they have in common. Plot blocks are rendered concurrently.
+    with timing.timed("all tests", output_dir):
+        test_results = scheduler.run(tests, genparams, status=status, stages=stages)
+            
+    if status is not None:
+        with timing.timed("html page", output_dir):
+            generate_html.finish_page()
         
+    # Time spent on each step
+    seconds, saved, cached, shared = timing.write(output_dir + "/timing.tab")
+    
     # Done
     print("Tests complete.")
+    print(("Saved " + str(saved) + " plot files in %.1f seconds" % seconds + (", reused " + str(cached) + " from the render cache" if cached else "") + 
+           ". Timings of each step are in timing.tab."))
+    if shared:
+        print(("Test blocks with the same filters and normalization shared their data, saving %.1f MB of memory." % (shared / 1048576.0)))
     print(("Output saved at " + genparams["output_directory"]))
+    
+    return {"output": output_dir, "blocks": len(tests), "finished": len(test_results), "seconds": time.time() - start, 
+            "saved": saved, "cached": cached, "shared": shared}
+
+def main():
+    """ Main script for running comparative analysis from the command line.
+    """
+    script, filename = argv
+    run(filename)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Class-ordered abundance matrices and pairwise distance matrices shared between
+test blocks. Distance matrices are cached on the content of the abundance data,
+so blocks that work on the same samples with the same metric compute it only once.
+The cache is kept within MAX_CACHE_BYTES, dropping the matrices used least recently.
+"""
+
+# General imports
+import hashlib
+import multiprocessing
+
+# specific imports that must be pre-installed
+import numpy as np
+import pandas as pd
+from sklearn.metrics.pairwise import pairwise_distances
+
+# Internal imports
+import bounded_cache
+
+MAX_CACHE_BYTES = 512 * 1024 * 1024 # Memory budget of the cached distance matrices.
+
+# maps (data fingerprint, metric) to a distance matrix, least recently used first
+__cache = bounded_cache.bounded_cache(MAX_CACHE_BYTES)
+
+# Helper methods
+
+def __pairwise(task):
+    """ Compute one distance matrix.
+
+    Args:
+        task: tuple (numpy.ndarray of abundance data, distance metric).
+
+    Returns:
+        n x n numpy array of distances.
+    """
+    values, dist_type = task
+    return pairwise_distances(values, metric=dist_type)
+
+# Public methods
+
+def fingerprint(df):
+    """ Hash the labels and values of this DataFrame.
+
+    Args:
+        df (pandas.DataFrame): abundance data.
+
+    Returns:
+        Hex digest identifying the contents of df.
+    """
+    h = hashlib.sha1()
+    h.update("\t".join(str(x) for x in df.index).encode("utf-8"))
+    h.update("\t".join(str(x) for x in df.columns).encode("utf-8"))
+    h.update(np.ascontiguousarray(df.values, dtype=float).tobytes())
+    return h.hexdigest()
+
+def partition_abundance_data(profile):
+    """Partition data by sample class.
+
+    Args:
+        profile (metagenomic_profile): profile to be partitioned.
+
+    Returns:
+        New partitioned DataFrame, samples of the same class are adjacent and
+        classes appear in the order of profile.references.
+    """
+    abundances_to_class = list()
+
+    for k in list(profile.references.keys()):
+        abundances_to_class.append(profile.abundance_data.loc[profile.references[k]])
+
+    return pd.concat(abundances_to_class)
+
+def class_codes(profile):
+    """ Integer class code of every sample in partitioned order.
+
+    Args:
+        profile (metagenomic_profile): profile instance.
+
+    Returns:
+        numpy array with the index of each sample's class in profile.references.
+    """
+    sizes = [len(profile.references[k]) for k in list(profile.references.keys())]
+    return np.repeat(np.arange(len(sizes)), sizes)
+
+def distance_matrices(data, dist_types, workers=None):
+    """ Pairwise distances between the rows of data for several metrics, cached on its
+    contents. Metrics that are not cached yet are computed concurrently.
+
+    Args:
+        data (pandas.DataFrame): samples x features abundance data.
+        dist_types (list[str]): distance metrics to use.
+        workers (int, default=None): number of processes to use. Defaults to the number of cores.
+
+    Returns:
+        List of n x n numpy arrays of distances, one per metric. The arrays are shared 
+        with other callers and must not be modified.
+    """
+    digest = fingerprint(data)
+    missing = [d for d in dist_types if (digest, d) not in __cache]
+    missing = sorted(set(missing), key=missing.index)
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    tasks = [(data.values, d) for d in missing]
+    if len(tasks) > 1 and workers > 1:
+        pool = multiprocessing.Pool(min(workers, len(tasks)))
+        try:
+            computed = pool.map(__pairwise, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        computed = [__pairwise(task) for task in tasks]
+
+    with __cache.hold():
+        for dist_type, dist in zip(missing, computed):
+            dist.setflags(write=False)
+            __cache[(digest, dist_type)] = dist
+        return [__cache[(digest, d)] for d in dist_types]
+
+def distance_matrix(data, dist_type):
+    """ Pairwise distances between the rows of data, cached on its contents.
+
+    Args:
+        data (pandas.DataFrame): samples x features abundance data.
+        dist_type (str): distance metric to use.
+
+    Returns:
+        n x n numpy array of distances. The array is shared with other callers and
+        must not be modified.
+    """
+    return distance_matrices(data, [dist_type], workers=1)[0]
+
+def profile_distance_matrix(profile, dist_type):
+    """ Pairwise distances between the samples of this profile in partitioned order.
+
+    Args:
+        profile (metagenomic_profile): profile instance containing data.
+        dist_type (str): distance metric to use.
+
+    Returns:
+        n x n numpy array of distances (read-only).
+    """
+    return distance_matrix(partition_abundance_data(profile), dist_type)
+
+def entries(data, dist_types):
+    """ Cached distance matrices of data, to be added to the cache of another process.
+
+    Args:
+        data (pandas.DataFrame): samples x features abundance data.
+        dist_types (list[str]): distance metrics.
+
+    Returns:
+        List of (key, distance matrix) for the metrics that are cached.
+    """
+    keys = [(fingerprint(data), d) for d in dist_types]
+    return [(k, __cache[k]) for k in keys if k in __cache]
+
+def add(cached):
+    """ Add distance matrices computed by another process, as returned by entries().
+    """
+    for k, dist in cached:
+        dist.setflags(write=False)
+        __cache[k] = dist
+
+def clear_cache():
+    """ Drop all cached distance matrices.
+    """
+    __cache.clear()
\ No newline at end of file
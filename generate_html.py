@@ -5,10 +5,58 @@ Created on Mon Jun 22 10:36:15 2015
 @author: Sierra Anderson
 
 Generate HTML file displaying comparative analysis results.
+
+Scripts shared by several results, such as the code drawing interactive plots, are
+written once at the end of the page. Each plot or table only carries its own data
+and is drawn when it scrolls into view.
+
+The page is written before the tests run and rewritten as each test block starts and
+finishes, so finished results can be looked at during a long run and are kept if a
+later block fails. Each finished section is saved to a file of its own, and sections and
+page are replaced as a whole so the page is never seen half written.
 """
 
 import datetime
 import string 
+import json
+import html
+import os
+import shutil
+
+REFRESH_SECONDS = 30 # The page reloads itself this often until all test blocks have finished.
+STATUS = {"pending": "Waiting to run.", "running": "Running...", "failed": "Failed: "} # Shown for unfinished blocks.
+
+# Page being written: order of the test blocks, status, result and section file of each block, shared scripts
+__page = dict()
+
+SHARED_SCRIPT = '<script data-shared="' # Start of the line opening a shared script in an html fragment.
+
+# Defined in the head of the page: plots and tables queue themselves until the page is loaded
+QUEUE_JS = """
+var whenVisible = [];
+var runWhenVisible = function(anchor, name, args) { whenVisible.push([anchor, name, args]); };
+"""
+
+# Written after the shared scripts: draws each queued plot or table once it is near the window
+START_JS = """
+(function() {
+  var queue = whenVisible;
+  function run(entry) { window[entry[1]].apply(null, entry[2]); }
+  runWhenVisible = function(anchor, name, args) { run([anchor, name, args]); };
+  if (!("IntersectionObserver" in window)) { queue.forEach(run); return; }
+  var observer = new IntersectionObserver(function(entries) {
+    entries.forEach(function(e) {
+      if (e.isIntersecting) { observer.unobserve(e.target); run(e.target.pending); }
+    });
+  }, {rootMargin: "1000px"});
+  queue.forEach(function(entry) {
+    var element = document.getElementById(entry[0]);
+    if (element === null) { run(entry); return; }
+    element.pending = entry;
+    observer.observe(element);
+  });
+})();
+"""
 
 # Helper methods
 
@@ -60,28 +108,6 @@ def __get_css(color_1="#CCFF66", color_2="#99CC00"):
         border: 5px solid ''' + color_2 + ''';
     }
     
-    /* make mpld3 toolbar buttons more visible */
-    
-    image.mpld3-resetbutton {
-        opacity: 0.9 !important;
-    }
-    
-    image.mpld3-zoombutton {
-        opacity: 0.9 !important;
-    }
-    
-    image.mpld3-boxzoombutton {
-        opacity: 0.9 !important;
-    }
-    
-    image.active {
-        opacity: 0.2 !important;
-    }
-    
-    image.pressed {
-        opacity: 0.2 !important;
-    }
-        
     /* for navigation bar links */
     
     a.nav:link {
@@ -152,6 +178,23 @@ def __get_css(color_1="#CCFF66", color_2="#99CC00"):
         width: 100%;
     }
     
+    div.table_scroll {
+        /* only the rows in view are drawn, see result.table_result */
+        display: inline-block;
+        max-height: 600px;
+        overflow-y: auto;
+    }
+    
+    p.status {
+        margin-left: 3cm;
+        font-style: italic;
+        color: gray;
+    }
+    
+    p.failed {
+        color: darkred;
+    }
+    
     div.interactive {
         display: block;
         width: 50%;
@@ -166,7 +209,8 @@ def __create_header(test_blocks, results):
     
     Args:
         test_blocks: list of test block instances (defines the order).
-        results: mapping of test blocks to their results.
+        results: mapping of test blocks to their results. Blocks without a result yet are
+            shown by their name.
         
     Returns:
         String representing the HTML for the navigation bar.
@@ -175,7 +219,8 @@ def __create_header(test_blocks, results):
     contents += '<th class="links"><a href="#top" class="nav">^</a></th>' # back to top button
     
     for test in test_blocks:    
-        contents += '<th class="links"><a href="#' + test.get_name() + '" class="nav">' + results[test].get_result_name() + '</a></th>'
+        name = results[test].get_result_name() if test in results else test.get_name()
+        contents += '<th class="links"><a href="#' + test.get_name() + '" class="nav">' + name + '</a></th>'
     
     contents += '</table></p></nav><div><a name="top"></a></div>'
     return contents
@@ -209,7 +254,200 @@ def __get_parameters_info(fname):
     """
     return 'Parameters used to generate results can be found <a href=' + fname + ' target="_blank">here.</a><br><br>'
     
+def __write_section(test, result):
+    """ Save the html of the section of a finished test block to a file of its own.
+    
+    Args:
+        test: test block instance.
+        result: result instance of this block.
+    """
+    fname = __page["sections_dir"] + "/" + str(__page["order"].index(test)) + ".html"
+    
+    f = open(fname + ".tmp", 'w')
+    out = page_writer(f, queue=False, base=os.path.dirname(__page["fname"]))
+    out.write('<a name="' + test.get_name() + '"></a><h2>' + result.get_result_name() + '</h2>')
+    result.write_html(out)
+    f.close()
+    os.replace(fname + ".tmp", fname)
+    
+    for name, script in out.scripts:
+        if name not in [n for n, s in __page["scripts"]]:
+            __page["scripts"].append((name, script))
+    __page["sections"][test] = fname
+    
+def __write_page(final=False):
+    """ Write the results page from the sections of the finished test blocks and the status of the others.
+    
+    Args:
+        final (default=False): if False, the page reloads itself every REFRESH_SECONDS.
+    """
+    order = __page["order"]
+    
+    f = open(__page["fname"] + ".tmp", 'w')
+    f.write('<!DOCTYPE html><html><head>')
+    if not final:
+        f.write('<meta http-equiv="refresh" content="' + str(REFRESH_SECONDS) + '">')
+    f.write(__get_css())
+    out = page_writer(f, base=os.path.dirname(__page["fname"]))
+    
+    out.write('<title>Results</title></head><body>' + __create_header(order, __page["results"]))
+    
+    # Experimenting with table stuff 
+    out.write('<table style="width:100%" id="main_table"><tr>')
+    
+    out.write('<h1>Comparative Analysis Results</h1></tr><tr>' + __page["info"])
+    if not final:
+        out.write('<p class="status">' + str(len(__page["sections"])) + ' of ' + str(len(order)) + 
+                  ' test blocks finished. This page is updated as the tests run.</p>')
+    out.write('</tr>')
+    
+    for test in order:
+        out.write('<tr>')
+        if test in __page["sections"]:
+            section = open(__page["sections"][test], 'r')
+            shutil.copyfileobj(section, out)
+            section.close()
+        else:
+            status, message = __page["status"][test]
+            out.write('<a name="' + test.get_name() + '"></a><h2>' + test.get_name() + '</h2>')
+            out.write('<p class="status ' + status + '">' + STATUS[status] + html.escape(message) + '</p>')
+        out.write('</tr>')
+        
+    out.write('</table>')
+    for name, script in __page["scripts"]:
+        out.add_script(name, script)
+    out.finish()
+    out.write('</body></html>')
+    f.close()
+    os.replace(__page["fname"] + ".tmp", __page["fname"])
+    
 # Public methods    
+
+def shared_script(name, script):
+    """ Return the html of a script shared by several results. It is written on lines of its
+    own, so that page_writer can take it out of an html fragment and write it once per page.
+    
+    Args:
+        name (str): name of the script, the name of the function it defines.
+        script (str): javascript, defining this function only if it is not defined yet.
+    """
+    return SHARED_SCRIPT + name + '">\n' + script.strip("\n") + '\n</script>\n'
+    
+def run_script(anchor, name, args):
+    """ Return the html calling a shared script once the element anchor is near the window. 
+    Outside of a results page, such as in an html fragment on its own, it is called at once.
+    
+    Args:
+        anchor (str): id of the element that should be visible.
+        name (str): name of the function to call.
+        args (list): arguments of the function, encoded as JSON.
+    """
+    return ('<script>(window.runWhenVisible || function(anchor, name, args) { window[name].apply(null, args); })("' + 
+            anchor + '", "' + name + '", ' + json.dumps(args) + ');</script>\n')
+
+class page_writer(object):
+    """ Writes a page to a file, keeping one copy of each shared script until the end of the page. 
+    
+    Attributes:
+        out: file-like object the page is written to.
+        scripts: list of (name, script) of the shared scripts, in the order they were added.
+        base: directory of the page, or None if it is not saved to a file.
+    """
+    
+    def __init__(self, out, queue=True, base=None):
+        """ Create a new page_writer. 
+        
+        Args:
+            out: file-like object the page is written to.
+            queue (default=True): write the script queueing plots and tables. False when 
+                writing part of a page.
+            base (default=None): directory of the page. Links to files are relative to it.
+        """
+        self.out = out
+        self.scripts = list()
+        self.base = base
+        if queue:
+            self.out.write('<script>' + QUEUE_JS + '</script>')
+        
+    def write(self, text):
+        """ Write this html to the page.
+        """
+        self.out.write(text)
+        
+    def link(self, path):
+        """ Return the link to this file from the page.
+        """
+        return path if self.base is None else os.path.relpath(path, self.base)
+        
+    def add_script(self, name, script):
+        """ Add a shared script to the page, unless a script with this name was added already.
+        """
+        if name not in [n for n, s in self.scripts]:
+            self.scripts.append((name, script))
+            
+    def finish(self):
+        """ Write the shared scripts and start drawing the plots and tables of the page.
+        """
+        for name, script in self.scripts:
+            self.out.write(shared_script(name, script))
+        self.out.write('<script>' + START_JS + '</script>')
+    
+    
+def start_page(order, output_dir, parameters_file):
+    """ Write the results page before the tests run, with every test block waiting to run.
+    
+    Args:
+        order (list[ ]): test blocks, in the order they are shown on the page.
+        output_dir: path to directory to save this HTML page. 
+        parameters_file (str): path to parameters file
+        
+    Returns:
+        path to output HTML file
+    """
+    __page.clear()
+    __page["order"] = list(order)
+    __page["fname"] = output_dir + "/" + "results.html"
+    __page["sections_dir"] = output_dir + "/" + ".results_sections"
+    __page["info"] = __get_parameters_info(parameters_file) + __format_experiment_metadata(order[0].gen_params)
+    __page["status"] = dict([(test, ("pending", "")) for test in order])
+    __page["results"] = dict()
+    __page["sections"] = dict()
+    __page["scripts"] = list()
+    
+    if not os.path.isdir(__page["sections_dir"]):
+        os.mkdir(__page["sections_dir"])
+    __write_page()
+    
+    return __page["fname"]
+    
+def update_page(test, status, outcome=None):
+    """ Show that a test block started, finished or failed on the results page.
+    
+    Args:
+        test: test block instance.
+        status (str): "running", "done" or "failed".
+        outcome (default=None): result instance of a finished block, or the exception 
+            raised by a failed block.
+    """
+    if status == "done":
+        __page["results"][test] = outcome
+        __write_section(test, outcome)
+    else:
+        __page["status"][test] = (status, str(outcome) if status == "failed" else "")
+    __write_page()
+    
+def finish_page():
+    """ Write the results page for the last time, once all test blocks have finished.
+    
+    Returns:
+        path to output HTML file
+        
+    Effects:
+        The page no longer reloads itself and the files of its sections are removed. 
+    """
+    __write_page(final=True)
+    shutil.rmtree(__page["sections_dir"])
+    return __page["fname"]
     
 def create_page(results, output_dir, parameters_file, order=None):
     """ Create full HTML/CSS for this page. Save result to file. 
@@ -223,32 +461,17 @@ def create_page(results, output_dir, parameters_file, order=None):
         
     Returns:
         path to output HTML file
+        
+    Effects:
+        Each section is written to the file as soon as it is formatted, the page is never
+        held in memory as a whole. Shared scripts are written once, at the end.
     """
     
     if order == None:
         order = sorted(list(results.keys()))
         
-    contents = '<!DOCTYPE html><html><head>' + __get_css()
-    contents += '<title>Results</title></head><body>' + __create_header(order, results)
-    
-    # Experimenting with table stuff 
-    contents += '<table style="width:100%" id="main_table"><tr>'    
-    
-    contents += '<h1>Comparative Analysis Results</h1></tr><tr>' + __get_parameters_info(parameters_file)
-    contents += __format_experiment_metadata(list(results.keys())[0].gen_params) + '</tr>'
-    
+    start_page(order, output_dir, parameters_file)
     for test in order:
-        contents += '<tr>'
-        contents += '<a name="' + test.get_name() + '"></a><h2>' + results[test].get_result_name() + '</h2>'
-        contents += results[test].to_html()
-        contents += '</tr>'
-        
-    contents += '</table></body></html>'
-    
-    fname = output_dir + "/" + "results.html"    
-    
-    out = open(fname, 'w')
-    out.write(contents)
-    out.close()
-    
-    return fname
\ No newline at end of file
+        __page["results"][test] = results[test]
+        __write_section(test, results[test])
+    return finish_page()
@@ -8,10 +8,33 @@ Class instance representing metagenomic profile containing all data.
 
 """
 
+import copy
 import sys
 
 import pandas as pd
 
+def read_data(abundance_data_path, metadata_path, a_sep='\t', m_sep='\t', metadata_header=False):
+    """ Read the abundance data and metadata files, before any filtering.
+    
+    Args:
+        abundance_data_path (str): Path to file containing abundance data
+        metadata_path (str): Path to file containing the metadata
+        a_sep (str): separating character in the abundance data file. Defaults to '\t'.
+        m_sep (str): separating character in the metadata file. Defaults to '\t'.
+        metadata_header (bool): Does the metadata file contain a header? Defaults to False.
+        
+    Returns:
+        Tuple of pandas.DataFrame (abundance data, metadata).
+    """
+    abundance_data = pd.DataFrame.from_csv(path=abundance_data_path, sep=a_sep)
+
+    if not metadata_header:
+        metadata = pd.DataFrame.from_csv(path=metadata_path, sep=m_sep, header=None)
+    else:
+        metadata = pd.DataFrame.from_csv(path=metadata_path, sep=m_sep)
+        
+    return abundance_data, metadata
+
 class metagenomic_profile(object):
     """ Represents a metagenomic profile containing all data from the experiment.
     
@@ -19,6 +42,8 @@ class metagenomic_profile(object):
         abundance_data (pandas.DataFrame): n x m matrix holding data across n samples and m attributes.
         metadata (pandas.DataFrame): n x m matrix holding metadata across n samples and m attributes.
         references (dict[str, list[str]]): maps class types to a list of sample labels in that class.
+        shared (bool): True if the profile is shared by several test blocks and must not be modified.
+            The values of its abundance data are then read-only, see share.
     """ 
     
     def __init__(self, abundance_data_path, metadata_path, a_sep='\t', m_sep='\t',
@@ -27,8 +52,10 @@ class metagenomic_profile(object):
         """Create new instance of a metagenomic profile
         
         Args:
-            abundance_data_path (str): Path to file containing abundance data
-            metadata_path (str): Path to file containing the metadata
+            abundance_data_path (str or pandas.DataFrame): Path to file containing abundance data,
+                or the abundance data returned by read_data.
+            metadata_path (str or pandas.DataFrame): Path to file containing the metadata, or the
+                metadata returned by read_data.
             metadata_header (bool): Does the metadata file contain a header? 
                 Defaults to False.
             metadata_label (str): Use metadata column with this label for tests. 
@@ -43,13 +70,14 @@ class metagenomic_profile(object):
                 form (label, operator, value)
             filter_labels: list of labels to filter out
         """
-        self.abundance_data = pd.DataFrame.from_csv(path=abundance_data_path, sep=a_sep)
-
-        if not metadata_header:
-            self.metadata = pd.DataFrame.from_csv(path=metadata_path, sep=m_sep, header=None)
+        if isinstance(abundance_data_path, pd.DataFrame):
+            self.abundance_data = abundance_data_path.copy()
+            self.metadata = metadata_path.copy()
         else:
-            self.metadata = pd.DataFrame.from_csv(path=metadata_path, sep=m_sep)
+            self.abundance_data, self.metadata = read_data(abundance_data_path, metadata_path, a_sep=a_sep, m_sep=m_sep, 
+                                                           metadata_header=metadata_header)
 
+        self.shared = False
         self.__check_abundance_data_shape()
         
         if filter_labels != None:    
@@ -114,6 +142,13 @@ class metagenomic_profile(object):
         if self.abundance_data.index[0] not in self.metadata.index:
             self.abundance_data = self.abundance_data.T
     
+    def __check_not_shared(self):
+        """ Profiles shared by several test blocks cannot be changed, as the change would 
+        show up in the other blocks.
+        """
+        if self.shared:
+            raise ValueError("Profile is shared by several test blocks and cannot be modified. Modify a copy instead.")
+    
     def __filter_samples_by_name(self, names):
         """ Filter out samples according to label.
         
@@ -157,6 +192,7 @@ class metagenomic_profile(object):
             path (string): path to file containing feature metadata
             sp (string): delimiting character in file. Defaults to '\t'.
         """
+        self.__check_not_shared()
         self.feature_metadata = pd.DataFrame.from_csv(path, sep=sp)
     
     def to_file_abundance_data(self, filename, output_dir, separator="\t"):
@@ -178,6 +214,7 @@ class metagenomic_profile(object):
         Args:
             dataframe (pandas.DataFrame): new abundance data matrix
         """
+        self.__check_not_shared()
         self.abundance_data = dataframe
         self.__check_abundance_data_shape()
         
@@ -187,4 +224,46 @@ class metagenomic_profile(object):
         Args:
             dataframe (pandas.DataFrame): new metadata matrix
         """
-        self.metadata = dataframe
\ No newline at end of file
+        self.__check_not_shared()
+        self.metadata = dataframe
+        
+    def share(self):
+        """ Mark this profile as shared by several test blocks. Its data can no longer be 
+        set afterwards, and the values of its abundance data are made read-only, so writing
+        to them raises ValueError instead of changing the data of the other blocks.
+        """
+        if not self.shared and len(set(self.abundance_data.dtypes)) == 1:
+            values = self.abundance_data.values
+            values.flags.writeable = False
+            self.abundance_data = pd.DataFrame(values, index=self.abundance_data.index, 
+                                               columns=self.abundance_data.columns, copy=False)
+        self.shared = True
+        
+    def view(self):
+        """ Return a profile for one of the test blocks sharing this profile. It reads the
+        same read-only abundance data through its own DataFrame, so rows or columns the block
+        drops or adds are not seen by the other blocks, and has its own copy of the metadata.
+        """
+        profile = copy.copy(self)
+        profile.abundance_data = self.abundance_data.copy(deep=False)
+        profile.metadata = self.metadata.copy()
+        if hasattr(self, "feature_metadata"):
+            profile.feature_metadata = self.feature_metadata.copy()
+        return profile
+        
+    def copy(self):
+        """ Return a copy of this profile that can be modified, also when this profile is shared.
+        """
+        profile = copy.deepcopy(self)
+        profile.shared = False
+        return profile
+        
+    def memory_usage(self):
+        """ Return the number of bytes held by the abundance data, metadata and feature metadata
+        of this profile.
+        """
+        usage = int(self.abundance_data.memory_usage(deep=True).sum())
+        usage += int(pd.Series(self.metadata.memory_usage(deep=True)).sum())
+        if hasattr(self, "feature_metadata"):
+            usage += int(self.feature_metadata.memory_usage(deep=True).sum())
+        return usage
\ No newline at end of file
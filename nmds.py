@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Non-metric multidimensional scaling (NMDS) of a distance matrix. Several starts
+are run in parallel, one of them warm-started from the PCoA solution, and the
+configuration with the lowest stress is kept.
+"""
+
+# General imports
+import multiprocessing
+
+# Specific imports that must be pre-installed
+import numpy as np
+from scipy.linalg import orthogonal_procrustes
+from sklearn.isotonic import IsotonicRegression
+
+# Internal imports
+import bounded_cache
+import distances
+
+MAX_CACHE_BYTES = 64 * 1024 * 1024 # Memory budget of the shared NMDS fits.
+
+# distance matrix shared by the starts, set once per worker process
+__worker_state = dict()
+
+# maps (data fingerprint, metric, starts, seed) to a fitted NMDS, least recently used first
+__fits = bounded_cache.bounded_cache(MAX_CACHE_BYTES)
+
+# Helper methods
+
+def __init_worker(dist_matrix, max_iter, eps):
+    """ Store the distance matrix and convergence settings in the worker process.
+    """
+    __worker_state["dist_matrix"] = dist_matrix
+    __worker_state["max_iter"] = max_iter
+    __worker_state["eps"] = eps
+
+def __stress(dist_matrix, coords):
+    """ Kruskal's stress-1 of a configuration.
+
+    Args:
+        dist_matrix (numpy.ndarray): n x n matrix of dissimilarities.
+        coords (numpy.ndarray): n x 2 configuration.
+
+    Returns:
+        Stress-1 (float), 0 for a perfect monotone fit.
+    """
+    upper = np.triu_indices(dist_matrix.shape[0], 1)
+    diff = coords[upper[0]] - coords[upper[1]]
+    config_dist = np.sqrt((diff ** 2).sum(axis=1))
+
+    # disparities: best monotone fit of the configuration distances to the dissimilarities
+    disparities = IsotonicRegression().fit_transform(dist_matrix[upper], config_dist)
+
+    return float(np.sqrt(((config_dist - disparities) ** 2).sum() / (config_dist ** 2).sum()))
+
+def __smacof(dist_matrix, init, random_state, max_iter, eps):
+    """ Non-metric SMACOF (de Leeuw and Mair 2009): alternate between the disparities,
+    the best monotone fit of the configuration distances to the dissimilarities, and
+    the Guttman transform of the configuration towards them.
+
+    Args:
+        dist_matrix (numpy.ndarray): n x n matrix of dissimilarities.
+        init (numpy.ndarray): n x 2 initial configuration, or None for a random one.
+        random_state (int): seed of the random initial configuration.
+        max_iter (int): maximum number of iterations.
+        eps (float): relative stress improvement at which the configuration has converged.
+
+    Returns:
+        Tuple (n x 2 configuration, number of iterations).
+    """
+    n = dist_matrix.shape[0]
+    upper = np.triu_indices(n, 1)
+    dissimilarities = dist_matrix[upper]
+    if init is None:
+        coords = np.random.RandomState(random_state).uniform(size=(n, 2))
+    else:
+        coords = np.array(init, dtype=float)
+
+    regression = IsotonicRegression()
+    disparities = np.zeros((n, n))
+    old_stress = None
+    for n_iter in range(1, max_iter + 1):
+        diff = coords[:, np.newaxis, :] - coords[np.newaxis, :, :]
+        config_dist = np.sqrt((diff ** 2).sum(axis=2))
+        fitted = regression.fit_transform(dissimilarities, config_dist[upper])
+        # scale the disparities to a fixed sum of squares, so the configuration cannot shrink to a point
+        fitted *= np.sqrt(len(fitted) / (fitted ** 2).sum())
+        disparities[upper] = fitted
+        disparities.T[upper] = fitted
+
+        stress = np.sqrt(((config_dist[upper] - fitted) ** 2).sum() / (config_dist[upper] ** 2).sum())
+        if old_stress is not None and old_stress - stress < eps * old_stress:
+            break
+        old_stress = stress
+
+        # Guttman transform
+        config_dist[config_dist == 0] = 1e-5
+        b = -disparities / config_dist
+        b[np.diag_indices(n)] = 0
+        b[np.diag_indices(n)] = -b.sum(axis=1)
+        coords = b.dot(coords) / n
+
+    return coords, n_iter
+
+def __run_start(task):
+    """ Run SMACOF from one starting configuration.
+
+    Args:
+        task: tuple (random seed, initial configuration or None).
+
+    Returns:
+        Tuple (stress-1, configuration, number of iterations).
+    """
+    seed, init = task
+    dist_matrix = __worker_state["dist_matrix"]
+
+    coords, n_iter = __smacof(dist_matrix, init, seed, __worker_state["max_iter"], __worker_state["eps"])
+
+    return __stress(dist_matrix, coords), coords, n_iter
+
+# Public methods
+
+def fit_nmds(dist_matrix, init=None, starts=20, workers=None, max_iter=300, eps=1e-4, tol=1e-3, seed=None):
+    """ Fit a two dimensional NMDS to this distance matrix.
+
+    Starts are run in a process pool and collected in the order they were started. The 
+    search stops early once the best solution has been reached a second time (stress 
+    within tol), as in metaMDS (Oksanen et al., vegan), so the starts run and the 
+    solution kept depend only on the seed, not on the number of processes.
+
+    Args:
+        dist_matrix (numpy.ndarray): n x n matrix of distances.
+        init (numpy.ndarray, default=None): n x 2 warm start (e.g. the first two principal
+            coordinates). The final configuration is rotated to match it.
+        starts (int, default=20): maximum number of random starts.
+        workers (int, default=None): number of processes. Defaults to the number of cores.
+        max_iter (int, default=300): maximum number of SMACOF iterations per start.
+        eps (float, default=1e-4): relative stress improvement at which a start has converged.
+        tol (float, default=1e-3): stress difference under which two solutions are considered the same.
+        seed (int, default=None): seed for the random starts.
+
+    Returns:
+        Tuple (n x 2 configuration, stress-1, number of starts run).
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    seeds = np.random.RandomState(seed).randint(0, 2**31 - 1, size=starts)
+    tasks = [(None, init)] if init is not None else list()
+    tasks += [(s, None) for s in seeds]
+
+    state = (dist_matrix, max_iter, eps)
+
+    best = None
+    repeats = 0
+    runs = 0
+
+    if workers <= 1:
+        __init_worker(*state)
+        pool = None
+        solutions = map(__run_start, tasks)
+    else:
+        pool = multiprocessing.Pool(min(workers, len(tasks)), initializer=__init_worker, initargs=state)
+        solutions = pool.imap(__run_start, tasks)
+
+    try:
+        for solution in solutions:
+            runs += 1
+            if best is None or solution[0] < best[0] - tol:
+                best = solution
+                repeats = 0
+            elif abs(solution[0] - best[0]) <= tol:
+                repeats += 1
+                if solution[0] < best[0]:
+                    best = solution
+            if repeats >= 1:
+                break
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    stress, coords = best[0], best[1]
+
+    # NMDS axes are arbitrary, rotate onto the warm start so plots line up with the PCoA
+    if init is not None:
+        coords = coords - coords.mean(axis=0)
+        rotation = orthogonal_procrustes(coords, init - init.mean(axis=0))[0]
+        coords = coords.dot(rotation)
+
+    return coords, stress, runs
+
+def shared_nmds(data, dist_type, dist_matrix, init=None, starts=20, workers=None, seed=None):
+    """ Fit a two dimensional NMDS to this abundance data, or return the fit of an earlier
+    call with the same data, metric, number of starts and seed, so the static and
+    interactive plots of a block show the same configuration.
+
+    Args:
+        data (pandas.DataFrame): a sorted (by sample class) matrix containing abundance data.
+        dist_type (str): distance metric of dist_matrix.
+        dist_matrix (numpy.ndarray): n x n matrix of distances between the samples of data.
+        init, starts, workers, seed: see fit_nmds.
+
+    Returns:
+        Tuple (n x 2 configuration, stress-1). The configuration is shared with other 
+        callers and read-only.
+    """
+    key = (distances.fingerprint(data), dist_type, starts, seed)
+    if key not in __fits:
+        coords, stress, runs = fit_nmds(dist_matrix, init=init, starts=starts, workers=workers, seed=seed)
+        coords.setflags(write=False)
+        __fits[key] = (coords, stress)
+    return __fits[key]
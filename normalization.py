@@ -11,6 +11,9 @@ passed into the file and writes normalized data to file.
 
 import pandas as pd
 
+# File the normalized abundance data is written to, for each type of normalization
+FILES = {"relative": "normalized_abundance_data.tab", "musicc": "musicc_normalized_abundance.tab"}
+
 # Helper methods
 
 def __normalize_dataframe(df):
@@ -34,8 +37,8 @@ def relative_normalization(profile, output_dir):
     Effects: 
         profile's abundance data is now normalized. 
     """
-    profile.abundance_data = __normalize_dataframe(profile.abundance_data)
-    profile.to_file_abundance_data("normalized_abundance_data.tab", output_dir)
+    profile.set_abundance_data(__normalize_dataframe(profile.abundance_data))
+    profile.to_file_abundance_data(FILES["relative"], output_dir)
 
 def musicc_normalization(profile, in_file, output_dir, musicc_inter=True, input_format='tab', output_format='tab', 
                          musicc_intra='use_generic', compute_scores=False, verbose=False):    
@@ -65,7 +68,7 @@ def musicc_normalization(profile, in_file, output_dir, musicc_inter=True, input_
                'musicc_intra':musicc_intra, 'compute_scores':compute_scores, 'verbose':verbose}    
     
     musicc_args['input_file'] = in_file 
-    musicc_args['output_file'] = output_dir + "//" + "musicc_normalized_abundance.tab"
+    musicc_args['output_file'] = output_dir + "//" + FILES["musicc"]
     correct_and_normalize(musicc_args)
     
     profile.set_abundance_data(pd.DataFrame.from_csv(musicc_args['output_file'], sep='\t'))
\ No newline at end of file
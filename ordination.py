@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Fitted PCoA and PCA ordinations. A fitted ordination keeps everything needed
+to place new samples on the same axes without recomputing the ordination, so
+reports generated from different batches of samples share one coordinate system.
+PCoA fits are also shared between the test blocks of a run, like distance matrices,
+within a budget of MAX_CACHE_BYTES.
+"""
+
+# specific imports that must be pre-installed
+import numpy as np
+from sklearn.metrics.pairwise import pairwise_distances
+from sklearn.decomposition import PCA
+
+# Internal imports
+import bounded_cache
+import distances
+
+# array attributes of a fitted PCoA
+PCOA_ARRAYS = ["coordinates", "eig_vals", "explained_variance_ratio", "eig_vecs", "row_means", "reference_data"]
+
+MAX_CACHE_BYTES = 512 * 1024 * 1024 # Memory budget of the shared PCoA fits.
+
+# maps (data fingerprint, metric) to a fitted PCoA, least recently used first
+__fits = bounded_cache.bounded_cache(MAX_CACHE_BYTES)
+
+# Helper methods
+
+def __orient(vectors):
+    """ Fix the sign of each column so that its largest absolute entry is positive.
+    Eigenvectors are only defined up to sign, so without this the axes of the
+    plot may flip between runs.
+
+    Args:
+        vectors (numpy.ndarray): matrix whose columns are eigenvectors/components.
+
+    Returns:
+        Array of +1/-1 multipliers, one per column.
+    """
+    if vectors.shape[0] == 0:
+        return np.ones(vectors.shape[1])
+    rows = np.argmax(np.abs(vectors), axis=0)
+    signs = np.sign(vectors[rows, np.arange(vectors.shape[1])])
+    signs[signs == 0] = 1
+    return signs
+
+def gower_matrix(dist_matrix):
+    """ Gower-centers a distance matrix. Calculated using methods described in
+    Numerical Ecology (pp 391-443, Legendre 1998).
+
+    Args:
+        dist_matrix (numpy.ndarray): n x n matrix of pairwise distances.
+
+    Returns:
+        The centered matrix, the row means of the squared distances and
+        the grand mean of the squared distances.
+    """
+    sq_dist = np.asarray(dist_matrix, dtype=float) ** 2
+    row_means = sq_dist.mean(axis=1)
+    grand_mean = row_means.mean()
+
+    # 9.20 and 9.21: a_ij = -d_ij^2 / 2, then double centering
+    centered = -0.5 * (sq_dist - row_means[:, np.newaxis] - row_means[np.newaxis, :] + grand_mean)
+
+    return centered, row_means, grand_mean
+
+class ordination(object):
+    """ A fitted PCoA or PCA ordination.
+
+    Attributes:
+        method (str): "pcoa" or "pca".
+        dist_type (str): distance metric used for a PCoA (None for a PCA).
+        samples (list[str]): labels of the reference samples, in plotting order.
+        features (list[str]): labels of the features the ordination was fitted on.
+        coordinates (numpy.ndarray): reference samples x axes matrix of coordinates.
+        eig_vals (numpy.ndarray): eigenvalues of the retained axes.
+        explained_variance_ratio (numpy.ndarray): fraction of the variance on each axis.
+        eig_vecs (numpy.ndarray): PCoA eigenvectors (reference samples x axes).
+        row_means (numpy.ndarray): PCoA centering term, mean squared distance per reference sample.
+        grand_mean (float): PCoA centering term, mean of all squared distances.
+        reference_data (numpy.ndarray): PCoA reference abundance matrix, needed to
+            measure distances from new samples.
+        components (numpy.ndarray): PCA components (axes x features).
+        mean (numpy.ndarray): PCA feature means.
+    """
+
+    def __init__(self, method, samples, features, coordinates, eig_vals, explained_variance_ratio,
+                 dist_type=None, eig_vecs=None, row_means=None, grand_mean=None,
+                 reference_data=None, components=None, mean=None):
+        """ Create a new fitted ordination. Use fit_pcoa, fit_pca or load rather
+        than calling this directly.
+        """
+        self.method = method
+        self.dist_type = dist_type
+        self.samples = list(samples)
+        self.features = list(features)
+        self.coordinates = coordinates
+        self.eig_vals = eig_vals
+        self.explained_variance_ratio = explained_variance_ratio
+        self.eig_vecs = eig_vecs
+        self.row_means = row_means
+        self.grand_mean = grand_mean
+        self.reference_data = reference_data
+        self.components = components
+        self.mean = mean
+
+    def align_features(self, data):
+        """ Reorder the columns of data to match the features of this ordination.
+        Features unknown to the ordination are dropped and missing features are
+        treated as absent (zero abundance).
+
+        Args:
+            data (pandas.DataFrame): samples x features abundance matrix.
+
+        Returns:
+            numpy.ndarray with one column per feature of this ordination.
+        """
+        return data.reindex(columns=self.features, fill_value=0).values.astype(float)
+
+    def project(self, data):
+        """ Project new samples onto this ordination. PCoA samples are placed with
+        Gower's add-a-point formula, which only needs the distances from each new
+        sample to the reference samples. PCA samples are centered with the stored
+        means and rotated onto the stored components.
+
+        Args:
+            data (pandas.DataFrame): samples x features abundance matrix.
+
+        Returns:
+            samples x axes numpy.ndarray of coordinates.
+        """
+        values = self.align_features(data)
+
+        if self.method == "pca":
+            return np.dot(values - self.mean, self.components.T)
+
+        sq_dist = pairwise_distances(values, self.reference_data, metric=self.dist_type) ** 2
+
+        # Gower (1968): centre the new squared distances against the reference centering terms
+        b = -0.5 * (sq_dist - sq_dist.mean(axis=1)[:, np.newaxis] - self.row_means[np.newaxis, :] + self.grand_mean)
+
+        return np.dot(b, self.eig_vecs) / np.sqrt(self.eig_vals)
+
+    def save(self, path):
+        """ Write this ordination to a numpy .npz archive.
+
+        Args:
+            path (str): path of the file to write.
+
+        Returns:
+            Path to output.
+        """
+        arrays = dict()
+        for name in ["coordinates", "eig_vals", "explained_variance_ratio", "eig_vecs",
+                     "row_means", "reference_data", "components", "mean"]:
+            if getattr(self, name) is not None:
+                arrays[name] = getattr(self, name)
+
+        np.savez_compressed(path, method=self.method, dist_type=str(self.dist_type),
+                            samples=np.array(self.samples, dtype=str),
+                            features=np.array(self.features, dtype=str),
+                            grand_mean=np.nan if self.grand_mean is None else self.grand_mean,
+                            **arrays)
+
+        return path if path.endswith(".npz") else path + ".npz"
+
+# Public methods
+
+def fit_pcoa(data, dist_type, dist_matrix=None):
+    """ Fit a PCoA to this abundance data.
+
+    Args:
+        data (pandas.DataFrame): a sorted (by sample class) matrix containing abundance data.
+        dist_type (str): distance metric to use.
+        dist_matrix (numpy.ndarray, default=None): precomputed distances between the
+            samples of data. Computed from data if None.
+
+    Returns:
+        ordination instance.
+    """
+    if dist_matrix is None:
+        dist_matrix = pairwise_distances(data, metric=dist_type)
+
+    centered, row_means, grand_mean = gower_matrix(dist_matrix)
+
+    eig_vals, eig_vecs = np.linalg.eigh(centered)
+
+    # eigh returns ascending eigenvalues
+    eig_vals, eig_vecs = eig_vals[::-1], eig_vecs[:, ::-1]
+
+    # only axes with positive eigenvalues have a Euclidean representation
+    positive = eig_vals > eig_vals[0] * 1e-10
+    eig_vals, eig_vecs = eig_vals[positive], eig_vecs[:, positive]
+    eig_vecs = eig_vecs * __orient(eig_vecs)
+
+    return ordination("pcoa", data.index, data.columns, eig_vecs * np.sqrt(eig_vals), eig_vals,
+                      eig_vals / eig_vals.sum(), dist_type=dist_type, eig_vecs=eig_vecs,
+                      row_means=row_means, grand_mean=grand_mean,
+                      reference_data=data.values.astype(float))
+
+def shared_pcoa(data, dist_type, dist_matrix=None):
+    """ Fit a PCoA to this abundance data, or return the fit of an earlier call with the 
+    same data and metric.
+
+    Args:
+        data (pandas.DataFrame): a sorted (by sample class) matrix containing abundance data.
+        dist_type (str): distance metric to use.
+        dist_matrix (numpy.ndarray, default=None): precomputed distances between the
+            samples of data. Computed from data if None.
+
+    Returns:
+        ordination instance. It is shared with other callers and must not be modified.
+    """
+    key = (distances.fingerprint(data), dist_type)
+    if key not in __fits:
+        add([(key, fit_pcoa(data, dist_type, dist_matrix=dist_matrix))])
+    return __fits[key]
+
+def entries(data, dist_types):
+    """ Shared PCoA fits of data, to be added to the fits of another process.
+
+    Args:
+        data (pandas.DataFrame): samples x features abundance data.
+        dist_types (list[str]): distance metrics.
+
+    Returns:
+        List of (key, ordination) for the metrics that were fitted.
+    """
+    keys = [(distances.fingerprint(data), d) for d in dist_types]
+    return [(k, __fits[k]) for k in keys if k in __fits]
+
+def add(fits):
+    """ Add PCoA fits made by another process, as returned by entries(). Their arrays are made read-only.
+    """
+    for k, fitted in fits:
+        for name in PCOA_ARRAYS:
+            getattr(fitted, name).setflags(write=False)
+        __fits[k] = fitted
+
+def fit_pca(data, n_components=2):
+    """ Fit a PCA to this abundance data.
+
+    Args:
+        data (pandas.DataFrame): a sorted (by sample class) matrix containing abundance data.
+        n_components (int, default=2): number of principal components to keep.
+
+    Returns:
+        ordination instance.
+    """
+    my_pca = PCA(n_components=n_components)
+    my_pca.fit(data)
+
+    components = my_pca.components_ * __orient(my_pca.components_.T)[:, np.newaxis]
+    coordinates = np.dot(data.values - my_pca.mean_, components.T)
+
+    return ordination("pca", data.index, data.columns, coordinates, my_pca.explained_variance_,
+                      my_pca.explained_variance_ratio_, components=components, mean=my_pca.mean_)
+
+def load(path):
+    """ Read an ordination written by ordination.save.
+
+    Args:
+        path (str): path to the .npz file.
+
+    Raises:
+        IOError: if the file cannot be read.
+
+    Returns:
+        ordination instance.
+    """
+    with np.load(path) as archive:
+        def optional(name):
+            return archive[name] if name in archive.files else None
+
+        grand_mean = float(archive["grand_mean"])
+        dist_type = str(archive["dist_type"])
+
+        return ordination(str(archive["method"]), list(archive["samples"]), list(archive["features"]),
+                          archive["coordinates"], archive["eig_vals"], archive["explained_variance_ratio"],
+                          dist_type=None if dist_type == "None" else dist_type,
+                          eig_vecs=optional("eig_vecs"), row_means=optional("row_means"),
+                          grand_mean=None if np.isnan(grand_mean) else grand_mean,
+                          reference_data=optional("reference_data"),
+                          components=optional("components"), mean=optional("mean"))
\ No newline at end of file
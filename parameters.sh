@@ -70,13 +70,33 @@ Interactive_plots=True
 #If interactive_plots=True, generate .png plots as well? 
 Static_plots=True
 
+# Format of static plots and legends (optional, defaults to png)
+# Options: png, svg, webp, pdf
+#plot_format=png
+
+# Resolution in dots per inch and maximum size in kilobytes of each plot (optional)
+#dpi=200
+#max_file_size=500
+
+# Directory to keep rendered plots in, so unchanged plots are not drawn again on the next run (optional)
+#cache_directory=plot_cache
+
+# Results directory of an earlier run to finish, rerunning only the test blocks that did not finish or changed (optional)
+#resume=comparative analysis results 5-26-2015-13.2.13
+
 # --------------------TESTS----------------------------
 
 # The type of test to be performed
-# Options: area_plot, pcoa, pca, enrichment
+# Options: area_plot, pcoa, multi_pcoa, nmds, pca, enrichment, permanova, permdisp
 test_type=area_plot
 # Unique display name for this test (optional)
 test_name=Area Plot
+# Number of features shown, the rest are summed into "Other" (optional)
+number_of_features=20
+# Rank features by mean abundance "overall" or within each "class" (optional)
+rank_features_by=overall
+# Order samples within a class by their most abundant feature ("abundance") or by clustering ("cluster") (optional)
+sample_order=abundance
 
 test_type=pcoa
 # Distance metric to be used in plotting PCoA
@@ -89,6 +109,13 @@ test_type=pcoa
 distance_metric=chebyshev
 test_name=Chebyshev PCoA
 
+test_type=permanova
+# Distance metric to be used for the test
+distance_metric=chebyshev
+# Number of label permutations (optional, defaults to 999)
+permutations=999
+test_name=Chebyshev PERMANOVA
+
 test_type=pca
 test_name=Filtered PCA
 # Filter out samples by rule (optional)
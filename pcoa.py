@@ -10,14 +10,26 @@ Provides methods to generate either static or interactive plots.
 import warnings
 import os
 import math
+import base64
+import hashlib
+import json
 
 # specific imports that must be pre-installed
 import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import pairwise_distances
-from sklearn.decomposition import PCA
-from matplotlib import pyplot as plt
-from matplotlib import patches as mpatches
+from matplotlib.patches import Ellipse
+from scipy.spatial import procrustes
+
+# Internal imports
+import ordination
+import distances
+import nmds
+import bootstrap
+import permanova
+import rendering
+import render_cache
+import timing
+import generate_html
 
 # complex numbers must be cast to real in order to plot
 warnings.simplefilter("ignore", np.ComplexWarning)
@@ -33,6 +45,218 @@ colors = ["#0000ff", "#ff0000", "#ffff00", "#00ff00", "#ff0066", "#99ff99",
 markers = ['o', 'D', 'v', 'd', '<', 'h', '+', 's', '>', '|', 'p', 'H', '.',
            'x', '*', '^', ',', '_']
 
+INTERACTIVE_SIZE = (800, 800) # Width, height in pixels of the canvas of an interactive ordination plot.
+
+BIN_POINTS = 20000 # Above this many points in view, interactive plots show the density of samples instead of each sample.
+
+# Draws an interactive ordination plot from its JSON payload, defined once per page
+ORDINATION_JS = """
+if (typeof ordinationPlot === "undefined") {
+  var ordinationPlot = function(id) {
+    var data = JSON.parse(document.getElementById(id + "_data").textContent);
+    var canvas = document.getElementById(id + "_canvas");
+    var tip = document.getElementById(id + "_tip");
+    var ctx = canvas.getContext("2d");
+    
+    function decode(s) {
+      var raw = atob(s), bytes = new Uint8Array(raw.length);
+      for (var i = 0; i < raw.length; i++) { bytes[i] = raw.charCodeAt(i); }
+      return new Uint16Array(bytes.buffer);
+    }
+    
+    // coordinates quantized to 0..data.scale between the bounds of each axis
+    var b = data.bounds, qx = decode(data.x), qy = decode(data.y), n = qx.length;
+    var xs = new Float64Array(n), ys = new Float64Array(n), cls = new Int32Array(n), k = 0;
+    for (var i = 0; i < n; i++) {
+      xs[i] = b[0] + qx[i] / data.scale * (b[1] - b[0]);
+      ys[i] = b[2] + qy[i] / data.scale * (b[3] - b[2]);
+    }
+    data.sizes.forEach(function(size, c) { for (var j = 0; j < size; j++) { cls[k++] = c; } });
+    var shown = data.classes.map(function() { return true; });
+    
+    var left = 70, right = 20, top = 20, bottom = 50, cell = 4;
+    var w = canvas.width - left - right, h = canvas.height - top - bottom;
+    var padX = 0.05 * (b[5] - b[4]), padY = 0.05 * (b[7] - b[6]);
+    var home = [b[4] - padX, b[5] + padX, b[6] - padY, b[7] + padY], view = home.slice(), bins = null;
+    
+    function px(x) { return left + (x - view[0]) / (view[1] - view[0]) * w; }
+    function py(y) { return top + (view[3] - y) / (view[3] - view[2]) * h; }
+    
+    function marker(shape, x, y, r) {
+      if (shape === "s") { ctx.rect(x - r, y - r, 2 * r, 2 * r); return; }
+      var points = {"D": [[0, -1.3], [1, 0], [0, 1.3], [-1, 0]], "d": [[0, -1.3], [0.7, 0], [0, 1.3], [-0.7, 0]],
+                    "v": [[-1, -0.8], [1, -0.8], [0, 1.2]], "^": [[-1, 0.8], [1, 0.8], [0, -1.2]],
+                    "<": [[0.8, -1], [0.8, 1], [-1.2, 0]], ">": [[-0.8, -1], [-0.8, 1], [1.2, 0]]}[shape];
+      if (points === undefined) { ctx.moveTo(x + r, y); ctx.arc(x, y, r, 0, 2 * Math.PI); return; }
+      ctx.moveTo(x + points[0][0] * r, y + points[0][1] * r);
+      for (var p = 1; p < points.length; p++) { ctx.lineTo(x + points[p][0] * r, y + points[p][1] * r); }
+      ctx.closePath();
+    }
+    
+    function visible(i) {
+      return shown[cls[i]] && xs[i] >= view[0] && xs[i] <= view[1] && ys[i] >= view[2] && ys[i] <= view[3];
+    }
+    
+    function ticks(lo, hi) {
+      var step = Math.pow(10, Math.floor(Math.log(hi - lo) / Math.LN10)), result = [];
+      if ((hi - lo) / step < 2.5) { step /= 5; } else if ((hi - lo) / step < 5) { step /= 2; }
+      for (var t = Math.ceil(lo / step) * step; t <= hi; t += step) { result.push(Math.abs(t) < step / 1e6 ? 0 : t); }
+      return result;
+    }
+    
+    // count the samples of each class in cells of a grid over the plot
+    function binned() {
+      var cols = Math.ceil(w / cell), rows = Math.ceil(h / cell), m = data.classes.length;
+      var counts = new Int32Array(cols * rows * m), totals = new Int32Array(cols * rows), most = 1;
+      for (var i = 0; i < n; i++) {
+        if (!visible(i)) { continue; }
+        var c = Math.min(cols - 1, Math.floor((px(xs[i]) - left) / cell)) + 
+                Math.min(rows - 1, Math.floor((py(ys[i]) - top) / cell)) * cols;
+        counts[c * m + cls[i]]++;
+        most = Math.max(most, ++totals[c]);
+      }
+      return {cols: cols, counts: counts, totals: totals, most: most};
+    }
+    
+    function draw() {
+      var count = 0;
+      for (var i = 0; i < n; i++) { if (visible(i)) { count++; } }
+      ctx.clearRect(0, 0, canvas.width, canvas.height);
+      ctx.save();
+      ctx.beginPath();
+      ctx.rect(left, top, w, h);
+      ctx.clip();
+      
+      bins = count > data.bins ? binned() : null;
+      if (bins !== null) {
+        // each cell in the color of its most common class, darker with more samples
+        var m = data.classes.length;
+        for (var c = 0; c < bins.totals.length; c++) {
+          if (bins.totals[c] === 0) { continue; }
+          var best = 0;
+          for (var l = 1; l < m; l++) { if (bins.counts[c * m + l] > bins.counts[c * m + best]) { best = l; } }
+          ctx.globalAlpha = 0.2 + 0.8 * Math.log(1 + bins.totals[c]) / Math.log(1 + bins.most);
+          ctx.fillStyle = data.colors[best];
+          ctx.fillRect(left + (c % bins.cols) * cell, top + Math.floor(c / bins.cols) * cell, cell, cell);
+        }
+      } else {
+        ctx.globalAlpha = 0.7;
+        data.classes.forEach(function(name, c) {
+          if (!shown[c]) { return; }
+          ctx.fillStyle = data.colors[c];
+          ctx.beginPath();
+          for (var i = 0; i < n; i++) { if (cls[i] === c && visible(i)) { marker(data.markers[c], px(xs[i]), py(ys[i]), 4); } }
+          ctx.fill();
+        });
+      }
+      ctx.globalAlpha = 1;
+      
+      ctx.strokeStyle = "black";
+      ctx.fillStyle = "black";
+      ctx.font = "12px sans-serif";
+      data.loadings.forEach(function(loading) {
+        ctx.beginPath();
+        ctx.moveTo(px(0), py(0));
+        ctx.lineTo(px(loading[1]), py(loading[2]));
+        ctx.stroke();
+        ctx.fillText(loading[0], px(loading[1]) + 3, py(loading[2]) - 3);
+      });
+      ctx.restore();
+      
+      // axes
+      ctx.strokeRect(left, top, w, h);
+      ctx.textAlign = "center";
+      ticks(view[0], view[1]).forEach(function(t) {
+        ctx.fillRect(px(t), top + h, 1, 5);
+        ctx.fillText(+t.toPrecision(6), px(t), top + h + 18);
+      });
+      ctx.textAlign = "right";
+      ticks(view[2], view[3]).forEach(function(t) {
+        ctx.fillRect(left - 5, py(t), 5, 1);
+        ctx.fillText(+t.toPrecision(6), left - 8, py(t) + 4);
+      });
+      ctx.textAlign = "center";
+      ctx.font = "14px sans-serif";
+      ctx.fillText(data.labels[0], left + w / 2, canvas.height - 8);
+      ctx.save();
+      ctx.translate(14, top + h / 2);
+      ctx.rotate(-Math.PI / 2);
+      ctx.fillText(data.labels[1], 0, 0);
+      ctx.restore();
+    }
+    
+    function position(event) {
+      var rect = canvas.getBoundingClientRect();
+      return [(event.clientX - rect.left) * canvas.width / rect.width, (event.clientY - rect.top) * canvas.height / rect.height];
+    }
+    
+    function hover(pos) {
+      if (pos[0] < left || pos[0] > left + w || pos[1] < top || pos[1] > top + h) { return null; }
+      if (bins !== null) {
+        var c = Math.floor((pos[0] - left) / cell) + Math.floor((pos[1] - top) / cell) * bins.cols, m = data.classes.length;
+        if (!bins.totals[c]) { return null; }
+        var parts = [];
+        for (var l = 0; l < m; l++) { if (bins.counts[c * m + l]) { parts.push(data.classes[l] + ": " + bins.counts[c * m + l]); } }
+        return bins.totals[c] + " samples (" + parts.join(", ") + ")";
+      }
+      var nearest = -1, best = 64;
+      for (var i = 0; i < n; i++) {
+        if (!visible(i)) { continue; }
+        var dx = px(xs[i]) - pos[0], dy = py(ys[i]) - pos[1];
+        if (dx * dx + dy * dy < best) { best = dx * dx + dy * dy; nearest = i; }
+      }
+      return nearest < 0 ? null : data.samples[nearest] + " (" + data.classes[cls[nearest]] + ")";
+    }
+    
+    var drag = null;
+    
+    canvas.onmousedown = function(event) { drag = [position(event), view.slice()]; };
+    window.addEventListener("mouseup", function() { drag = null; });
+    
+    canvas.onmousemove = function(event) {
+      var pos = position(event);
+      if (drag !== null) {
+        var dx = (pos[0] - drag[0][0]) / w * (view[1] - view[0]), dy = (pos[1] - drag[0][1]) / h * (view[3] - view[2]);
+        view = [drag[1][0] - dx, drag[1][1] - dx, drag[1][2] + dy, drag[1][3] + dy];
+        draw();
+      }
+      var text = hover(pos);
+      if (text === null) { tip.style.display = "none"; return; }
+      tip.textContent = text;
+      tip.style.left = (event.offsetX + 12) + "px";
+      tip.style.top = (event.offsetY + 12) + "px";
+      tip.style.display = "block";
+    };
+    
+    canvas.onmouseleave = function() { tip.style.display = "none"; };
+    
+    // zoom around the mouse with the wheel, up to 100 times, double click to reset
+    canvas.onwheel = function(event) {
+      event.preventDefault();
+      var pos = position(event), factor = event.deltaY > 0 ? 1.25 : 0.8;
+      factor = Math.max(factor, (home[1] - home[0]) / 100 / (view[1] - view[0]));
+      var x = view[0] + (pos[0] - left) / w * (view[1] - view[0]), y = view[3] - (pos[1] - top) / h * (view[3] - view[2]);
+      view = [x - (x - view[0]) * factor, x + (view[1] - x) * factor, y - (y - view[2]) * factor, y + (view[3] - y) * factor];
+      draw();
+    };
+    
+    canvas.ondblclick = function() { view = home.slice(); draw(); };
+    
+    // click a class in the legend to hide or show it
+    data.classes.forEach(function(name, c) {
+      var entry = document.getElementById(id + "_class_" + c);
+      entry.onclick = function() {
+        shown[c] = !shown[c];
+        entry.style.opacity = shown[c] ? 1 : 0.3;
+        draw();
+      };
+    });
+    
+    draw();
+  };
+}
+"""
+
 # Helper methods
 
 def __check_input(output_dir, num_of_loadings=0):
@@ -62,68 +286,99 @@ def __partition_abundance_data(profile):
     Returns:
         New partitioned DataFrame.
     """
-    abundances_to_class = dict()
+    return distances.partition_abundance_data(profile)
 
-    for k in list(profile.references.keys()):
-        abundances_to_class[k] = profile.abundance_data.loc[profile.references[k]]
-    
-    return pd.concat(list(abundances_to_class.values()))
-
-def __get_eig_pairs(data, dist_type):
-    """ Computes eigenvalues and eigenvectors for this matrix. Calculated
-    using methods described in Numerical Ecology (pp 391-443, Legendre 1998).
+def __ordinate(profile, method, dist_type=None, reference=None, ordination_file=None):
+    """ Fit an ordination to this profile, or project its samples onto an existing one.
     
     Args:
-        data (pandas.DataFrame): a sorted (by sample class) matrix 
-            containing abundance data.
-        dist_type (str) : distance metric to use (Euclidean for PCA)
+        profile (metagenomic_profile): profile instance containing data.
+        method (str): "pcoa" or "pca".
+        dist_type (str, default=None): distance metric to use for a PCoA.
+        reference (ordination.ordination, default=None): previously fitted ordination. If 
+            given, samples are projected onto it instead of fitting a new one.
+        ordination_file (str, default=None): if given, the fitted ordination is saved here.
+    
+    Raises:
+        ValueError: if the reference ordination does not match the method or distance metric.
     
     Returns:
-        List of pairs of eigenvalues and eigenvectors.
+        Partitioned DataFrame, samples x axes coordinates and the ordination used.
     """
-    dist_matrix = pairwise_distances(data, metric=dist_type)
+    df = __partition_abundance_data(profile)
     
-    # 9.20
-    A_matrix = np.linalg.matrix_power(dist_matrix, 2) / -2
-    n = int(A_matrix.shape[0])
-    a_mean = np.mean(A_matrix)
+    if reference is not None:
+        if reference.method != method or (method == "pcoa" and reference.dist_type != dist_type):
+            raise ValueError("Reference ordination was not fitted with " + method + 
+                             ("" if dist_type is None else " (" + dist_type + ")") + ".")
+        return df, reference.project(df), reference
     
-    # 9.21
-    ctr_matrix = [[0 for i in range(n)] for j in range(n)]
+    if method == "pca":
+        fitted = ordination.fit_pca(df)
+    else:
+        fitted = ordination.shared_pcoa(df, dist_type, dist_matrix=distances.distance_matrix(df, dist_type))
     
-    for i in range(n):
-        for j in range(n):
-            s = A_matrix[i][j] - np.mean(A_matrix[i][:]) - np.mean(A_matrix[:][j]) + a_mean
-            ctr_matrix[i][j] = s
+    if ordination_file is not None:
+        fitted.save(ordination_file)
     
-    eig_val, eig_vec = np.linalg.eig(ctr_matrix)
-    eig_pairs = [(eig_val[i], eig_vec[:,i]) for i in range(len(eig_val))]
-            
-    return eig_pairs
+    return df, fitted.coordinates, fitted
 
-def __get_loadings(rotation):
-    """ Get loadings for this matrix.     
+def __get_loadings(rotation, num_of_loadings):
+    """ Get the largest loadings for this matrix. The norms of all loading vectors are
+    computed at once and only the top num_of_loadings are selected and sorted.
     
     Args:
         rotatation (pandas.DataFrame): matrix of features x principal components
+        num_of_loadings (int): number of loadings to return.
         
     Returns: 
-        List of all loading factors in the form: 
+        List of the largest loading factors in the form: 
         (feature name, loading vector norm, loading vector) sorted by vector norm.
 
     """
-    all_loadings = list()
-    for i in rotation.index:
-        all_loadings.append((i, float(np.linalg.norm(rotation.loc[i])), list(rotation.loc[i])))
+    values = rotation.values
+    norms = np.sqrt((values ** 2).sum(axis=1))
+    
+    k = min(num_of_loadings, len(norms))
+    top = np.argpartition(-norms, k - 1)[:k]
+    top = top[np.argsort(-norms[top])]
+    
+    return [(rotation.index[i], float(norms[i]), list(values[i])) for i in top]
+
+def __write_loadings(rotation, fname):
+    """ Write the loadings of every feature to file, sorted by the norm of the loading vector. 
+    The contribution of a feature to a component is its squared loading as a percentage 
+    of the sum of squared loadings of that component.
+    
+    Args:
+        rotatation (pandas.DataFrame): matrix of features x principal components
+        fname (str): path of the .tab file to write.
         
-    all_loadings = sorted(all_loadings, reverse=True, key= lambda triple: triple[1])
+    Returns:
+        Path to output.
+    """
+    values = rotation.values
+    squared = values ** 2
+    contribution = 100 * squared / squared.sum(axis=0)
+    
+    table = pd.DataFrame(index=rotation.index)
+    for c in range(values.shape[1]):
+        table["PC" + str(c + 1) + " loading"] = values[:, c]
+    table["norm"] = np.sqrt(squared.sum(axis=1))
+    for c in range(values.shape[1]):
+        table["PC" + str(c + 1) + " contribution (%)"] = contribution[:, c]
     
-    return all_loadings
+    table = table.iloc[np.argsort(-table["norm"].values, kind="mergesort")]
+    table.index.name = "feature"
+    table.to_csv(fname, sep="\t", float_format="%.6g")
     
-def __plot_markers(profile, PC1, PC2, msize=5, a=0.9):
-    """Plot markers on the current plot.
+    return fname
+    
+def __plot_markers(ax, profile, PC1, PC2, msize=5, a=0.9):
+    """Plot markers on these axes.
     
     Args:
+        ax (matplotlib.axes.Axes): axes to plot on.
         PC1 (list or seq): 1st PC/PCo
         PC2 (list or seq): 2nd PC/PCo
         msize (int, default=5): size of plot markers. 
@@ -135,55 +390,14 @@ def __plot_markers(profile, PC1, PC2, msize=5, a=0.9):
     for k in list(profile.references.keys()):
         n = len(profile.references[k]) # number of samples in this class
 
-        plt.plot(PC1[prev:n+prev], PC2[prev:n+prev], markers[marker_index], 
-                     markersize=5, alpha=0.9, color=colors[color_index], label=k)
+        ax.plot(PC1[prev:n+prev], PC2[prev:n+prev], markers[marker_index], 
+                markersize=5, alpha=0.9, color=colors[color_index], label=k)
 
         marker_index = (marker_index + 1) % len(markers) # enable wrap around
         color_index = (color_index + 1) % len(colors)
         prev += n
         i += 1
 
-def __plot_markers_interactive(profile, PC1, PC2, a=0.9):
-    """Plot markers on the current plot.
-    
-    Args:
-        PC1 (list or seq): 1st PC/PCo
-        PC2 (list or seq): 2nd PC/PCo
-        a (int or float, default=0.9): transparency of markers.
-        
-    Returns:
-        Dictionary of legend labels mapping labels to color patches. 
-    """
-    import mpld3 # Provides interactive graphs 
-    
-    fig, ax = plt.subplots()
-    
-    fig.set_size_inches(12, 12)    
-    
-    marker_index = color_index = prev = i = 0    
-    
-    lgd_labels = dict() # for creating the legend    
-    
-    for k in list(profile.references.keys()):
-        n = len(profile.references[k])
-        
-        scatter = ax.scatter(PC1[prev:n+prev], PC2[prev:n+prev], marker=markers[marker_index],
-                             alpha=0.9, color=colors[color_index], label=k)
-        
-        lgd_labels[k] = mpatches.Patch(color=colors[color_index], label=k)
-                     
-        marker_index = (marker_index + 1) % len(markers) # enable wrap around
-        color_index = (color_index + 1) % len(colors)
-        prev += n
-        i += 1
-        
-        labels = profile.references[k]
-        
-        tooltip = mpld3.plugins.PointHTMLTooltip(scatter, labels=labels)   
-        mpld3.plugins.connect(fig, tooltip)
-        
-    return lgd_labels
-        
 def __scale_loading(x_range, y_range, x_cor, y_cor):
     """ Scale this loading vector to fit on the plot.
     
@@ -204,19 +418,18 @@ def __scale_loading(x_range, y_range, x_cor, y_cor):
     
     return normalized[0]*scale_factor, normalized[1]*scale_factor
         
-def __plot_loadings(loadings, num_of_loadings, sz=6, interactive=False):
+def __plot_loadings(ax, loadings, num_of_loadings, sz=6):
     """Plot loadings for this plot.
     
     Args:
+        ax (matplotlib.axes.Axes): axes to plot on.
         loadings (list[ ]):
         num_of_loadings (int): number of loadings to be plotted. 
         sz (int, default=6): Font size for annotations.
-        interactive (bool, default=False): If True arrow dimensions are altered for better 
-            visibility on interactive plots.
     """
     
-    x_range = abs(plt.xlim()[0]) + abs(plt.xlim()[1])
-    y_range = abs(plt.ylim()[0]) + abs(plt.ylim()[1])
+    x_range = abs(ax.get_xlim()[0]) + abs(ax.get_xlim()[1])
+    y_range = abs(ax.get_ylim()[0]) + abs(ax.get_ylim()[1])
     
     for i in range(num_of_loadings):
         x_cor = loadings[i][2][0] 
@@ -224,36 +437,197 @@ def __plot_loadings(loadings, num_of_loadings, sz=6, interactive=False):
         
         vec_x, vec_y = __scale_loading(x_range, y_range, x_cor, y_cor)        
         
-        if not interactive:
-            plt.arrow(0, 0, vec_x, vec_y, head_width=0.000625, 
-                      head_length=0.000625, width=0.0001, color='black')
-            name = loadings[i][0].replace(" ", "\n")
-        else:
-            plt.plot([0, vec_x], [0, vec_y], color='black')
-            name = loadings[i][0]
+        ax.arrow(0, 0, vec_x, vec_y, head_width=0.000625, 
+                 head_length=0.000625, width=0.0001, color='black')
+        name = loadings[i][0].replace(" ", "\n")
             
-        plt.annotate(xy=(vec_x, vec_y), s=name, size=sz, 
-                   bbox=dict(facecolor='w', edgecolor='none', alpha=0.75))
+        ax.annotate(name, xy=(vec_x, vec_y), size=sz, 
+                    bbox=dict(facecolor='w', edgecolor='none', alpha=0.75))
 
-def __create_legend(lgd_labels, output_dir):
+def __ordination_payload(profile, PC1, PC2, axis_labels, loadings=None):
+    """ Encode the samples of an interactive ordination plot as JSON. The coordinates are 
+    quantized to 16 bit integers between the bounds of each axis and base64 encoded; the
+    class of each sample follows from the number of samples per class.
     
-    lgd_fig = plt.figure(figsize=(6,4))
-    lf = lgd_fig.legend(handles=list(lgd_labels.values()), labels=list(lgd_labels.keys()),
-                        loc="center", ncol=2, fontsize=12)
-                        
-    lf.get_frame().set_linewidth(0.0)
-    lgd_fig.canvas.draw()
+    Args:
+        profile (metagenomic_profile): profile instance containing data.
+        PC1 (list or seq): 1st PC/PCo
+        PC2 (list or seq): 2nd PC/PCo
+        axis_labels (tuple): labels of the x and y axes.
+        loadings (list, default=None): loadings to draw, from __get_loadings.
+        
+    Returns:
+        JSON string.
+    """
+    x = np.asarray(PC1).real.astype(float)
+    y = np.asarray(PC2).real.astype(float)
+    scale = np.iinfo(np.uint16).max
+    
+    bounds = list()
+    for v in [x, y]:
+        lo, hi = float(v.min()), float(v.max())
+        if hi == lo:
+            lo, hi = lo - 1, hi + 1
+        bounds += [lo, hi]
+    
+    # loading vectors scaled as on the static plot, the initial view shows their tips too
+    vectors = list()
+    if loadings is not None:
+        x_range = abs(bounds[0]) + abs(bounds[1])
+        y_range = abs(bounds[2]) + abs(bounds[3])
+        for name, norm, loading in loadings:
+            vec_x, vec_y = __scale_loading(x_range, y_range, loading[0].real, loading[1].real)
+            vectors.append([str(name), float(vec_x), float(vec_y)])
+    extent = [min([bounds[0]] + [v[1] for v in vectors]), max([bounds[1]] + [v[1] for v in vectors]), 
+              min([bounds[2]] + [v[2] for v in vectors]), max([bounds[3]] + [v[2] for v in vectors])]
+    
+    def quantize(v, lo, hi):
+        return base64.b64encode(np.round((v - lo) / (hi - lo) * scale).astype('<u2').tobytes()).decode('ascii')
+    
+    classes = list(profile.references.keys())
+    payload = {"classes": [str(c) for c in classes],
+               "sizes": [len(profile.references[c]) for c in classes],
+               "samples": [str(label) for c in classes for label in profile.references[c]],
+               "colors": [colors[i % len(colors)] for i in range(len(classes))],
+               "markers": [markers[i % len(markers)] for i in range(len(classes))],
+               "labels": list(axis_labels),
+               "loadings": vectors,
+               "bins": BIN_POINTS,
+               "scale": int(scale),
+               "bounds": bounds + extent,
+               "x": quantize(x, bounds[0], bounds[1]),
+               "y": quantize(y, bounds[2], bounds[3])}
+    
+    return json.dumps(payload).replace("</", "<\\/")
+    
+def __draw_ordination(profile, PCo1, PCo2, fname, axis_labels=("PCo1", "PCo2"), output=None):
+    """ Draw a static PCoA (or NMDS) plot and save it.
     
-    lgd_fig.savefig(output_dir + "/legend.png", bbox_inches=lf.get_window_extent().transformed(lgd_fig.dpi_scale_trans.inverted()))
+    Args:
+        profile (metagenomic_profile): profile instance containing data.
+        PCo1 (list or seq): 1st PCo
+        PCo2 (list or seq): 2nd PCo
+        fname (str): path of the image to save.
+        axis_labels (tuple, default=("PCo1", "PCo2")): labels of the x and y axes.
+        output (dict, default=None): output options of the test block, see rendering.save_figure.
         
-    lgd_fname = output_dir + "/" + "legend.png"
-    lgd_fig.savefig(lgd_fname, bbox_inches=lf.get_window_extent().transformed(lgd_fig.dpi_scale_trans.inverted()))
+    Returns:
+        Path to output.
+    """
+    cache_key = render_cache.key("ordination", PCo1, PCo2, profile.references, axis_labels, rendering.relative_path(fname), output)
+    if render_cache.fetch(cache_key, [fname]):
+        return fname
     
-    return lgd_fname
+    fig = rendering.new_figure()
+    ax = fig.add_subplot(111)
+    
+    __plot_markers(ax, profile, PCo1, PCo2) # Main plotting
+    
+    ax.set_xlabel(axis_labels[0])
+    ax.set_ylabel(axis_labels[1])
+    
+    # Set up legend 
+    handles, labels = ax.get_legend_handles_labels()
+    lgd = ax.legend(handles, labels, loc="upper center", bbox_to_anchor=(0.5, -0.1), numpoints=1)
+    
+    rendering.save_figure(fig, fname, output, bbox_extra_artists=(lgd,), bbox_inches='tight')
+    
+    render_cache.store(cache_key, [fname])
+    
+    return fname
+
+def __draw_ordination_interactive(profile, PCo1, PCo2, fname, axis_labels=("PCo1", "PCo2"), loadings=None):
+    """ Draw an interactive PCoA, PCA or NMDS plot and save it as an html fragment. The 
+    coordinates and sample labels are saved once as a compact JSON payload and drawn on 
+    a canvas in the browser, which supports zooming, moving, hovering over samples and 
+    hiding classes. When more than BIN_POINTS samples are in view, the density of each 
+    class is drawn instead of the samples.
+    
+    Args:
+        profile (metagenomic_profile): profile instance containing data.
+        PCo1 (list or seq): 1st PCo
+        PCo2 (list or seq): 2nd PCo
+        fname (str): path of the html file to save.
+        axis_labels (tuple, default=("PCo1", "PCo2")): labels of the x and y axes.
+        loadings (list, default=None): loadings to draw, from __get_loadings.
+        
+    Returns:
+        Path to output.
+    """
+    cache_key = render_cache.key("ordination_interactive", PCo1, PCo2, profile.references, axis_labels, loadings, 
+                                 rendering.relative_path(fname))
+    if render_cache.fetch(cache_key, [fname]):
+        return fname
+    
+    payload = __ordination_payload(profile, PCo1, PCo2, axis_labels, loadings)
+    
+    plot_id = "ordination_" + hashlib.md5(rendering.relative_path(fname).encode("utf-8")).hexdigest()[:8]
+    
+    with timing.timed("save", fname):
+        f = open(fname, 'w')
+        f.write('<div style="position:relative; width:' + str(INTERACTIVE_SIZE[0]) + 'px; margin:auto">\n')
+        f.write('<canvas id="' + plot_id + '_canvas" width="' + str(INTERACTIVE_SIZE[0]) + '" height="' + 
+                str(INTERACTIVE_SIZE[1]) + '"></canvas>\n')
+        f.write('<div id="' + plot_id + '_tip" style="position:absolute; display:none; pointer-events:none; ' + 
+                'background:white; border:1px solid gray; padding:2px 4px; font-size:12px"></div>\n')
+        
+        # legend, click a class to hide it
+        f.write('<div style="font-size:12px; text-align:center">\n')
+        for c, k in enumerate(profile.references.keys()):
+            f.write('<span id="' + plot_id + '_class_' + str(c) + '" style="cursor:pointer; margin-right:12px">' + 
+                    '<span style="display:inline-block; width:12px; height:12px; background:' + colors[c % len(colors)] + 
+                    '"></span> ' + str(k) + '</span>\n')
+        f.write('</div>\n')
+        f.write('<div style="font-size:12px; text-align:center">Scroll to zoom, drag to move, double click to reset. ' + 
+                'Click a class to hide or show it.</div>\n')
+        
+        f.write('<script type="application/json" id="' + plot_id + '_data">' + payload + '</script>\n')
+        f.write(generate_html.shared_script("ordinationPlot", ORDINATION_JS))
+        f.write(generate_html.run_script(plot_id + "_canvas", "ordinationPlot", [plot_id]))
+        f.write('</div>\n')
+        f.close()
+    
+    render_cache.store(cache_key, [fname])
+    
+    return fname
+
+def __write_concordance(dist_types, dist_matrices, fits, output_dir, permutations, workers, seed):
+    """ Compare the PCoAs of several distance metrics on the same samples. Each pair 
+    of metrics is compared with a Mantel test of the distance matrices and the 
+    Procrustes disparity (m^2) of the first two principal coordinates.
+    
+    Args:
+        dist_types (list[str]): distance metrics.
+        dist_matrices (list[numpy.ndarray]): distance matrix of each metric.
+        fits (list[ordination.ordination]): PCoA of each metric.
+        output_dir (str): directory to save output.
+        permutations (int): number of permutations of each Mantel test.
+        workers (int): number of processes running the permutations.
+        seed (int): seed for the permutations.
+        
+    Returns:
+        Path to output.
+    """
+    fname = output_dir + "/" + "pcoa_concordance.tab"
+    f = open(fname, 'w')
+    f.write('metric 1\tmetric 2\tmantel r\tmantel p-val\tpermutations\tprocrustes m2\n')
+    
+    for i in range(len(dist_types) - 1):
+        for j in range(i + 1, len(dist_types)):
+            mantel_r, p = permanova.mantel(dist_matrices[i], dist_matrices[j], permutations=permutations, 
+                                           workers=workers, seed=seed)
+            disparity = procrustes(fits[i].coordinates[:, :2], fits[j].coordinates[:, :2])[2]
+            f.write(dist_types[i] + "\t" + dist_types[j] + "\t" + ("%.4f" % mantel_r) + "\t" + ("%.4g" % p) + "\t" + 
+                    str(permutations) + "\t" + ("%.4f" % disparity) + "\n")
+    
+    f.close()
+    
+    return fname
     
 # General methods 
 
-def pca_plot(profile, output_dir, filename="pca.png", num_of_loadings=3):
+def pca_plot(profile, output_dir, filename="pca.png", num_of_loadings=3, reference=None, ordination_file=None, 
+             loadings_file=None, output=None):
     """Generate PCA plot. A PCA is a PCoA with a Euclidean distance metric. Non-interactive. 
     
     Args:
@@ -261,221 +635,366 @@ def pca_plot(profile, output_dir, filename="pca.png", num_of_loadings=3):
         output_dir (str): path to directory to save output
         filename (str, default="pca.png"): name of png file to be saved. 
         num_of_loadings (int, default=3, max=5, min=0): number of loadings to display.
+        reference (ordination.ordination, default=None): previously fitted PCA to project 
+            the samples onto instead of fitting a new one.
+        ordination_file (str, default=None): path to save the fitted PCA to.
+        loadings_file (str, default=None): path to save the loadings of all features to.
+        output (dict, default=None): output options of the test block, see rendering.save_figure.
         
     Returns:
         Path to output.
     """
     __check_input(output_dir, num_of_loadings)
     
-    df = __partition_abundance_data(profile)
-
-    my_pca = PCA(n_components=2)
-    df_new = my_pca.fit_transform(df).T
+    df, coords, fitted = __ordinate(profile, "pca", reference=reference, ordination_file=ordination_file)
 
     # matrix of variable loadings
-    rotation = pd.DataFrame(my_pca.components_.T, index=df.columns, columns=[1, 2])
+    rotation = pd.DataFrame(fitted.components[:2].T, index=fitted.features, columns=[1, 2])
     
     if num_of_loadings > 0:
-        loadings = __get_loadings(rotation)
+        loadings = __get_loadings(rotation, num_of_loadings)
+    
+    if loadings_file is not None:
+        __write_loadings(rotation, loadings_file)
     
-    PC1 = df_new[:][0]
-    PC2 = df_new[:][1]
-    PC1_variance, PC2_variance = my_pca.explained_variance_ratio_[0]*100, my_pca.explained_variance_ratio_[1]*100
+    PC1 = coords[:, 0]
+    PC2 = coords[:, 1]
+    PC1_variance, PC2_variance = fitted.explained_variance_ratio[0]*100, fitted.explained_variance_ratio[1]*100
+    
+    fname = rendering.plot_file(output_dir, "pca", output)
+    
+    cache_key = render_cache.key("pca", PC1, PC2, PC1_variance, PC2_variance, profile.references, 
+                                 loadings if num_of_loadings > 0 else None, rendering.relative_path(fname), output)
+    if render_cache.fetch(cache_key, [fname]):
+        return fname
 
     # Begin plotting
 
-    # Clear any current figures from the plot
-    plt.clf()
-
-    ax = plt.subplot(111)
+    fig = rendering.new_figure()
+    ax = fig.add_subplot(111)
     
-    __plot_markers(profile, PC1, PC2) # Main plotting 
+    __plot_markers(ax, profile, PC1, PC2) # Main plotting 
 
     # Plot the loadings 
     if num_of_loadings > 0:
-        __plot_loadings(loadings, num_of_loadings)
+        __plot_loadings(ax, loadings, num_of_loadings)
     
-    plt.xlabel("PC1" + " (" + str(round(PC1_variance, 2)) + "%)")
-    plt.ylabel("PC2" + " (" + str(round(PC2_variance, 2)) + "%)")
+    ax.set_xlabel("PC1" + " (" + str(round(PC1_variance, 2)) + "%)")
+    ax.set_ylabel("PC2" + " (" + str(round(PC2_variance, 2)) + "%)")
     
     # Set up legend 
     handles, labels = ax.get_legend_handles_labels()
     lgd = ax.legend(handles, labels, loc="upper center", bbox_to_anchor=(0.5, -0.1), numpoints=1) 
 
     # Rescale axes to fit loading vectors
-    ax = plt.gca()
     ax.relim()
     ax.autoscale_view()
     
-    fname = output_dir + "/" + "pca.png"    
+    rendering.save_figure(fig, fname, output, bbox_extra_artists=(lgd,), bbox_inches='tight')
     
-    plt.savefig(fname, bbox_extra_artists=(lgd,), bbox_inches='tight', dpi=(200))
+    render_cache.store(cache_key, [fname])
     
     return fname
     
-def pcoa_plot(profile, output_dir, dist_type):
-    """Generate PCoA plot. Non-interactive. Saves png file "pcoa_(dist_type).png."
+def pcoa_plot(profile, output_dir, dist_type, reference=None, ordination_file=None, output=None):
+    """Generate PCoA plot. Non-interactive. Saves image "pcoa_(dist_type).png" (or the extension of the output format).
     
     Args:
         profile (metagenomic profile):  profile instance containing abundance data. 
         output_dir (str): directory to save output. 
         dist_type (str): distance metric to use for PCoA. 
+        reference (ordination.ordination, default=None): previously fitted PCoA to project 
+            the samples onto instead of fitting a new one.
+        ordination_file (str, default=None): path to save the fitted PCoA to.
+        output (dict, default=None): output options of the test block, see rendering.save_figure.
         
     Returns:
         Path to output.
     """
     __check_input(output_dir)    
     
-    df = __partition_abundance_data(profile)
-    eig_pairs = __get_eig_pairs(df, dist_type)
-    
-    eig_pairs.sort()
-    eig_pairs.reverse()    
+    df, coords, fitted = __ordinate(profile, "pcoa", dist_type=dist_type, reference=reference, 
+                                    ordination_file=ordination_file)
             
-    PCo1 = eig_pairs[0][1]
-    PCo2 = eig_pairs[1][1]
-    
-    # Begin plotting
-
-    # Clear any current figures from the plot
-    plt.clf()
+    return __draw_ordination(profile, coords[:, 0], coords[:, 1], rendering.plot_file(output_dir, "pcoa_" + dist_type, output), 
+                             output=output)
 
-    ax = plt.subplot(111)
-    
-    __plot_markers(profile, PCo1, PCo2) # Main plotting
+def pca_plot_interactive(profile, output_dir, num_of_loadings=3, reference=None, ordination_file=None, 
+                         loadings_file=None):
+    """Generate interactive PCA plot. Saves html file "pca.html."
     
-    plt.xlabel("PCo1")
-    plt.ylabel("PCo2")
+    Args:
+        profile (metagenomic_profile): profile containing abundance data to be plotted. 
+        output_dir (str): path to directory to save output.
+        num_of_loadings (int, default=3, max=5, min=0): number of loadings to plot.
+        reference (ordination.ordination, default=None): previously fitted PCA to project 
+            the samples onto instead of fitting a new one.
+        ordination_file (str, default=None): path to save the fitted PCA to.
+        loadings_file (str, default=None): path to save the loadings of all features to.
+        
+    Returns:
+        Path to output file.
+    """
+    __check_input(output_dir, num_of_loadings)
     
-    # Set up legend 
-    handles, labels = ax.get_legend_handles_labels()
-    lgd = ax.legend(handles, labels, loc="upper center", bbox_to_anchor=(0.5, -0.1), numpoints=1)
+    df, coords, fitted = __ordinate(profile, "pca", reference=reference, ordination_file=ordination_file)
+
+    # matrix of variable loadings
+    rotation = pd.DataFrame(fitted.components[:2].T, index=fitted.features, columns=[1, 2])
     
-    fname = output_dir + "/" + "pcoa_" + dist_type + ".png"    
+    loadings = __get_loadings(rotation, num_of_loadings) if num_of_loadings > 0 else None
     
-    plt.savefig(fname, bbox_extra_artists=(lgd,), bbox_inches='tight', dpi=(200))
+    if loadings_file is not None:
+        __write_loadings(rotation, loadings_file)
     
-    plt.clf()
+    PC1_variance, PC2_variance = fitted.explained_variance_ratio[0]*100, fitted.explained_variance_ratio[1]*100
+    axis_labels = ("PC1" + " (" + str(round(PC1_variance, 2)) + "%)", "PC2" + " (" + str(round(PC2_variance, 2)) + "%)")
     
-    return fname
+    return __draw_ordination_interactive(profile, coords[:, 0], coords[:, 1], output_dir + "/" + "pca.html", 
+                                         axis_labels=axis_labels, loadings=loadings)
 
-def pca_plot_interactive(profile, output_dir, num_of_loadings=3):
-    """Generate interactive PCA plot. Saves html file "pca.html."
+def pcoa_plot_interactive(profile, output_dir, dist_type, reference=None, ordination_file=None):
+    """Generate interactive PCoA plot.
     
     Args:
-        profile (metagenomic_profile): profile containing abundance data to be plotted. 
-        output_dir (str): path to directory to save output.
-        num_of_loadings (int, default=3, max=5, min=0): number of loadings to plot.
+        profile (metagenomic_profile): Profile instance containing data. 
+        output_dir (str): path to directory to save output
+        dist_type (str): distance metric to use in PCoA.
+        reference (ordination.ordination, default=None): previously fitted PCoA to project 
+            the samples onto instead of fitting a new one.
+        ordination_file (str, default=None): path to save the fitted PCoA to.
         
     Returns:
-        Path to output file.
+        Path to output file. 
     """
+    __check_input(output_dir)
     
-    try:
-        import mpld3 # Provides interactive graphs 
-        import plugins # Custom mpld3 plugins
-    except ImportError:
-        print("Could not import mpld3. Please install mpld3 or set 'interactive_plots' option to 'false.'")
-        return
+    df, coords, fitted = __ordinate(profile, "pcoa", dist_type=dist_type, reference=reference, 
+                                    ordination_file=ordination_file)
+            
+    fname = output_dir + "/" + "pcoa_" + dist_type + ".html"
+    
+    return __draw_ordination_interactive(profile, coords[:, 0], coords[:, 1], fname)
+
+def multi_pcoa_plot(profile, output_dir, dist_types, workers=None, interactive=False, output=None, permutations=999, 
+                    seed=None):
+    """Generate one PCoA plot per distance metric. The data is partitioned once, the 
+    distance matrices are computed concurrently and a concordance table comparing the 
+    metrics is saved as "pcoa_concordance.tab."
+    
+    Args:
+        profile (metagenomic_profile): profile instance containing data.
+        output_dir (str): directory to save output.
+        dist_types (list[str]): distance metrics to use.
+        workers (int, default=None): number of processes computing distance matrices. 
+            Defaults to the number of cores.
+        interactive (bool, default=False): if True, save interactive html plots instead of images.
+        output (dict, default=None): output options of the images, see rendering.save_figure.
+        permutations (int, default=999): number of permutations of the Mantel tests in the 
+            concordance table.
+        seed (int, default=None): seed for the permutations.
         
-    __check_input(output_dir, num_of_loadings)
+    Returns:
+        List of (distance metric, path to plot), path to concordance table.
+    """
+    __check_input(output_dir)
     
     df = __partition_abundance_data(profile)
+    dist_matrices = distances.distance_matrices(df, dist_types, workers=workers)
+    fits = [ordination.shared_pcoa(df, dist_types[i], dist_matrix=dist_matrices[i]) for i in range(len(dist_types))]
+    
+    outputs = list()
+    for dist_type, fitted in zip(dist_types, fits):
+        PCo1, PCo2 = fitted.coordinates[:, 0], fitted.coordinates[:, 1]
+        if interactive:
+            fname = __draw_ordination_interactive(profile, PCo1, PCo2, output_dir + "/" + "pcoa_" + dist_type + ".html")
+        else:
+            fname = __draw_ordination(profile, PCo1, PCo2, rendering.plot_file(output_dir, "pcoa_" + dist_type, output), 
+                                      output=output)
+        outputs.append((dist_type, fname))
     
-    my_pca = PCA(n_components=2)
-    df_new = my_pca.fit_transform(df).T
+    concordance = __write_concordance(dist_types, dist_matrices, fits, output_dir, permutations, workers, seed)
+    
+    return outputs, concordance
 
-    # matrix of variable loadings
-    rotation = pd.DataFrame(my_pca.components_.T, index=df.columns, columns=[1, 2])
+def fit_nmds(profile, dist_type, starts=20, workers=None, seed=None):
+    """ Fit an NMDS to this profile, warm-started from its PCoA. The fit is made once and
+    shared by later calls with the same data and options (see nmds.shared_nmds).
     
-    if num_of_loadings > 0:
-        loadings = __get_loadings(rotation)
+    Args:
+        profile (metagenomic profile): profile instance containing abundance data. 
+        dist_type (str): distance metric to use for NMDS. 
+        starts (int, default=20): maximum number of random starts, in addition to the PCoA warm start.
+        workers (int, default=None): number of processes running starts. Defaults to the number of cores.
+        seed (int, default=None): seed for the random starts.
+    
+    Returns:
+        Tuple (n x 2 configuration, stress-1).
+    """
+    df = __partition_abundance_data(profile)
+    dist_matrix = distances.distance_matrix(df, dist_type)
+    
+    warm_start = ordination.shared_pcoa(df, dist_type, dist_matrix=dist_matrix).coordinates[:, :2]
+    
+    return nmds.shared_nmds(df, dist_type, dist_matrix, init=warm_start, starts=starts, workers=workers, seed=seed)
 
-    PC1 = df_new[:][0]
-    PC2 = df_new[:][1]
+def nmds_plot(profile, output_dir, dist_type, starts=20, workers=None, seed=None, output=None, fit=None):
+    """Generate NMDS plot. Non-interactive. Saves image "nmds_(dist_type).png" (or the extension of the output format).
     
-    PC1_variance, PC2_variance = my_pca.explained_variance_ratio_[0]*100, my_pca.explained_variance_ratio_[1]*100
+    Args:
+        profile (metagenomic profile): profile instance containing abundance data. 
+        output_dir (str): directory to save output. 
+        dist_type (str): distance metric to use for NMDS. 
+        starts (int, default=20): maximum number of random starts, in addition to the PCoA warm start.
+        workers (int, default=None): number of processes running starts. Defaults to the number of cores.
+        seed (int, default=None): seed for the random starts.
+        output (dict, default=None): output options of the test block, see rendering.save_figure.
+        fit (default=None): (configuration, stress) from fit_nmds. Fitted here if None.
+        
+    Returns:
+        Path to output, final stress.
+    """
+    __check_input(output_dir)
     
-    # Begin plotting
+    coords, stress = fit if fit is not None else fit_nmds(profile, dist_type, starts=starts, workers=workers, seed=seed)
+    
+    fname = rendering.plot_file(output_dir, "nmds_" + dist_type, output)
+    
+    return __draw_ordination(profile, coords[:, 0], coords[:, 1], fname, axis_labels=("NMDS1", "NMDS2"), output=output), stress
 
-    # Clear any current figures from the plot
-    plt.clf()
+def nmds_plot_interactive(profile, output_dir, dist_type, starts=20, workers=None, seed=None, fit=None):
+    """Generate interactive NMDS plot. Saves html file "nmds_(dist_type).html."
     
-    lgd_labels = __plot_markers_interactive(profile, PC1, PC2, a=0.7) # Main plotting 
+    Args:
+        profile (metagenomic profile): profile instance containing abundance data. 
+        output_dir (str): directory to save output. 
+        dist_type (str): distance metric to use for NMDS. 
+        starts (int, default=20): maximum number of random starts, in addition to the PCoA warm start.
+        workers (int, default=None): number of processes running starts. Defaults to the number of cores.
+        seed (int, default=None): seed for the random starts.
+        fit (default=None): (configuration, stress) from fit_nmds. Fitted here if None.
+        
+    Returns:
+        Path to output, final stress.
+    """
+    __check_input(output_dir)
     
-    # Plot the loadings 
-    if num_of_loadings > 0:
-        __plot_loadings(loadings, num_of_loadings, sz=10, interactive=True)
+    coords, stress = fit if fit is not None else fit_nmds(profile, dist_type, starts=starts, workers=workers, seed=seed)
     
-    # Padding for x and y labels 
-    ax = plt.gca()
-    ax.tick_params(axis='both', which='major', pad=15)
+    fname = output_dir + "/" + "nmds_" + dist_type + ".html"
     
-    plt.xlabel("PC1" + " (" + str(round(PC1_variance, 2)) + "%)", fontsize=16)
-    plt.ylabel("PC2" + " (" + str(round(PC2_variance, 2)) + "%)", fontsize=16)
+    return __draw_ordination_interactive(profile, coords[:, 0], coords[:, 1], fname, axis_labels=("NMDS1", "NMDS2")), stress
+
+def __write_bootstrap_tables(profile, df, coords, variance, fitted, output_dir, prefix):
+    """ Write the bootstrap variance intervals per axis and the spread of each sample to file.
     
-    fname = output_dir + "/" + "pca.html"    
+    Returns:
+        Path to the axes table, path to the samples table.
+    """
+    axes_fname = output_dir + "/" + prefix + "_bootstrap_axes.tab"
+    f = open(axes_fname, 'w')
+    f.write('axis\tvariance (%)\tlower 95% (%)\tupper 95% (%)\n')
+    lower, upper = np.percentile(variance, [2.5, 97.5], axis=0) * 100
+    for a in range(2):
+        f.write(prefix.upper() + str(a + 1) + "\t" + ("%.2f" % (fitted.explained_variance_ratio[a] * 100)) + "\t" + 
+                ("%.2f" % lower[a]) + "\t" + ("%.2f" % upper[a]) + "\n")
+    f.close()
+    
+    classes = list()
+    for k in list(profile.references.keys()):
+        classes += [k] * len(profile.references[k])
     
-    fig = plt.gcf()
+    present = ~np.isnan(coords[:, :, 0])
+    table = pd.DataFrame({"class": classes, "replicates": present.sum(axis=0)}, index=df.index)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning) # samples never drawn have no spread
+        table["sd axis 1"] = np.nanstd(coords[:, :, 0], axis=0)
+        table["sd axis 2"] = np.nanstd(coords[:, :, 1], axis=0)
+    table.index.name = "sample"
     
-    mpld3.plugins.connect(fig, plugins.TweakToolbar())
-    mpld3.save_html(fig, fname)
-        
-    lgd_fname = __create_legend(lgd_labels, output_dir)
+    samples_fname = output_dir + "/" + prefix + "_bootstrap_samples.tab"
+    table.to_csv(samples_fname, sep="\t", float_format="%.4g")
     
-    return fname, lgd_fname
+    return axes_fname, samples_fname
 
-def pcoa_plot_interactive(profile, output_dir, dist_type):
-    """Generate interactive PCoA plot.
+def bootstrap_plot(profile, output_dir, method, dist_type=None, replicates=100, by="samples", workers=None, seed=None, 
+                   output=None):
+    """Generate a PCA or PCoA plot with 95% bootstrap confidence ellipses around each sample. 
+    Non-interactive. Saves image "(method)_bootstrap.png" (or the extension of the output format) and tables of the variance 
+    intervals of each axis and of the spread of each sample.
     
     Args:
-        profile (metagenomic_profile): Profile instance containing data. 
-        output_dir (str): path to directory to save output
-        dist_type (str): distance metric to use in PCoA.
+        profile (metagenomic_profile): profile instance containing data. 
+        output_dir (str): directory to save output. 
+        method (str): "pca" or "pcoa".
+        dist_type (str, default=None): distance metric to use for a PCoA.
+        replicates (int, default=100): number of bootstrap replicates.
+        by (str, default="samples"): resample "samples" or "features". Resampled samples, with
+            their duplicates, reuse the cached distance matrix.
+        workers (int, default=None): number of processes running replicates. Defaults to the number of cores.
+        seed (int, default=None): seed for the resampling.
+        output (dict, default=None): output options of the test block, see rendering.save_figure.
         
     Returns:
-        Path to output file. 
+        Path to output, path to axes table, path to samples table.
     """
-    try:
-        import mpld3 # Provides interactive graphs 
-        import plugins # Custom mpld3 plugins    
-    except ImportError:
-        print("Could not import mpld3. Please install mpld3 or set 'interactive_plots' option to 'false.'")
-        return
-        
     __check_input(output_dir)
     
     df = __partition_abundance_data(profile)
-    eig_pairs = __get_eig_pairs(df, dist_type)
     
-    eig_pairs.sort()
-    eig_pairs.reverse()
-        
-    PCo1 = eig_pairs[0][1]
-    PCo2 = eig_pairs[1][1]
+    if method == "pca":
+        dist_type = "euclidean"
+        fitted = ordination.fit_pca(df)
+    else:
+        fitted = ordination.shared_pcoa(df, dist_type, dist_matrix=distances.distance_matrix(df, dist_type))
+    
+    dist_matrix = distances.distance_matrix(df, dist_type) if by == "samples" else None
+    
+    coords, variance = bootstrap.bootstrap(df.values.astype(float), dist_matrix, fitted.coordinates[:, :2], dist_type, 
+                                           replicates=replicates, by=by, workers=workers, seed=seed)
+    ellipses = bootstrap.confidence_ellipses(coords)
+    
+    prefix = "pc" if method == "pca" else "pco"
+    axes_fname, samples_fname = __write_bootstrap_tables(profile, df, coords, variance, fitted, output_dir, prefix)
+    
+    fname = rendering.plot_file(output_dir, method + ("" if method == "pca" else "_" + dist_type) + "_bootstrap", output)
+    
+    cache_key = render_cache.key("bootstrap", fitted.coordinates[:, :2], fitted.explained_variance_ratio[:2], ellipses, 
+                                 variance, profile.references, rendering.relative_path(fname), output)
+    if render_cache.fetch(cache_key, [fname]):
+        return fname, axes_fname, samples_fname
     
     # Begin plotting
 
-    # Clear any current figures from the plot
-    plt.clf()
+    fig = rendering.new_figure()
+    ax = fig.add_subplot(111)
     
-    lgd_labels = __plot_markers_interactive(profile, PCo1, PCo2, a=0.7) # Main plotting 
-
-    # Padding for x and y labels    
-    ax = plt.gca()
-    ax.tick_params(axis='both', which='major', pad=15)    
+    __plot_markers(ax, profile, fitted.coordinates[:, 0], fitted.coordinates[:, 1]) # Main plotting
     
-    plt.xlabel("PCo1", fontsize=16)
-    plt.ylabel("PCo2", fontsize=16)
+    color_index = prev = 0
+    for k in list(profile.references.keys()):
+        n = len(profile.references[k])
+        for x, y, width, height, angle in ellipses[prev:prev + n]:
+            if not np.isnan(x):
+                ax.add_patch(Ellipse((x, y), width, height, angle=angle, facecolor=colors[color_index], 
+                                     edgecolor='none', alpha=0.15))
+        color_index = (color_index + 1) % len(colors)
+        prev += n
     
-    fname = output_dir + "/" + "pcoa_" + dist_type + ".html"
+    lower, upper = np.percentile(variance, [2.5, 97.5], axis=0) * 100
+    for a, axis_label in enumerate([ax.set_xlabel, ax.set_ylabel]):
+        axis_label(prefix.upper() + str(a + 1) + " (" + str(round(fitted.explained_variance_ratio[a] * 100, 2)) + "%, 95% CI " + 
+                   str(round(lower[a], 2)) + "-" + str(round(upper[a], 2)) + "%)")
     
-    fig = plt.gcf()
+    # Set up legend 
+    handles, labels = ax.get_legend_handles_labels()
+    lgd = ax.legend(handles, labels, loc="upper center", bbox_to_anchor=(0.5, -0.1), numpoints=1)
+    
+    ax.relim()
+    ax.autoscale_view()
     
-    mpld3.plugins.connect(fig, plugins.TweakToolbar())
-    mpld3.save_html(fig, fname)
+    rendering.save_figure(fig, fname, output, bbox_extra_artists=(lgd,), bbox_inches='tight')
     
-    # Create legend 
-    lgd_fname = __create_legend(lgd_labels, output_dir)
+    render_cache.store(cache_key, [fname])
     
-    return fname, lgd_fname
\ No newline at end of file
+    return fname, axes_fname, samples_fname
\ No newline at end of file
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+Perform PERMANOVA and PERMDISP tests on the distance matrix of this data and
+write results to a .tab file. Permutations are evaluated in batches as matrix
+products on the Gower-centered distance matrix and spread across processes.
+The Mantel test comparing two distance matrices uses the same permutation batches.
+"""
+
+# General imports
+import multiprocessing
+import itertools
+
+# Specific imports that must be pre-installed
+import numpy as np
+
+# Internal imports
+import distances
+from ordination import gower_matrix
+
+BATCH_SIZE = 200 # Number of permutations evaluated together in one matrix product.
+MANTEL_BLOCK = 1 << 20 # Largest number of permuted distances a Mantel batch holds at once (8 MB).
+
+# data shared by the permutation batches of one test, set once per worker process
+__worker_state = dict()
+
+# Helper methods
+
+def __init_worker(statistic, data, codes, n_groups, observed):
+    """ Store the data for this test in the worker process.
+
+    Args:
+        statistic (str): "permanova", "permdisp" or "mantel".
+        data (numpy.ndarray): Gower-centered matrix (PERMANOVA), distances to
+            group centroids (PERMDISP) or the standardized distances of the two matrices (Mantel).
+        codes (numpy.ndarray): class code of every sample, or the index of every sample 
+            for a Mantel test.
+        n_groups (int): number of classes.
+        observed (float): statistic of the unpermuted labels.
+    """
+    __worker_state["statistic"] = statistic
+    __worker_state["data"] = data
+    __worker_state["codes"] = codes
+    __worker_state["n_groups"] = n_groups
+    __worker_state["observed"] = observed
+
+def __design(labels, n_groups):
+    """ One-hot encode class labels.
+
+    Args:
+        labels (numpy.ndarray): integer class labels, any shape.
+        n_groups (int): number of classes.
+
+    Returns:
+        Array of shape labels.shape + (n_groups,).
+    """
+    return np.eye(n_groups)[labels]
+
+def __pseudo_f(gower, labels, n_groups):
+    """ PERMANOVA pseudo-F for a batch of labelings (Anderson 2001).
+
+    Args:
+        gower (numpy.ndarray): n x n Gower-centered matrix.
+        labels (numpy.ndarray): B x n matrix of class labels, one labeling per row.
+        n_groups (int): number of classes.
+
+    Returns:
+        Array of B pseudo-F statistics.
+    """
+    n = labels.shape[1]
+    design = __design(labels, n_groups) # B x n x k
+    sizes = design.sum(axis=1)
+
+    # SS_among = trace(H G) with H the projection onto the class indicators
+    ss_among = ((design * np.matmul(gower, design)).sum(axis=1) / sizes).sum(axis=1)
+    ss_within = np.trace(gower) - ss_among
+
+    return (ss_among / (n_groups - 1)) / (ss_within / (n - n_groups))
+
+def __anova_f(values, labels, n_groups):
+    """ One-way ANOVA F statistic for a batch of labelings.
+
+    Args:
+        values (numpy.ndarray): n observations.
+        labels (numpy.ndarray): B x n matrix of class labels, one labeling per row.
+        n_groups (int): number of classes.
+
+    Returns:
+        Array of B F statistics.
+    """
+    n = labels.shape[1]
+    design = __design(labels, n_groups)
+    sizes = design.sum(axis=1)
+    grand_mean = values.mean()
+
+    ss_among = (np.matmul(values, design) ** 2 / sizes).sum(axis=1) - n * grand_mean ** 2
+    ss_within = ((values - grand_mean) ** 2).sum() - ss_among
+
+    return (ss_among / (n_groups - 1)) / (ss_within / (n - n_groups))
+
+def __centroid_distances(gower, codes, n_groups):
+    """ Distance of every sample to the centroid of its class in principal coordinate
+    space, computed directly from the Gower-centered matrix (Anderson 2006).
+
+    Args:
+        gower (numpy.ndarray): n x n Gower-centered matrix.
+        codes (numpy.ndarray): class code of every sample.
+        n_groups (int): number of classes.
+
+    Returns:
+        Array of n distances.
+    """
+    design = __design(codes, n_groups)
+    sizes = design.sum(axis=0)[codes]
+    to_class = gower.dot(design) # sum of G_ij over the members j of each class
+    within = (design * to_class).sum(axis=0)[codes]
+
+    sq_dist = np.diag(gower) - 2 * to_class[np.arange(len(codes)), codes] / sizes + within / sizes ** 2
+
+    # negative eigenvalues of non-Euclidean metrics can push this slightly below zero
+    return np.sqrt(np.clip(sq_dist, 0, None))
+
+def __standardize(dist_matrix):
+    """ Standardize the distances above the diagonal to mean 0 and variance 1.
+
+    Returns:
+        Symmetric n x n matrix of standardized distances with a zero diagonal.
+    """
+    upper = np.triu_indices(dist_matrix.shape[0], 1)
+    values = dist_matrix[upper]
+    result = np.zeros(dist_matrix.shape)
+    result[upper] = (values - values.mean()) / values.std()
+    return result + result.T
+
+def __mantel_r(data, orders):
+    """ Mantel correlation for a batch of permutations of the samples of the second matrix.
+    The permuted matrices are gathered into one orders x n^2 array, a block of at most
+    MANTEL_BLOCK values at a time, and correlated with the first matrix by a single
+    matrix product per block. The diagonals are zero, so each distance counts twice.
+
+    Args:
+        data: tuple (first standardized matrix, second standardized matrix), see
+            __standardize.
+        orders (numpy.ndarray): B x n matrix, one order of the samples per row.
+
+    Returns:
+        Array of B Pearson correlations of the distances above the diagonal.
+    """
+    a, b = data
+    n = b.shape[0]
+    step = max(1, min(len(orders), MANTEL_BLOCK // (n * n)))
+    permuted = np.empty((step, n, n))
+    rows = np.empty((n, n))
+    r = np.empty(len(orders))
+    for start in range(0, len(orders), step):
+        block = orders[start:start + step]
+        for i, order in enumerate(block):
+            np.take(b, order, axis=0, out=rows)
+            np.take(rows, order, axis=1, out=permuted[i])
+        r[start:start + len(block)] = permuted[:len(block)].reshape(len(block), -1).dot(a.ravel())
+    return r / (n * (n - 1))
+
+def __statistic(statistic, data, labels, n_groups):
+    """ Compute the requested statistic for a batch of labelings.
+    """
+    if statistic == "permanova":
+        return __pseudo_f(data, labels, n_groups)
+    if statistic == "mantel":
+        return __mantel_r(data, labels)
+    return __anova_f(data, labels, n_groups)
+
+def __permutation_batch(task):
+    """ Count the permutations in this batch with a statistic at least as large as observed.
+
+    Args:
+        task: tuple (seed, number of permutations).
+
+    Returns:
+        Number of permuted statistics >= the observed statistic.
+    """
+    seed, size = task
+    codes = __worker_state["codes"]
+    observed = __worker_state["observed"]
+
+    rng = np.random.RandomState(seed)
+    labels = codes[np.argsort(rng.rand(size, len(codes)), axis=1)]
+
+    f = __statistic(__worker_state["statistic"], __worker_state["data"], labels, __worker_state["n_groups"])
+
+    return int(np.sum((f >= observed) | np.isclose(f, observed)))
+
+def __count_exceedances(statistic, data, codes, n_groups, observed, permutations, workers, seed):
+    """ Run all permutations for one test, in parallel if more than one worker is requested.
+
+    Returns:
+        Number of permuted statistics >= the observed statistic.
+    """
+    sizes = [BATCH_SIZE] * (permutations // BATCH_SIZE)
+    if permutations % BATCH_SIZE:
+        sizes.append(permutations % BATCH_SIZE)
+    seeds = np.random.RandomState(seed).randint(0, 2**31 - 1, size=len(sizes))
+    tasks = list(zip(seeds, sizes))
+
+    state = (statistic, data, codes, n_groups, observed)
+
+    if workers <= 1 or len(tasks) == 1:
+        __init_worker(*state)
+        return sum(map(__permutation_batch, tasks))
+
+    pool = multiprocessing.Pool(min(workers, len(tasks)), initializer=__init_worker, initargs=state)
+    try:
+        counts = pool.map(__permutation_batch, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    return sum(counts)
+
+def __comparisons(profile):
+    """ List the comparisons to test: all classes together, followed by each pair of
+    classes when there are more than two.
+
+    Returns:
+        List of tuples (comparison name, list of class codes).
+    """
+    names = list(profile.references.keys())
+
+    if len(names) < 2:
+        raise ValueError("At least two classes are required.")
+
+    result = [(" vs ".join(names), list(range(len(names))))]
+
+    if len(names) > 2:
+        for i, j in itertools.combinations(range(len(names)), 2):
+            result.append((names[i] + " vs " + names[j], [i, j]))
+
+    return result
+
+def __test(profile, output_dir, dist_type, statistic, permutations, workers, seed):
+    """ Helper method to perform a PERMANOVA or PERMDISP test.
+
+    Effects:
+        Writes out to the output_dir a .tab file containing the F statistics and p-values.
+
+    Returns:
+        Path to output.
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    dist = distances.profile_distance_matrix(profile, dist_type)
+    all_codes = distances.class_codes(profile)
+
+    fname = output_dir + "/" + statistic + ".tab"
+
+    f = open(fname, 'w')
+    f.write('comparison\t' + ('pseudo-F' if statistic == "permanova" else 'F') + '\tp-val\tpermutations\n')
+
+    for name, members in __comparisons(profile):
+        mask = np.isin(all_codes, members)
+        codes = np.searchsorted(members, all_codes[mask])
+        n_groups = len(members)
+
+        gower = gower_matrix(dist[mask][:, mask])[0]
+
+        if statistic == "permanova":
+            data = gower
+        else:
+            data = __centroid_distances(gower, codes, n_groups)
+
+        observed = float(__statistic(statistic, data, codes[np.newaxis, :], n_groups)[0])
+        exceed = __count_exceedances(statistic, data, codes, n_groups, observed, permutations, workers, seed)
+        p = (exceed + 1.0) / (permutations + 1.0)
+
+        f.write(name + "\t" + ("%.4f" % observed) + "\t" + ("%.4g" % p) + "\t" + str(permutations) + "\n")
+
+    f.close()
+
+    return fname
+
+# Public methods
+
+def permanova(profile, output_dir, dist_type, permutations=999, workers=None, seed=None):
+    """ Perform a PERMANOVA test of the difference in location between classes. Save results to file.
+
+    Args:
+        profile: metagenomic profile instance.
+        output_dir: directory output is saved to.
+        dist_type (str): distance metric to use.
+        permutations (int, default=999): number of label permutations.
+        workers (int, default=None): number of processes to spread the permutations across.
+            Defaults to the number of cores.
+        seed (int, default=None): seed for the permutations.
+
+    Raises:
+        ValueError: if the profile has fewer than two classes.
+
+    Returns:
+        Path to output.
+    """
+    return __test(profile, output_dir, dist_type, "permanova", permutations, workers, seed)
+
+def permdisp(profile, output_dir, dist_type, permutations=999, workers=None, seed=None):
+    """ Perform a PERMDISP test of the homogeneity of dispersion between classes. Save results to file.
+
+    Args:
+        profile: metagenomic profile instance.
+        output_dir: directory output is saved to.
+        dist_type (str): distance metric to use.
+        permutations (int, default=999): number of label permutations.
+        workers (int, default=None): number of processes to spread the permutations across.
+            Defaults to the number of cores.
+        seed (int, default=None): seed for the permutations.
+
+    Raises:
+        ValueError: if the profile has fewer than two classes.
+
+    Returns:
+        Path to output.
+    """
+    return __test(profile, output_dir, dist_type, "permdisp", permutations, workers, seed)
+
+def mantel(dist_matrix_a, dist_matrix_b, permutations=999, workers=None, seed=None):
+    """ Mantel test of the correlation between two distance matrices of the same samples.
+    The samples of the second matrix are permuted to test whether the correlation is 
+    larger than expected by chance.
+
+    Args:
+        dist_matrix_a (numpy.ndarray): n x n distance matrix.
+        dist_matrix_b (numpy.ndarray): n x n distance matrix of the same samples.
+        permutations (int, default=999): number of sample permutations.
+        workers (int, default=None): number of processes to spread the permutations across.
+            Defaults to the number of cores.
+        seed (int, default=None): seed for the permutations.
+
+    Returns:
+        Tuple (Mantel r, one-sided p-value).
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    data = (__standardize(dist_matrix_a), __standardize(dist_matrix_b))
+    codes = np.arange(dist_matrix_a.shape[0])
+
+    observed = __mantel_r(data, codes[np.newaxis, :])[0]
+    exceed = __count_exceedances("mantel", data, codes, None, observed, permutations, workers, seed)
+
+    return observed, (exceed + 1.0) / (permutations + 1.0)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of rendered plots keyed on a hash of everything that goes into them: the
+plotted arrays, the sample and class labels and the render options. When a plot
+with the same key was rendered before, its files are copied into the new output
+directory instead of being drawn again.
+"""
+
+# General imports
+import hashlib
+import os
+import shutil
+import tempfile
+
+# specific imports that must be pre-installed
+import numpy as np
+import pandas as pd
+import matplotlib
+
+# Internal imports
+import timing
+
+CACHE_VERSION = "2" # Change when the renderers change, so plots cached by older versions are not reused.
+
+# directory holding the cached plots, None if caching is off
+__state = {"directory": None}
+
+# Helper methods
+
+def __update(h, part):
+    """ Add one part of a key to this hash.
+
+    Args:
+        h: hashlib hash object.
+        part: numpy array, pandas object, dict, list, tuple, or any object with a stable repr.
+    """
+    if isinstance(part, pd.Index):
+        part = list(part)
+    if isinstance(part, pd.DataFrame) or isinstance(part, pd.Series):
+        __update(h, list(part.index))
+        if isinstance(part, pd.DataFrame):
+            __update(h, list(part.columns))
+        part = part.values
+    if isinstance(part, np.ndarray):
+        h.update(("array" + str(part.shape) + str(part.dtype)).encode("utf-8"))
+        if part.dtype == object:
+            h.update(repr(part.tolist()).encode("utf-8"))
+        else:
+            h.update(np.ascontiguousarray(part).tobytes())
+    elif isinstance(part, dict):
+        h.update(b"dict")
+        for k in list(part.keys()):
+            __update(h, k)
+            __update(h, part[k])
+    elif isinstance(part, (list, tuple)):
+        h.update(("list" + str(len(part))).encode("utf-8"))
+        for p in part:
+            __update(h, p)
+    else:
+        h.update(repr(part).encode("utf-8"))
+    h.update(b"\0")
+
+def __entry(key, fname):
+    """ Path of the cached copy of this output file.
+    """
+    return os.path.join(__state["directory"], key[:2], key, os.path.basename(fname))
+
+# Public methods
+
+def configure(directory):
+    """ Turn caching on, storing plots in this directory, or off if directory is None.
+
+    Args:
+        directory (str): cache directory. Created if it does not exist.
+    """
+    if directory is not None and not os.path.isdir(directory):
+        os.makedirs(directory)
+    __state["directory"] = directory
+
+def directory():
+    """ Return the cache directory, or None if caching is off.
+    """
+    return __state["directory"]
+
+def key(*parts):
+    """ Hash the inputs of a plot.
+
+    Args:
+        parts: the name of the renderer followed by its input arrays, labels and options.
+            The output path should be included, as it ends up in interactive plots, relative
+            to the output directory of the run (see rendering.relative_path).
+
+    Returns:
+        Hex digest identifying the plot.
+    """
+    h = hashlib.sha1()
+    __update(h, (CACHE_VERSION, matplotlib.__version__) + parts)
+    return h.hexdigest()
+
+def fetch(key, fnames):
+    """ Put the cached output files of this plot in place.
+
+    Args:
+        key (str): key of the plot, from key().
+        fnames (list[str]): paths the output files should be saved to.
+
+    Returns:
+        True if every file was found in the cache and placed, False otherwise (or if
+        caching is off).
+    """
+    if __state["directory"] is None:
+        return False
+
+    if not all(os.path.isfile(__entry(key, f)) for f in fnames):
+        return False
+
+    # copied rather than linked: a plot saved later to the same path (such as a shared
+    # legend) would otherwise write through the link into the cache
+    for f in fnames:
+        with timing.timed("cached", f):
+            shutil.copyfile(__entry(key, f), f)
+
+    return True
+
+def store(key, fnames):
+    """ Save the output files of this plot in the cache. Files are written under a temporary
+    name and renamed, so concurrent renderers never see a partial file.
+
+    Args:
+        key (str): key of the plot, from key().
+        fnames (list[str]): paths of the rendered output files.
+    """
+    if __state["directory"] is None:
+        return
+
+    for f in fnames:
+        entry = __entry(key, f)
+        if os.path.isfile(entry):
+            continue
+        if not os.path.isdir(os.path.dirname(entry)):
+            try:
+                os.makedirs(os.path.dirname(entry))
+            except OSError: # created by another process in the meantime
+                pass
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(entry))
+        os.close(fd)
+        shutil.copyfile(f, tmp)
+        try:
+            os.rename(tmp, entry)
+        except OSError: # already stored by another process
+            os.remove(tmp)
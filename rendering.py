@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Headless figures and the pool of rendering processes. Plots are drawn on their
+own Figure/Axes objects with the Agg canvas instead of the global pyplot state,
+so no display is needed, nothing leaks from one plot into the next and test
+blocks can be run in separate processes (see scheduler). Figures are saved in the output
+format and resolution of their test block, within its file size budget, and large
+raster plots get a thumbnail for the results page.
+"""
+
+# General imports
+import hashlib
+import io
+import math
+import multiprocessing
+import os
+
+# specific imports that must be pre-installed
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from PIL import Image
+
+# Internal imports
+import render_cache
+import timing
+
+FORMATS = ["png", "svg", "webp", "pdf"] # Output formats of plots, if supported by the installed matplotlib.
+MIN_DPI = 50 # Lowest resolution used to fit a plot in its maximum file size.
+THUMBNAIL_WIDTH = 900 # Width in pixels of plots on the results page.
+
+# set in the processes of the rendering pool
+__worker_state = dict()
+
+# Helper methods
+
+def __init_worker(cache_directory, started):
+    """ Mark this process as a rendering worker.
+
+    Args:
+        cache_directory (str): directory of the render cache, or None.
+        started (multiprocessing.Queue): queue to report started tasks to, or None.
+    """
+    __worker_state["in_worker"] = True
+    __worker_state["started"] = started
+    render_cache.configure(cache_directory)
+    timing.collect() # timings of the parent process are reported by the parent
+
+# Public methods
+
+def new_figure(figsize=None):
+    """ Create a figure that is drawn with the Agg canvas, independent of pyplot.
+
+    Args:
+        figsize (tuple, default=None): width, height in inches.
+
+    Returns:
+        matplotlib.figure.Figure instance.
+    """
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+def supported_formats():
+    """ Return the output formats of FORMATS the installed matplotlib can save.
+    """
+    filetypes = new_figure().canvas.get_supported_filetypes()
+    return [f for f in FORMATS if f in filetypes]
+
+def plot_file(output_dir, name, output=None):
+    """ Return the path a plot is saved to.
+
+    Args:
+        output_dir (str): directory of the plot.
+        name (str): file name without extension.
+        output (dict, default=None): output options of the test block, see save_figure.
+
+    Returns:
+        Path with the extension of the output format, png by default.
+    """
+    return output_dir + "/" + name + "." + (output["format"] if output is not None else "png")
+
+def save_figure(fig, fname, output=None, dpi=200, **kwargs):
+    """ Save a figure once, in the format given by the extension of fname. 
+
+    Args:
+        fig: matplotlib.figure.Figure instance.
+        fname (str): path to save to, from plot_file().
+        output (dict, default=None): output options of the test block: "format", "dpi" 
+            (overrides the default dpi if not None) and "max_file_size" (in kilobytes, or None).
+        dpi (int, default=200): resolution of this kind of plot.
+        kwargs: passed on to savefig, such as bbox_inches.
+
+    Effects:
+        If the figure is larger than the maximum file size it is drawn again at a lower 
+        resolution, down to MIN_DPI. Only the final version is written to disk. Prints a 
+        warning if the figure cannot be made small enough, which is the case for vector 
+        formats without embedded images.
+    """
+    if output is not None and output["dpi"] is not None:
+        dpi = output["dpi"]
+    budget = output["max_file_size"] * 1024 if output is not None and output["max_file_size"] is not None else None
+    fmt = fname.rsplit(".", 1)[1]
+    
+    with timing.timed("save", fname):
+        buf = io.BytesIO()
+        fig.savefig(buf, format=fmt, dpi=dpi, **kwargs)
+        
+        # pixels, and so roughly the size, scale with the square of the resolution
+        while budget is not None and len(buf.getvalue()) > budget and dpi > MIN_DPI:
+            size = len(buf.getvalue())
+            dpi = max(MIN_DPI, int(dpi * math.sqrt(float(budget) / size) * 0.95))
+            smaller = io.BytesIO()
+            fig.savefig(smaller, format=fmt, dpi=dpi, **kwargs)
+            if len(smaller.getvalue()) >= size: # resolution does not matter for this figure
+                break
+            buf = smaller
+        
+        if budget is not None and len(buf.getvalue()) > budget:
+            print(("Warning: " + fname + " is " + str(len(buf.getvalue()) // 1024) + " KB, more than the maximum file size of " + 
+                   str(budget // 1024) + " KB."))
+        
+        f = open(fname, 'wb')
+        f.write(buf.getvalue())
+        f.close()
+
+def thumbnail(fname, width=THUMBNAIL_WIDTH):
+    """ Save a copy of a plot scaled down to the width it is shown at on the results page, in 
+    a "thumbnails" folder next to the plot. Thumbnails are kept in the render cache, keyed 
+    on the contents of the plot.
+
+    Args:
+        fname (str): path of the plot.
+        width (int, default=THUMBNAIL_WIDTH): width of the thumbnail in pixels.
+
+    Returns:
+        Path to the thumbnail, or None if the plot is not a png or webp image or is not
+        wider than width.
+    """
+    if os.path.splitext(fname)[1].lower() not in (".png", ".webp"):
+        return None
+    
+    image = Image.open(fname)
+    if image.size[0] <= width:
+        image.close()
+        return None
+    
+    thumb = os.path.join(os.path.dirname(fname), "thumbnails", os.path.basename(fname))
+    if not os.path.isdir(os.path.dirname(thumb)):
+        os.makedirs(os.path.dirname(thumb))
+    
+    f = open(fname, 'rb')
+    cache_key = render_cache.key("thumbnail", hashlib.sha1(f.read()).hexdigest(), width)
+    f.close()
+    
+    if not render_cache.fetch(cache_key, [thumb]):
+        with timing.timed("thumbnail", thumb):
+            image.thumbnail((width, image.size[1]), Image.LANCZOS)
+            image.save(thumb)
+        render_cache.store(cache_key, [thumb])
+    image.close()
+    
+    return thumb
+
+def relative_path(fname):
+    """ Return the path of an output file from the output directory of the run: the folder of
+    its test block and its name. Used in cache keys and plot ids, which should not depend on
+    where the run is saved.
+
+    Args:
+        fname (str): path of the output file.
+    """
+    return os.path.basename(os.path.dirname(fname)) + "/" + os.path.basename(fname)
+
+def new_pool(processes, started=None):
+    """ Start a pool of rendering processes. These share the render cache of this process.
+
+    Args:
+        processes (int): number of processes.
+        started (multiprocessing.Queue, default=None): queue the processes report the tasks 
+            they start to, see report_started.
+
+    Returns:
+        multiprocessing.Pool instance.
+    """
+    return multiprocessing.Pool(processes, initializer=__init_worker, initargs=(render_cache.directory(), started))
+
+def report_started(task):
+    """ Tell the process that started the pool that this worker started a task. Does 
+    nothing outside the rendering pool.
+
+    Args:
+        task: picklable name of the task.
+    """
+    if __worker_state.get("started") is not None:
+        __worker_state["started"].put(task)
+
+def in_worker():
+    """ Return True in the processes of the rendering pool. These are daemonic and
+    cannot start process pools of their own.
+    """
+    return __worker_state.get("in_worker", False)
@@ -7,9 +7,139 @@ Created on Mon Jun 15 11:02:54 2015
 Module containing several classes representing types of results. A result
 can take the form of a table, a static image, or an interactive plot. The final
 comparative analysis html page is composed from several instances of result class. 
+Each result writes its html straight to the page, so the page is never held in memory.
 
 """
 
+# General imports
+import io
+import json
+import math
+
+# Internal imports
+import generate_html
+import rendering
+
+# Draws a table_result from its JSON payload: only the rows in view are built, shared by the tables of a page
+TABLE_JS = """
+if (typeof dataTable === "undefined") {
+  var dataTable = function(id, pageSize) {
+    var data = JSON.parse(document.getElementById(id + "_data").textContent);
+    var table = document.getElementById(id);
+    var body = table.tBodies[0];
+    var scroll = document.getElementById(id + "_scroll");
+    var pager = document.getElementById(id + "_pager");
+    var search = document.getElementById(id + "_search");
+    var threshold = document.getElementById(id + "_threshold");
+    var count = document.getElementById(id + "_count");
+    var columns = table.tHead.rows[0].cells.length;
+    var rows = data.rows, shown = rows, page = 0, sortCol = -1, ascending = true, rowHeight = 0, pending = false;
+    
+    function spacer(height) {
+      var tr = document.createElement("tr"), td = document.createElement("td");
+      td.colSpan = columns;
+      td.style.cssText = "height:" + height + "px;padding:0;border:0";
+      tr.appendChild(td);
+      body.appendChild(tr);
+    }
+    
+    function button(text, target) {
+      var b = document.createElement("button");
+      b.textContent = text;
+      b.onclick = function() { page = target; render(); };
+      pager.appendChild(b);
+    }
+    
+    function render() {
+      var start = 0, end = Math.min(shown.length, 50);
+      if (pageSize) {
+        var pages = Math.max(1, Math.ceil(shown.length / pageSize));
+        page = Math.max(0, Math.min(page, pages - 1));
+        start = page * pageSize;
+        end = Math.min(shown.length, start + pageSize);
+        pager.textContent = "";
+        button("<", page - 1);
+        pager.appendChild(document.createTextNode(" Page " + (page + 1) + " of " + pages + " "));
+        button(">", page + 1);
+      } else if (rowHeight) {
+        start = Math.max(0, Math.floor(scroll.scrollTop / rowHeight) - 10);
+        end = Math.min(shown.length, start + Math.ceil(scroll.clientHeight / rowHeight) + 20);
+      }
+      body.textContent = "";
+      if (start > 0) { spacer(start * rowHeight); }
+      for (var i = start; i < end; i++) {
+        var tr = document.createElement("tr");
+        for (var c = 0; c < columns; c++) {
+          var td = document.createElement("td");
+          td.textContent = (c < shown[i].length) ? shown[i][c] : "";
+          tr.appendChild(td);
+        }
+        body.appendChild(tr);
+      }
+      if (!pageSize && rowHeight && end < shown.length) { spacer((shown.length - end) * rowHeight); }
+      count.textContent = shown.length + " of " + rows.length + " rows";
+      if (!pageSize && !rowHeight && end > start && body.rows[0].offsetHeight > 0) {
+        rowHeight = body.rows[0].offsetHeight;
+        render();
+      }
+    }
+    
+    function filter() {
+      var text = search.value.toLowerCase();
+      var p = threshold ? parseFloat(threshold.value) : NaN;
+      shown = rows.filter(function(r) {
+        if (!isNaN(p) && !(typeof r[data.pColumn] === "number" && r[data.pColumn] <= p)) { return false; }
+        return !text || r.some(function(v) { return String(v).toLowerCase().indexOf(text) >= 0; });
+      });
+      page = 0;
+      scroll.scrollTop = 0;
+      render();
+    }
+    
+    Array.prototype.forEach.call(table.tHead.rows[0].cells, function(th, col) {
+      th.style.cursor = "pointer";
+      th.onclick = function() {
+        ascending = (sortCol === col) ? !ascending : false;
+        sortCol = col;
+        rows.sort(function(a, b) {
+          var x = a[col], y = b[col];
+          var c = (typeof x === "number" && typeof y === "number") ? x - y : String(x).localeCompare(String(y));
+          return ascending ? c : -c;
+        });
+        filter();
+      };
+    });
+    
+    search.oninput = filter;
+    if (threshold) { threshold.oninput = filter; }
+    scroll.onscroll = function() {
+      if (pageSize || pending) { return; }
+      pending = true;
+      window.requestAnimationFrame(function() { pending = false; render(); });
+    };
+    render();
+  };
+}
+"""
+
+def image_html(path, attributes="", height=700, thumbnail=None):
+    """ Returns html showing this image. Images are only loaded when the page is scrolled to them.
+    Browsers do not show pdf files in an img tag, so these are embedded as objects with a link to the file.
+    
+    Args:
+        path: path to the image.
+        attributes (default=""): attributes of the img or object tag, such as its width.
+        height (default=700): height of an embedded pdf in pixels.
+        thumbnail (default=None): path to a smaller copy of the image. If given, it is shown
+            instead, linking to the image.
+    """
+    if path.lower().endswith(".pdf"):
+        return ('<object data="' + path + '" type="application/pdf" ' + attributes + ' style="height:' + str(height) + 
+                'px"><a href="' + path + '">' + path + '</a></object>')
+    if thumbnail is not None:
+        return '<a href="' + path + '" target="_blank"><img src="' + thumbnail + '" loading="lazy" ' + attributes + '></a>'
+    return '<img src="' + path + '" loading="lazy" ' + attributes + '>'
+
 class abstract_result(object):
     """ Abstract class representing a result from a test. 
     
@@ -56,23 +186,76 @@ class abstract_result(object):
         """
         return self.test_name + "_"
         
+    def write_html(self, out):
+        """ Write the html formatting for this result. Implemented by each type of result.
+        
+        Args:
+            out: generate_html.page_writer the page is written to.
+        """
+        raise NotImplementedError
+        
+    def make_thumbnails(self):
+        """ Make smaller copies of the images of this result for the results page. Only results
+        showing images have any.
+        """
+        pass
+        
+    def to_html(self):
+        """ Returns html formatting for this result, including the scripts it needs. 
+        """
+        contents = io.StringIO()
+        out = generate_html.page_writer(contents)
+        self.write_html(out)
+        out.finish()
+        return contents.getvalue()
+        
+    def to_data(self):
+        """ Return this result as plain data (strings, numbers, lists and dictionaries), 
+        to be saved and read back with from_data.
+        """
+        return {"type": type(self).__name__, "output": self.output, "meta": self.meta, 
+                "result_name": self.result_name, "test_name": self.test_name}
+        
 class png_result(abstract_result):
-    """ A result consisting of a png image. 
+    """ A result consisting of an image, in png, svg, webp or pdf format. 
+    
+    Attributes:
+        thumbnail: path to a copy of the image at the width it is shown at, or None if the
+            image is shown as it is.
     """
-    def to_html(self):
-        """ Returns html formatting for this result. 
+    
+    def __init__(self, path, meta, result_name, test_name):
+        """ Create a new png_result to display.
         """
-        contents = '<div><a name="' + self.get_result_id() + '"></a></div>' # internal linking
-        contents += '<p><div class="image"><img src="' + self.get_output() + '" width="900" class="center"></div></p>' 
-        contents += '<p class="about">' + self.get_meta() + '</p><br>'
-
-        return contents
+        abstract_result.__init__(self, path, meta, result_name, test_name)
+        self.thumbnail = None
+        
+    def make_thumbnails(self):
+        """ Make the thumbnail of this image, if it is larger than it is shown.
+        """
+        self.thumbnail = rendering.thumbnail(self.get_output())
+        
+    def to_data(self):
+        """ Return this result as plain data, see abstract_result.to_data.
+        """
+        data = abstract_result.to_data(self)
+        data["thumbnail"] = self.thumbnail
+        return data
+        
+    def write_html(self, out):
+        """ Write the html formatting for this result. 
+        """
+        out.write('<div><a name="' + self.get_result_id() + '"></a></div>') # internal linking
+        thumbnail = None if self.thumbnail is None else out.link(self.thumbnail)
+        out.write('<p><div class="image">' + image_html(out.link(self.get_output()), 'width="900" class="center"', 
+                                                        thumbnail=thumbnail) + '</div></p>')
+        out.write('<p class="about">' + self.get_meta() + '</p><br>')
         
 class html_result(abstract_result):
     """ A result containing an html file, typically an interactive plot. 
     
     Attributes:
-        legend: path to png legend for this interactive plot. 
+        legend: path to the legend image for this interactive plot. 
         x_label: string representing the x_label for the interactive plot. 
     """
 
@@ -80,59 +263,191 @@ class html_result(abstract_result):
         """ Create a new html_result to display.
         
         Args:
-            lgd (default=None): path to png legend for this interactive plot.
+            lgd (default=None): path to the legend image for this interactive plot.
             x_lbl (default=None): string representing the x_label for the interactive plot. 
         """
         abstract_result.__init__(self, path, meta, result_name, test_name)
         self.legend = lgd
         self.x_label = x_lbl
         
-    def to_html(self):
-        """ Returns html formatting for this result. 
+    def to_data(self):
+        """ Return this result as plain data, see abstract_result.to_data.
         """
-        contents = '<a name="' + self.get_result_id() + '"></a>' # for internal linking
+        data = abstract_result.to_data(self)
+        data["legend"] = self.legend
+        data["x_label"] = self.x_label
+        return data
         
-        contents += '<div class="interactive">'
+    def write_html(self, out):
+        """ Write the html formatting for this result. The html file is copied into the page line by
+        line, except for its shared scripts which are added to the page once.
+        """
+        out.write('<a name="' + self.get_result_id() + '"></a>') # for internal linking
         
-        for line in open(self.get_output(), 'r'):
-            contents += line
+        out.write('<div class="interactive">')
+        
+        f = open(self.get_output(), 'r')
+        shared = None # name and lines of the shared script being read
+        for line in f:
+            if shared is not None:
+                if line.startswith('</script>'):
+                    out.add_script(shared[0], "".join(shared[1]))
+                    shared = None
+                else:
+                    shared[1].append(line)
+            elif line.startswith(generate_html.SHARED_SCRIPT):
+                shared = (line[len(generate_html.SHARED_SCRIPT):].split('"')[0], list())
+            else:
+                out.write(line)
+        f.close()
             
-        contents += '</div>'
+        out.write('</div>')
         
         if self.x_label != None:
-            contents += '<div class="x_label">' + self.x_label.replace(" ", "&nbsp;") + '</div>'
+            out.write('<div class="x_label">' + self.x_label.replace(" ", "&nbsp;") + '</div>')
         
         if self.legend != None:
-            contents += '<div class="image"><img src="' + self.legend + '" class="center"></div><br>'
+            out.write('<div class="image">' + image_html(out.link(self.legend), 'class="center"', height=300) + '</div><br>')
             
-        contents += '<p class="about">' + self.get_meta() + '</p><br>'
-        
-        return contents
+        out.write('<p class="about">' + self.get_meta() + '</p><br>')
     
 class table_result(abstract_result):
-    """ A result containing a table.
+    """ A result containing a table. The rows are embedded in the page as JSON and drawn by 
+    the browser, which only builds the rows in view. Tables can be sorted by clicking on a 
+    column heading, searched, and filtered by p-value if they have a p-value column.
+    
+    Attributes:
+        page_size: number of rows shown at once, or None to scroll through all rows.
     """ 
     
-    def to_html(self):
-        """ Returns html formatting for this result. 
-        """
-        contents = '<div><a name="' + self.get_result_id() + '"></a>' # for internal linking
-        contents += '<div id="enrich"><table style="width:"900" class="center"><tbody>' 
-        
-        i = 0        
-        for line in open(self.get_output(), 'r'):
-            line = line.split('\t')
-            contents += '<tr>'            
-            if i == 0:
-                for word in line:
-                    contents += '<th>' + word.capitalize() + '</th>'
-            else:
-                for word in line:
-                    contents += '<td>' + word + '</td>'
-            contents += '</tr>'
-            
+    def __init__(self, path, meta, result_name, test_name, page_size=None):
+        """ Create a new table_result to display.
+        
+        Args:
+            page_size (default=None): number of rows shown at once. If None, all rows can be scrolled through.
+        """
+        abstract_result.__init__(self, path, meta, result_name, test_name)
+        self.page_size = page_size
+        
+    def to_data(self):
+        """ Return this result as plain data, see abstract_result.to_data.
+        """
+        data = abstract_result.to_data(self)
+        data["page_size"] = self.page_size
+        return data
+    
+    def __cell(self, word):
+        """ Return the value of a cell of the table: a number if it is one, or else the text.
+        """
+        for convert in (int, float):
+            try:
+                value = convert(word)
+            except ValueError:
+                continue
+            if not (math.isnan(value) or math.isinf(value)):
+                return value
+        return word
+    
+    def write_html(self, out):
+        """ Write the html formatting for this result. The rows are read from the table one at a time
+        and written as JSON, no html is written for them.
+        """
+        table_id = (self.get_result_id() + self.get_result_name()).replace(" ", "_")
+        
+        f = open(self.get_output(), 'r')
+        header = f.readline().rstrip('\n').split('\t')
+        p_column = [i for i, word in enumerate(header) if "p-val" in word.lower()]
+        
+        out.write('<div><a name="' + self.get_result_id() + '"></a>') # for internal linking
+        out.write('<p class="about">Search: <input type="search" id="' + table_id + '_search">')
+        if len(p_column) > 0:
+            out.write(' &nbsp; p-value at most: <input type="number" step="any" min="0" id="' + table_id + '_threshold">')
+        out.write(' &nbsp; <span id="' + table_id + '_count"></span></p>')
+        
+        out.write('<div class="table_scroll" id="' + table_id + '_scroll"><table class="center" id="' + table_id + '">')
+        out.write('<thead><tr>' + ''.join(['<th>' + word.capitalize() + '</th>' for word in header]) + '</tr></thead>')
+        out.write('<tbody></tbody></table></div>')
+        if self.page_size != None:
+            out.write('<p class="about" id="' + table_id + '_pager"></p>')
+        out.write('</div>')
+        
+        out.write('<script type="application/json" id="' + table_id + '_data">{"pColumn":' + 
+                  str(p_column[0] if len(p_column) > 0 else -1) + ',"rows":[')
+        i = 0
+        for line in f:
+            row = [self.__cell(word) for word in line.rstrip('\n').split('\t')]
+            out.write(("," if i > 0 else "") + json.dumps(row, separators=(",", ":")).replace("</", "<\\/"))
             i += 1
+        f.close()
+        out.write(']}</script>')
+        
+        out.add_script("dataTable", TABLE_JS)
+        out.write(generate_html.run_script(table_id, "dataTable", [table_id, self.page_size]))
+        out.write('<p class="about">' + self.get_meta() + '</p><br>')
+    
+class multi_result(abstract_result):
+    """ A result made up of several results from one test block, for instance one
+    plot per distance metric followed by a table comparing them.
+    
+    Attributes:
+        results: list of (heading, result instance) pairs in display order.
+    """
+    
+    def __init__(self, results, meta, result_name, test_name):
+        """ Create a new multi_result to display.
+        
+        Args:
+            results: list of (heading, result instance) pairs in display order.
+        """
+        abstract_result.__init__(self, None, meta, result_name, test_name)
+        self.results = results
+        
+    def make_thumbnails(self):
+        """ Make the thumbnails of the images of each of its results.
+        """
+        for heading, res in self.results:
+            res.make_thumbnails()
             
-        contents += '<tbody></table></div>'
-        contents += '<p class="about">' + self.get_meta() + '</p><br>'
-        return contents
\ No newline at end of file
+    def to_data(self):
+        """ Return this result and each of its results as plain data, see abstract_result.to_data.
+        """
+        data = abstract_result.to_data(self)
+        data["results"] = [[heading, res.to_data()] for heading, res in self.results]
+        return data
+            
+    def write_html(self, out):
+        """ Write the html formatting for this result, followed by each of its results. 
+        """
+        out.write('<div><a name="' + self.get_result_id() + '"></a></div>') # internal linking
+        
+        for heading, res in self.results:
+            out.write('<h3>' + heading + '</h3>')
+            res.write_html(out)
+            
+        out.write('<p class="about">' + self.get_meta() + '</p><br>')
+
+def from_data(data):
+    """ Create a result from the plain data returned by its to_data method.
+    
+    Args:
+        data (dict): plain data of the result.
+        
+    Returns:
+        Result instance.
+        
+    Raises:
+        ValueError: if data is not of a known type of result.
+    """
+    args = (data["output"], data["meta"], data["result_name"], data["test_name"])
+    if data["type"] == "png_result":
+        res = png_result(*args)
+        res.thumbnail = data["thumbnail"]
+        return res
+    if data["type"] == "html_result":
+        return html_result(*args, lgd=data["legend"], x_lbl=data["x_label"])
+    if data["type"] == "table_result":
+        return table_result(*args, page_size=data["page_size"])
+    if data["type"] == "multi_result":
+        return multi_result([(heading, from_data(res)) for heading, res in data["results"]], 
+                            data["meta"], data["result_name"], data["test_name"])
+    raise ValueError("Unknown type of result: " + repr(data["type"]))
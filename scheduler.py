@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the test blocks of a parameters file as a graph of stages:
+
+    load -> filter -> normalize -> distance -> ordination -> render -> report
+
+A stage is identified by everything that goes into it, so blocks that use the same
+samples, normalization, distance metric or PCoA share one stage instead of each
+computing their own. Blocks with the same filters and normalization are given the
+same abundance data, which is read-only, and their own copy of the metadata. Data is
+loaded, filtered and normalized in this process. The distance, PCoA and render stages
+then run in the rendering pool, each as soon as the stages it needs are done, taking
+the data, distances and fits they need with them. Blocks that spread their own work 
+across processes (permutation tests, NMDS and bootstrap) are rendered in this process
+instead, while the pool is idle, so they can use all the workers. A block is reported 
+as running when a worker starts rendering it, and as soon as it finishes. The working directory is
+never changed: every output path starts from the output directory of the run.
+"""
+
+# General imports
+import copy
+import multiprocessing
+import os
+import queue
+import shutil
+
+# Internal imports
+import checkpoint
+import metagenomic_profile as mgp
+import normalization
+import distances
+import ordination
+import rendering
+import shared_arrays
+import timing
+
+# Helper methods
+
+def __option(params, gen_params, name):
+    """ Return a parameter of a test block, or the general parameter if the block does not set it.
+    """
+    return params[name] if name in params else gen_params.get(name)
+
+def __load(stages, gen_params):
+    """ Read the abundance data and metadata (load stage).
+
+    Returns:
+        Key of the stage.
+    """
+    key = ("load", os.path.abspath(gen_params["abundance_data"]), os.path.abspath(gen_params["sample_metadata"]), 
+           gen_params["abundance_sep"], gen_params["metadata_sep"], gen_params["metadata_header"])
+    if key not in stages:
+        with timing.timed("load", gen_params["abundance_data"]):
+            stages[key] = mgp.read_data(gen_params["abundance_data"], gen_params["sample_metadata"], 
+                                        a_sep=gen_params["abundance_sep"], m_sep=gen_params["metadata_sep"], 
+                                        metadata_header=gen_params["metadata_header"])
+    return key
+
+def __filter(stages, params, gen_params):
+    """ Create the profile of the samples and classes of a test block (filter stage).
+
+    Args:
+        stages (dict): stages run so far, mapping the key of each stage to its output.
+        params (dict): parameters of the test block.
+        gen_params (dict): general parameters.
+
+    Returns:
+        Key of the stage.
+    """
+    label = __option(params, gen_params, "class_label")
+    class_names = __option(params, gen_params, "class_names")
+    rules = params.get("filter_rules")
+    labels = params.get("filter_labels")
+    
+    load_key = __load(stages, gen_params)
+    key = ("filter", load_key, label, None if class_names is None else repr(sorted(class_names.items())), 
+           repr(rules), repr(labels), gen_params.get("feature_metadata"))
+    if key not in stages:
+        abundance_data, metadata = stages[load_key]
+        with timing.timed("filter", gen_params["output_directory"]):
+            profile = mgp.metagenomic_profile(abundance_data, metadata, metadata_label=label, class_names=class_names, 
+                                              filter_rules=rules, filter_labels=labels)
+            if "feature_metadata" in gen_params:
+                profile.add_feature_metadata(gen_params["feature_metadata"])
+        stages[key] = profile
+    return key
+
+def __normalize(stages, params, gen_params, normalization_type, output_dir):
+    """ Normalize the profile of a test block (normalize stage). The normalized data is 
+    written to output_dir, by the stage or copied from the folder the stage wrote it to.
+
+    Args:
+        stages (dict): stages run so far.
+        params (dict): parameters of the test block.
+        gen_params (dict): general parameters.
+        normalization_type (str): "relative", "musicc" or None for no normalization.
+        output_dir (str): directory to save the normalized data to.
+
+    Returns:
+        Key of the stage.
+    """
+    filter_key = __filter(stages, params, gen_params)
+    key = ("normalize", filter_key, normalization_type)
+    if key not in stages:
+        profile = stages[filter_key]
+        if normalization_type in normalization.FILES:
+            profile = profile.copy()
+            with timing.timed("normalize", output_dir):
+                if normalization_type == "relative":
+                    normalization.relative_normalization(profile, output_dir)
+                else:
+                    normalization.musicc_normalization(profile, gen_params["abundance_data"], output_dir)
+        stages[key] = (profile, output_dir)
+    elif normalization_type in normalization.FILES and stages[key][1] != output_dir:
+        fname = normalization.FILES[normalization_type]
+        shutil.copyfile(stages[key][1] + "/" + fname, output_dir + "/" + fname)
+    return key
+
+def __metrics(block):
+    """ Return the distance metrics used on the whole profile of a test block, and those
+    of them that a PCoA is fitted with.
+    """
+    params = block.params
+    test = block.get_type()
+    if test == "multi_pcoa":
+        return list(params["distance_metrics"]), list(params["distance_metrics"])
+    if test == "nmds" or (test == "pcoa" and "reference_ordination" not in params):
+        return [params["distance_metric"]], [params["distance_metric"]]
+    if test in ["permanova", "permdisp"]:
+        return [params["distance_metric"]], []
+    if test == "pca" and "bootstrap" in params and params["bootstrap_by"] == "samples":
+        return ["euclidean"], []
+    return [], []
+
+def __prepare(stages, block):
+    """ Run the stages of a test block that come before its distances (load, filter and 
+    normalize), and give it a view of its profile, whose read-only abundance data is shared 
+    with the other blocks that have the same filters and normalization.
+
+    Args:
+        stages (dict): stages run so far.
+        block: test_block instance.
+
+    Returns:
+        Key of the normalize stage of the block.
+    """
+    block_dir = block.gen_params["output_directory"] + "/" + block.get_name()
+    if not os.path.isdir(block_dir):
+        os.mkdir(block_dir)
+    
+    key = __normalize(stages, block.params, block.gen_params, block.params.get("normalization"), block_dir)
+    profile = stages[key][0]
+    if profile.shared:
+        timing.shared(block.get_name(), profile.memory_usage())
+    profile.share()
+    block.set_metagenomic_profile(profile.view())
+    if ("partition", key) not in stages:
+        stages[("partition", key)] = distances.partition_abundance_data(profile)
+    return key
+
+def __graph(stages, blocks, keys):
+    """ Build the graph of the stages left to run once the blocks have their profiles.
+
+    Args:
+        stages (dict): stages run so far.
+        blocks (list[test_block]): test blocks, from __prepare.
+        keys (list): key of the normalize stage of each block.
+
+    Returns:
+        Dictionary mapping each stage left to run to the stages it needs. Distance stages
+        are ("distance", normalize key, metric), PCoA stages ("ordination", normalize key,
+        metric) and the render stage of a block ("render", index of the block). Distance 
+        and PCoA stages come first, so the renders do not hold up the stages other blocks wait for.
+    """
+    computed = dict()
+    rendered = dict()
+    for i, (block, key) in enumerate(zip(blocks, keys)):
+        metrics, fit_metrics = __metrics(block)
+        needs = [("distance", key, m) for m in metrics] + [("ordination", key, m) for m in fit_metrics]
+        for node in needs:
+            if node not in stages:
+                computed[node] = [("distance", key, node[2])] if node[0] == "ordination" else []
+        rendered[("render", i)] = needs
+    computed.update(rendered)
+    return computed
+
+def __distance(frame, dist_type):
+    """ Compute a distance matrix (distance stage).
+
+    Args:
+        frame: abundance data of the samples in partitioned order, from shared_arrays.share_frame.
+        dist_type (str): distance metric to use.
+
+    Returns:
+        n x n numpy array of distances.
+    """
+    df = shared_arrays.attach_frame(frame)
+    with timing.timed("distance", dist_type):
+        return distances.distance_matrix(df, dist_type)
+
+def __ordination(frame, dist_type, dist):
+    """ Fit a PCoA (ordination stage).
+
+    Args:
+        frame: abundance data of the samples in partitioned order, from shared_arrays.share_frame.
+        dist_type (str): distance metric to use.
+        dist: distances between the samples, from shared_arrays.share.
+
+    Returns:
+        ordination instance.
+    """
+    df = shared_arrays.attach_frame(frame)
+    with timing.timed("ordination", dist_type):
+        return ordination.shared_pcoa(df, dist_type, dist_matrix=shared_arrays.attach(dist))
+
+def __send(sent, key, block, shared):
+    """ Prepare a test block to be sent to the rendering pool. Its abundance data, distance
+    matrices and PCoA fits are shared through the scratch folder rather than copied into 
+    the task (see shared_arrays).
+
+    Args:
+        sent (dict): profiles shared with the pool in this run. The profile of the block 
+            is added, so blocks with the same profile send it once.
+        key: key of the normalize stage of the block.
+        block: test_block instance.
+        shared: distance matrices and PCoA fits of the block, as (distances.entries, 
+            ordination.entries).
+
+    Returns:
+        Arguments of __render after the index of the block.
+    """
+    profile = block.metagenomic_profile
+    if key not in sent:
+        light = copy.copy(profile)
+        light.abundance_data = None
+        sent[key] = (light, shared_arrays.share_frame(profile.abundance_data))
+    
+    sent_block = copy.copy(block)
+    sent_block.metagenomic_profile = None
+    
+    matrices = [(k, shared_arrays.share(dist)) for k, dist in shared[0]]
+    fits = list()
+    for k, fitted in shared[1]:
+        fitted = copy.copy(fitted)
+        for name in ordination.PCOA_ARRAYS:
+            setattr(fitted, name, shared_arrays.share(getattr(fitted, name)))
+        fits.append((k, fitted))
+    
+    return sent_block, sent[key], (matrices, fits)
+
+def __render(index, block, profile, shared):
+    """ Render one test block in the rendering pool (render stage).
+
+    Args:
+        index (int): index of the block in the run, reported when it starts.
+        block: test_block instance, without its profile.
+        profile: the profile of the block without its abundance data, and the shared
+            abundance data, from __send.
+        shared: shared distance matrices and PCoA fits of the block, from __send.
+
+    Returns:
+        Result instance of the block, holding only paths to its output and text.
+    """
+    rendering.report_started(index)
+    mp = copy.copy(profile[0])
+    mp.abundance_data = shared_arrays.attach_frame(profile[1])
+    block.set_metagenomic_profile(mp)
+    
+    distances.add([(k, shared_arrays.attach(dist)) for k, dist in shared[0]])
+    for k, fitted in shared[1]:
+        for name in ordination.PCOA_ARRAYS:
+            setattr(fitted, name, shared_arrays.attach(getattr(fitted, name)))
+    ordination.add(shared[1])
+    return block.run()
+
+def __pooled(task, args):
+    """ Run a stage in the rendering pool.
+
+    Returns:
+        Output of the stage and the timings recorded while running it.
+    """
+    return task(*args), timing.collect()
+
+def __task(node, stages, blocks, keys, sent, pool):
+    """ Return the function and arguments that run a stage of the graph.
+
+    Args:
+        node: stage of the graph, see __graph.
+        stages (dict): stages run so far, holding every stage the node needs.
+        blocks (list[test_block]): test blocks of the run.
+        keys (list): key of the normalize stage of each block.
+        sent (dict): data shared with the rendering pool in this run, see __send.
+        pool: rendering pool the stage is sent to, or None to run it in this process.
+    """
+    if node[0] == "render":
+        block = blocks[node[1]]
+        if pool is None:
+            return block.run, ()
+        df = stages[("partition", keys[node[1]])]
+        metrics, fit_metrics = __metrics(block)
+        return __render, (node[1],) + __send(sent, keys[node[1]], block, (distances.entries(df, metrics), ordination.entries(df, fit_metrics)))
+    frame_key = ("partition", node[1])
+    if frame_key not in sent:
+        sent[frame_key] = shared_arrays.share_frame(stages[frame_key])
+    if node[0] == "distance":
+        return __distance, (sent[frame_key], node[2])
+    return __ordination, (sent[frame_key], node[2], shared_arrays.share(stages[("distance",) + node[1:]]))
+
+def __finish(node, output, error, stages, blocks, results, failed, status):
+    """ Record a stage of the graph that finished or failed. A distance matrix or PCoA fit
+    computed in the rendering pool is added to the caches of this process (report stage).
+
+    Args:
+        node: stage of the graph, see __graph.
+        output: output of the stage, if it finished.
+        error (Exception): exception raised by the stage or by a stage it needs, or None.
+        stages (dict): stages run so far.
+        blocks (list[test_block]): test blocks of the run.
+        results (dict): results of the finished blocks.
+        failed (dict): stages that failed, mapped to their exception.
+        status: function told when a block finishes, or None.
+    """
+    if error is not None:
+        failed[node] = error
+        if node[0] == "render":
+            __failed(blocks[node[1]], error, status)
+    elif node[0] == "render":
+        __done(blocks[node[1]], output, results, status)
+    else:
+        df = stages[("partition", node[1])]
+        if node[0] == "distance":
+            distances.add([((distances.fingerprint(df), node[2]), output)])
+        else:
+            ordination.add([((distances.fingerprint(df), node[2]), output)])
+        stages[node] = output
+
+def __report_started(started, blocks, status):
+    """ Tell status about the blocks that workers of the rendering pool started rendering.
+    """
+    if started is None or status is None:
+        return
+    while True:
+        try:
+            index = started.get_nowait()
+        except queue.Empty:
+            return
+        status(blocks[index], "running")
+
+def __run_graph(graph, stages, blocks, keys, results, status, workers):
+    """ Run the stages of the graph, each as soon as the stages it needs are done. With more
+    than one worker they run in the rendering pool and the blocks are reported as running
+    when a worker starts them, otherwise they run here one after the other. Blocks that are
+    parallel themselves (see test_block.is_parallel) run here with their own processes: 
+    no more stages are sent to the pool until the stages in it are done and the block has 
+    run. A stage that needs a failed stage fails with the same exception.
+
+    Args:
+        graph (dict): stages left to run, from __graph. Stages are removed as they start.
+        stages (dict): stages run so far. The distance and PCoA stages are added.
+        blocks (list[test_block]): test blocks of the run.
+        keys (list): key of the normalize stage of each block.
+        results (dict): results of the finished blocks.
+        status: function told when a block starts and finishes, or None. See run.
+        workers (int): number of rendering processes.
+    """
+    pool = None
+    started = None
+    processes = min(workers, len(graph))
+    if processes > 1:
+        started = multiprocessing.Queue()
+        pool = rendering.new_pool(processes, started=started)
+        shared_arrays.open_scratch()
+    
+    running = dict()
+    failed = dict()
+    sent = dict()
+    try:
+        while len(graph) > 0 or len(running) > 0:
+            for node in [n for n in running if running[n].ready()]:
+                try:
+                    output, timings = running.pop(node).get()
+                except Exception as e:
+                    __finish(node, None, e, stages, blocks, results, failed, status)
+                    continue
+                timing.add(timings)
+                __finish(node, output, None, stages, blocks, results, failed, status)
+            __report_started(started, blocks, status)
+            
+            for node in list(graph.keys()):
+                if pool is not None and len(running) >= processes:
+                    break
+                errors = [failed[n] for n in graph[node] if n in failed]
+                if len(errors) == 0 and any(n not in stages for n in graph[node]):
+                    continue
+                # a parallel block runs here with its own processes once the pool is idle
+                here = pool is None or (len(errors) == 0 and node[0] == "render" and blocks[node[1]].is_parallel())
+                if not here or len(running) == 0:
+                    del graph[node]
+                if len(errors) > 0:
+                    __finish(node, None, errors[0], stages, blocks, results, failed, status)
+                    continue
+                if here and len(running) > 0:
+                    break
+                task, args = __task(node, stages, blocks, keys, sent, None if here else pool)
+                if not here:
+                    running[node] = pool.apply_async(__pooled, (task, args))
+                    continue
+                if node[0] == "render" and status is not None:
+                    status(blocks[node[1]], "running")
+                try:
+                    output = task(*args)
+                except Exception as e:
+                    __finish(node, None, e, stages, blocks, results, failed, status)
+                    continue
+                __finish(node, output, None, stages, blocks, results, failed, status)
+            
+            if len(running) > 0:
+                list(running.values())[0].wait(0.1)
+        __report_started(started, blocks, status)
+    except BaseException:
+        # a failed or interrupted run does not wait for the stages still running
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+            shared_arrays.close_scratch()
+
+def __done(block, result, results, status):
+    """ Record the result of a finished test block and save its checkpoint.
+    """
+    try:
+        checkpoint.save(block, result)
+    except Exception as e:
+        print(("Warning: checkpoint of test block " + block.get_name() + " could not be saved: " + repr(e)))
+    results[block] = result
+    if status is not None:
+        status(block, "done", result)
+
+def __resume(block, results, status):
+    """ Reuse the result of a test block from the run being resumed (see checkpoint).
+
+    Returns:
+        True if the block finished in that run and is unchanged, False if it has to run again.
+        Its output from that run is removed in that case.
+    """
+    with timing.timed("resumed", block.get_name()):
+        result = checkpoint.load(block)
+    if result is None:
+        checkpoint.clear(block)
+        return False
+    print(("Reusing the results of test block " + block.get_name() + " from the earlier run."))
+    results[block] = result
+    if status is not None:
+        status(block, "done", result)
+    return True
+
+def __failed(block, error, status):
+    """ Report a test block that raised an exception.
+    """
+    print(("Warning: test block " + block.get_name() + " failed: " + repr(error)))
+    if status is not None:
+        status(block, "failed", error)
+
+# Public methods
+
+def run(blocks, gen_params, status=None, stages=None):
+    """ Run test blocks, sharing the stages they have in common. A block that fails is 
+    reported and the others still run.
+
+    Args:
+        blocks (list[test_block]): test blocks to run.
+        gen_params (dict): general parameters. The "workers" parameter sets the number of 
+            processes the distance, PCoA and render stages run in, by default the number 
+            of cores. With 1 worker all blocks run here one after the other.
+        status (default=None): function called with a block and "running" when the block 
+            starts rendering, with a block, "done" and its result when it finishes, and with a block, 
+            "failed" and the exception when it fails.
+        stages (dict, default=None): stages run by earlier calls, shared with this run.
+            The stages of this run are added. None to share nothing.
+
+    Returns:
+        Dictionary mapping each block that finished to its result.
+        
+    Effects:
+        Writes the normalized abundance data of all samples to the output directory, and
+        the output and checkpoint of each block to its folder. When an earlier run is
+        resumed (the "resume" parameter), blocks that finished in it and have not changed
+        are not run again.
+    """
+    output_dir = gen_params["output_directory"]
+    workers = gen_params.get("workers")
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    
+    if stages is None:
+        stages = dict()
+    key = __normalize(stages, dict(), gen_params, gen_params["normalization"], output_dir)
+    stages[key][0].share()
+    
+    results = dict()
+    if "resume" in gen_params:
+        blocks = [b for b in blocks if not __resume(b, results, status)]
+    
+    prepared = list()
+    keys = list()
+    for block in blocks:
+        try:
+            keys.append(__prepare(stages, block))
+        except Exception as e:
+            __failed(block, e, status)
+            continue
+        prepared.append(block)
+    
+    __run_graph(__graph(stages, prepared, keys), stages, prepared, keys, results, status, workers)
+    return results
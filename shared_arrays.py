@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Large arrays handed to the processes of the rendering pool without copying them. An
+array is saved once to a scratch folder and sent as a small mapped_array holding only
+its path, shape and type. Each process maps the file into memory read-only, so all
+processes read the same copy of the data. The scratch folder is removed when the run
+finishes or fails.
+"""
+
+# General imports
+import os
+import shutil
+import tempfile
+
+# specific imports that must be pre-installed
+import numpy as np
+import pandas as pd
+
+MIN_BYTES = 1024 * 1024 # Smaller arrays are cheaper to send with the task than to map.
+
+# scratch folder, None if sharing is off, and the arrays saved to it by id
+__state = {"directory": None, "arrays": dict()}
+
+class mapped_array(object):
+    """ A numpy array saved to the scratch folder, to be mapped into memory by another process.
+
+    Attributes:
+        path (str): path of the .npy file holding the array.
+        shape (tuple[int]): shape of the array.
+        dtype (str): type of the array.
+    """
+
+    def __init__(self, path, shape, dtype):
+        """ Create a new mapped_array. Use share rather than calling this directly.
+        """
+        self.path = path
+        self.shape = shape
+        self.dtype = dtype
+
+    def load(self):
+        """ Map the array into memory.
+
+        Returns:
+            Read-only numpy.memmap holding the array.
+        """
+        return np.load(self.path, mmap_mode="r")
+
+# Public methods
+
+def open_scratch():
+    """ Create the scratch folder. Arrays are shared until close_scratch is called.
+    """
+    close_scratch()
+    __state["directory"] = tempfile.mkdtemp(prefix="comparative_analysis_")
+
+def close_scratch():
+    """ Remove the scratch folder and forget the arrays saved to it. Processes that mapped
+    an array keep their mapping until they drop it.
+    """
+    if __state["directory"] is not None:
+        shutil.rmtree(__state["directory"], ignore_errors=True)
+    __state["directory"] = None
+    __state["arrays"].clear()
+
+def share(array):
+    """ Save this array to the scratch folder, once.
+
+    Args:
+        array (numpy.ndarray): array to share.
+
+    Returns:
+        mapped_array of the array, or the array itself if it is small, holds python
+        objects or the scratch folder is not open.
+    """
+    if __state["directory"] is None or array is None or array.dtype == object or array.nbytes < MIN_BYTES:
+        return array
+    if id(array) not in __state["arrays"]:
+        path = os.path.join(__state["directory"], str(len(__state["arrays"])) + ".npy")
+        np.save(path, array)
+        # the array is kept so its id is not reused by another array
+        __state["arrays"][id(array)] = (array, mapped_array(path, array.shape, str(array.dtype)))
+    return __state["arrays"][id(array)][1]
+
+def attach(value):
+    """ Return the array a value from share stands for.
+    """
+    if isinstance(value, mapped_array):
+        return value.load()
+    return value
+
+def share_frame(df):
+    """ Share the values of a DataFrame holding a single numeric type. The index and columns
+    are sent with the task.
+
+    Returns:
+        (mapped values or the DataFrame itself, index, columns), to be passed to attach_frame.
+    """
+    if len(set(df.dtypes)) != 1:
+        return df, None, None
+    values = share(df.values)
+    if not isinstance(values, mapped_array):
+        return df, None, None
+    return values, df.index, df.columns
+
+def attach_frame(shared):
+    """ Return the DataFrame shared by share_frame, backed by the mapped values.
+    """
+    values, index, columns = shared
+    if not isinstance(values, mapped_array):
+        return values
+    return pd.DataFrame(values.load(), index=index, columns=columns, copy=False)
@@ -8,6 +8,7 @@ Created on Tue May 19 14:04:38 2015
 
 # Internal imports 
 import test_runner as tr
+import rendering
 
 class test_block:
     """ Represents a block of tests to be run on this data.
@@ -47,6 +48,42 @@ class test_block:
         """
         return self.params["test_type"]
         
+    def get_workers(self):
+        """ Return the number of worker processes this test may use, or None to use all cores.
+        The 'workers' option of the test block overrides the general parameter. Blocks 
+        rendered in the rendering pool use a single process, so the scheduler runs those 
+        that are parallel (see is_parallel) outside of it.
+        """
+        if rendering.in_worker():
+            return 1
+        if "workers" in self.params:
+            return self.params["workers"]
+        return self.gen_params.get("workers")
+        
+    def is_parallel(self):
+        """ Return True if this test spreads its work across processes (see get_workers):
+        the permutations of PERMANOVA, PERMDISP and the multiple metrics PCoA, the starts
+        of an NMDS and the bootstrap replicates of a PCA or PCoA.
+        """
+        if self.get_workers() == 1:
+            return False
+        test = self.get_type()
+        return test in ["permanova", "permdisp", "multi_pcoa", "nmds"] or (test in ["pca", "pcoa"] and "bootstrap" in self.params)
+        
+    def get_output_options(self):
+        """ Return the output options of the plots of this test: a dictionary with the 
+        "format" (png by default), the "dpi" and the "max_file_size" in kilobytes (None 
+        when not set). Options of the test block override the general parameters.
+        """
+        options = dict()
+        for option, param, default in [("format", "plot_format", "png"), ("dpi", "dpi", None), 
+                                       ("max_file_size", "max_file_size", None)]:
+            if param in self.params:
+                options[option] = self.params[param]
+            else:
+                options[option] = self.gen_params.get(param, default)
+        return options
+        
     def get_name(self):
         """ Return the name of this test. 
         """
@@ -10,10 +10,13 @@ all the internal files are in the correct directory.
 """
 
 def main():
-    modules = ["matplotlib", "sklearn", "numpy", "scipy", "pandas"]
+    modules = ["matplotlib", "PIL", "sklearn", "numpy", "scipy", "pandas"]
     internal_files = ["area_plot", "check_parameters", "comparative_analysis", 
                       "pcoa", "enrichment", "test_block", "test_runner", "normalization",
-                      "metagenomic_profile", "result", "generate_html"]
+                      "metagenomic_profile", "result", "generate_html", "ordination",
+                      "distances", "permanova", "nmds", "bootstrap", "rendering", "render_cache",
+                      "timing", "scheduler", "shared_arrays", "checkpoint",
+                      "batch", "bounded_cache"]
     success = True
     
     for m in modules:
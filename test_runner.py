@@ -10,9 +10,11 @@ The class that performs the tests for the comparative analysis.
 # internal imports
 import pcoa
 import enrichment 
-import normalization
+import permanova
 import area_plot
-from result import png_result, html_result, table_result
+import ordination
+import timing
+from result import png_result, html_result, table_result, multi_result
 
 # General imports 
 import os 
@@ -22,7 +24,7 @@ class test_runner:
     
     Attributes:
         block: test_block instance containing instructions for this run. 
-        new_dir: directory where the output from this test run will be saved. 
+        new_dir: directory where the output from this test run will be saved, in the output directory of the run. 
         result: list of result class instances containing the results for this test block. 
     """
     
@@ -33,9 +35,9 @@ class test_runner:
             test_block: test_block instance containing instructions for this run. 
         """
         self.block = test_block
-        os.chdir(self.block.gen_params["output_directory"])
-        self.new_dir = self.block.get_name()  
-        os.mkdir(self.new_dir)
+        self.new_dir = self.block.gen_params["output_directory"] + "/" + self.block.get_name()  
+        if not os.path.isdir(self.new_dir):
+            os.mkdir(self.new_dir)
         self.result = None
     
     # Helper methods 
@@ -51,6 +53,29 @@ class test_runner:
         elif self.block.get_type() == "pcoa":
             dist_metric = self.block.params["distance_metric"]
             result = "PCoA with " + dist_metric + " distance metric shown.\n"
+        elif self.block.get_type() == "nmds":
+            dist_metric = self.block.params["distance_metric"]
+            result = "NMDS with " + dist_metric + " distance metric shown, best of up to " + str(self.block.params["starts"])
+            result += " random starts and a start from the PCoA solution.\n"
+        elif self.block.get_type() == "multi_pcoa":
+            result = "PCoA with " + ", ".join(self.block.params["distance_metrics"]) + " distance metrics shown.\n"
+            result += "Concordance between metrics: Mantel test (" + str(self.block.params["permutations"]) 
+            result += " permutations) of the distance matrices and Procrustes disparity (m2) of the first two principal coordinates.\n"
+        elif self.block.get_type() == "permanova" or self.block.get_type() == "permdisp":
+            test = "PERMANOVA" if self.block.get_type() == "permanova" else "PERMDISP"
+            result = test + " on the " + self.block.params["distance_metric"] + " distance matrix with "
+            result += str(self.block.params["permutations"]) + " permutations.\n"
+            if len(self.block.metagenomic_profile.references) > 2:
+                result += "Each pair of classes is also tested separately.\n"
+        elif self.block.get_type() == "area_plot":
+            n = self.block.params["number_of_features"]
+            by = "mean abundance" if self.block.params["rank_features_by"] == "overall" else "highest mean abundance in a class"
+            result = "Area plot of the " + str(n) + " features with the " + by + ".\n"
+            if len(self.block.metagenomic_profile.abundance_data.columns) > n:
+                result += "All other features are summed into \"Other\".\n"
+            if self.block.params["sample_order"] == "cluster":
+                result += "Samples ordered within each class by average linkage clustering on the " 
+                result += self.block.params["distance_metric"] + " distance matrix.\n"
         elif self.block.get_type() == "enrichment":
             correction = self.block.params["correction"]
             test = "student's t-test" if self.block.params["test"] == "ttest" else "Wilcoxon ranksums test"
@@ -60,8 +85,77 @@ class test_runner:
             elif correction.split("-")[0] == "fdr":
                 result += "P-values adjusted using the Benjamini-Hochberg method using a false discovery rate = " 
                 result += correction.split("-")[1] + ".\n"
+        if "reference_ordination" in self.block.params and self.block.get_type() in ["pca", "pcoa"]:
+            result += "Samples projected onto the reference ordination " + self.block.params["reference_ordination"] + ".\n"
         return result
     
+    def __ordination_options(self):
+        """ Return the reference ordination to project onto (or None) and the path the fitted
+        ordination should be saved to (or None) for a PCA or PCoA block.
+        """
+        reference = None
+        ordination_file = None
+        
+        if "reference_ordination" in self.block.params:
+            reference = ordination.load(self.block.params["reference_ordination"])
+        elif "save_ordination" in self.block.params and self.block.params["save_ordination"][0] == "t":
+            if self.block.get_type() == "pca":
+                ordination_file = self.new_dir + "/" + "pca_ordination.npz"
+            else:
+                ordination_file = self.new_dir + "/" + "pcoa_" + self.block.params["distance_metric"] + "_ordination.npz"
+                
+        return reference, ordination_file
+    
+    def __plot_multi_pcoa(self, interactive):
+        """ Creates one PCoA plot per distance metric and a table comparing them.
+        
+        Args:
+            interactive (bool): create interactive plots instead of png images.
+        """
+        mgprofile = self.block.metagenomic_profile
+        display_name = "PCoA: Multiple Metrics" if self.block.get_name() == self.block.get_type() else self.block.get_name()
+        outputs, concordance = pcoa.multi_pcoa_plot(mgprofile, self.new_dir, self.block.params["distance_metrics"], 
+                                                    workers=self.block.get_workers(), interactive=interactive, 
+                                                    output=self.block.get_output_options(), 
+                                                    permutations=self.block.params["permutations"], 
+                                                    seed=self.block.params.get("seed"))
+        results = list()
+        for dist, fname in outputs:
+            if interactive:
+                res = html_result(fname, "", dist.capitalize(), self.block.get_name())
+            else:
+                res = png_result(fname, "", dist.capitalize(), self.block.get_name())
+            results.append(("PCoA: " + dist.capitalize(), res))
+        results.append(("Concordance", table_result(concordance, "", "Concordance", self.block.get_name())))
+        self.result = multi_result(results, self.__generate_about(), display_name, self.block.get_name())
+    
+    def __with_loadings(self, plot, loadings_file, display_name):
+        """ Combine a PCA plot with the table of all feature loadings.
+        
+        Args:
+            plot: png_result or html_result holding the PCA plot.
+            loadings_file: path to the loadings table.
+            display_name: name of this result.
+        
+        Returns:
+            multi_result instance.
+        """
+        table = table_result(loadings_file, "Loadings of all features, sorted by the norm of the loading vector. " +
+                             "Click a column heading to sort.", "Loadings", self.block.get_name(), page_size=25)
+        return multi_result([("Plot", plot), ("Loadings", table)], self.__generate_about(), 
+                            display_name, self.block.get_name())
+    
+    def __fit_nmds(self):
+        """ Return the NMDS of this block, fitted on the first call and shared by its static 
+        and interactive plots (see nmds.shared_nmds).
+        
+        Returns:
+            Tuple (n x 2 configuration, stress-1).
+        """
+        seed = self.block.params["seed"] if "seed" in self.block.params else None
+        return pcoa.fit_nmds(self.block.metagenomic_profile, self.block.params["distance_metric"], 
+                             starts=self.block.params["starts"], workers=self.block.get_workers(), seed=seed)
+    
     def __plot_static(self):
         """ Creates static plots. 
         """
@@ -69,22 +163,44 @@ class test_runner:
         
         if self.block.get_type() == "area_plot":
             display_name = "Area Plot" if self.block.get_name() == self.block.get_type() else self.block.get_name()
-            area_img = area_plot.area_plot(mgprofile, self.new_dir)
+            area_img = area_plot.area_plot(mgprofile, self.new_dir, number_of_features=self.block.params["number_of_features"], 
+                                           rank_by=self.block.params["rank_features_by"], 
+                                           sample_order=self.block.params["sample_order"], 
+                                           dist_type=self.block.params["distance_metric"], 
+                                           raster=None if self.block.params["raster"] == "auto" else self.block.params["raster"] == "true", 
+                                           output=self.block.get_output_options())
             self.result = png_result(area_img, self.__generate_about(), display_name, self.block.get_name())        
         
         elif self.block.get_type() == "pca":
             loadings = int(self.block.params["number_of_loadings"])
             display_name = "PCA" if self.block.get_name() == self.block.get_type() else self.block.get_name()
-            pca_img = pcoa.pca_plot(mgprofile, self.new_dir, num_of_loadings=loadings)
-            self.result = png_result(pca_img, self.__generate_about(), 
-                                           display_name, self.block.get_name())            
+            reference, ordination_file = self.__ordination_options()
+            loadings_file = self.new_dir + "/" + "pca_loadings.tab"
+            pca_img = pcoa.pca_plot(mgprofile, self.new_dir, num_of_loadings=loadings, reference=reference, 
+                                    ordination_file=ordination_file, loadings_file=loadings_file, 
+                                    output=self.block.get_output_options())
+            plot = png_result(pca_img, "", display_name, self.block.get_name())
+            self.result = self.__with_loadings(plot, loadings_file, display_name)
         
         elif self.block.get_type() == "pcoa":
             dist = self.block.params["distance_metric"]
             display_name = "PCoA: " + dist.capitalize() if self.block.get_name() == self.block.get_type() else self.block.get_name()
-            pcoa_img = pcoa.pcoa_plot(mgprofile, self.new_dir, dist_type=dist)
+            reference, ordination_file = self.__ordination_options()
+            pcoa_img = pcoa.pcoa_plot(mgprofile, self.new_dir, dist_type=dist, reference=reference, 
+                                      ordination_file=ordination_file, output=self.block.get_output_options())
             self.result = png_result(pcoa_img, self.__generate_about(), 
                                            display_name, self.block.get_name())
+        
+        elif self.block.get_type() == "multi_pcoa":
+            self.__plot_multi_pcoa(interactive=False)
+        
+        elif self.block.get_type() == "nmds":
+            dist = self.block.params["distance_metric"]
+            display_name = "NMDS: " + dist.capitalize() if self.block.get_name() == self.block.get_type() else self.block.get_name()
+            nmds_img, stress = pcoa.nmds_plot(mgprofile, self.new_dir, dist, fit=self.__fit_nmds(), 
+                                              output=self.block.get_output_options())
+            self.result = png_result(nmds_img, self.__generate_about() + "Final stress: %.4f.\n" % stress, 
+                                           display_name, self.block.get_name())
             
             
     def __plot_dynamic(self):
@@ -95,25 +211,41 @@ class test_runner:
         if self.block.get_type() == "pca":
             loadings = int(self.block.params["number_of_loadings"])
             display_name = "PCA" if self.block.get_name() == self.block.get_type() else self.block.get_name()
-            pca_html, lgd_png = pcoa.pca_plot_interactive(mgprofile, self.new_dir, num_of_loadings=loadings)
-            self.result = html_result(pca_html, self.__generate_about(), 
-                                            display_name, self.block.get_name(), lgd=lgd_png)
+            reference, ordination_file = self.__ordination_options()
+            loadings_file = self.new_dir + "/" + "pca_loadings.tab"
+            pca_html = pcoa.pca_plot_interactive(mgprofile, self.new_dir, num_of_loadings=loadings, 
+                                                 reference=reference, ordination_file=ordination_file, 
+                                                 loadings_file=loadings_file)
+            plot = html_result(pca_html, "", display_name, self.block.get_name())
+            self.result = self.__with_loadings(plot, loadings_file, display_name)
         
         elif self.block.get_type() == "pcoa":
             dist = self.block.params["distance_metric"]
             display_name = "PCoA: " + dist.capitalize() if self.block.get_name() == self.block.get_type() else self.block.get_name()
-            pcoa_html, lgd_png = pcoa.pcoa_plot_interactive(mgprofile, self.new_dir, dist_type=dist)
+            reference, ordination_file = self.__ordination_options()
+            pcoa_html = pcoa.pcoa_plot_interactive(mgprofile, self.new_dir, dist_type=dist, 
+                                                   reference=reference, ordination_file=ordination_file)
             self.result = html_result(pcoa_html, self.__generate_about(), 
-                                            display_name, self.block.get_name(), lgd=lgd_png)
+                                            display_name, self.block.get_name())
+        
+        elif self.block.get_type() == "multi_pcoa":
+            self.__plot_multi_pcoa(interactive=True)
+        
+        elif self.block.get_type() == "nmds":
+            dist = self.block.params["distance_metric"]
+            display_name = "NMDS: " + dist.capitalize() if self.block.get_name() == self.block.get_type() else self.block.get_name()
+            nmds_html, stress = pcoa.nmds_plot_interactive(mgprofile, self.new_dir, dist, fit=self.__fit_nmds())
+            self.result = html_result(nmds_html, self.__generate_about() + "Final stress: %.4f.\n" % stress, 
+                                            display_name, self.block.get_name())
         
         elif self.block.get_type() == "area_plot":
-            x_label = ""
-            for cls in list(self.block.metagenomic_profile.references.keys()):
-                x_label += cls.ljust(80) # add spaces between labels
             display_name = "Area Plot" if self.block.get_name() == self.block.get_type() else self.block.get_name()
-            area_html, lgd_png = area_plot.area_plot_interactive(mgprofile, self.new_dir)
-            self.result = html_result(area_html, self.__generate_about(), display_name, self.block.get_name(), lgd=lgd_png, 
-                                            x_lbl=x_label)
+            area_html = area_plot.area_plot_interactive(mgprofile, self.new_dir, 
+                                                        number_of_features=self.block.params["number_of_features"], 
+                                                        rank_by=self.block.params["rank_features_by"], 
+                                                        sample_order=self.block.params["sample_order"], 
+                                                        dist_type=self.block.params["distance_metric"])
+            self.result = html_result(area_html, self.__generate_about(), display_name, self.block.get_name())
     
     def __perform_enrichment(self):
         """ Performs a user-specified enrichment test on this metagenomic profile.
@@ -131,34 +263,89 @@ class test_runner:
             self.result = table_result(enrich_table, self.__generate_about(), 
                                              display_name, self.block.get_name())
     
-    def __perform_normalization(self, normalization_type, musicc_intra='use_generic'):
-        """ Normalizes the data in the metagenomic profile of this test block.
+    def __add_bootstrap(self):
+        """ Adds a bootstrap stability analysis to the result of a PCA or PCoA block.
+        """
+        mgprofile = self.block.metagenomic_profile
+        method = self.block.get_type()
+        dist = self.block.params["distance_metric"] if method == "pcoa" else None
+        replicates = self.block.params["bootstrap"]
+        by = self.block.params["bootstrap_by"]
+        seed = self.block.params["seed"] if "seed" in self.block.params else None
+        
+        img, axes_table, samples_table = pcoa.bootstrap_plot(mgprofile, self.new_dir, method, dist_type=dist, replicates=replicates,
+                                                             by=by, workers=self.block.get_workers(), seed=seed, 
+                                                             output=self.block.get_output_options())
+        
+        about = "Bootstrap: " + str(replicates) + " replicates resampling " + by + ", each aligned to the plot above by "
+        about += "a Procrustes rotation. Shaded ellipses are 95% confidence regions of the sample positions.\n"
+        
+        if isinstance(self.result, multi_result):
+            results = self.result.results
+            about = self.result.get_meta() + about
+        else:
+            results = [("Plot", self.result)]
+        
+        results += [("Bootstrap", png_result(img, "", "Bootstrap", self.block.get_name())),
+                    ("Variance explained", table_result(axes_table, "", "Variance explained", self.block.get_name())),
+                    ("Sample stability", table_result(samples_table, "Standard deviation of each sample's position over the replicates.", 
+                                                      "Sample stability", self.block.get_name(), page_size=25))]
+        
+        self.result = multi_result(results, about, self.result.get_result_name(), self.block.get_name())
+    
+    def __perform_permutation_test(self):
+        """ Performs a PERMANOVA or PERMDISP test on the distance matrix of this metagenomic profile.
         """
         mgprofile = self.block.metagenomic_profile
-        if normalization_type == "relative":
-            normalization.relative_normalization(mgprofile, self.new_dir)
-        elif normalization_type == "musicc":
-            normalization.musicc_normalization(mgprofile, self.block.gen_params['abundance_data'], 
-                                               self.new_dir, musicc_intra=musicc_intra)
+        dist = self.block.params["distance_metric"]
+        permutations = self.block.params["permutations"]
+        seed = self.block.params["seed"] if "seed" in self.block.params else None
+        if self.block.get_type() == "permanova":
+            display_name = "PERMANOVA: " + dist.capitalize() if self.block.get_name() == self.block.get_type() else self.block.get_name()
+            table = permanova.permanova(mgprofile, self.new_dir, dist, permutations=permutations, 
+                                        workers=self.block.get_workers(), seed=seed)
+        else:
+            display_name = "PERMDISP: " + dist.capitalize() if self.block.get_name() == self.block.get_type() else self.block.get_name()
+            table = permanova.permdisp(mgprofile, self.new_dir, dist, permutations=permutations, 
+                                       workers=self.block.get_workers(), seed=seed)
+        self.result = table_result(table, self.__generate_about(), display_name, self.block.get_name())
     
     # Public methods 
       
     def run_tests(self):
         """ Run tests on this test block according to the specifications in the parameters file.
+        The profile of the block is already filtered and normalized (see scheduler), and 
+        may be shared with other blocks, so it is only read.
         
         Returns:
             Result instance for this test run. 
+            
+        Effects:
+            Records the time taken by each step of the test block. Makes the thumbnails of 
+            its images for the results page.
         """
-        if "normalization" in self.block.params: # Normalization needs to be performed 1st
-            self.__perform_normalization(self.block.params["normalization"])
         if "interactive_plots" in list(self.block.gen_params.keys()) and self.block.gen_params["interactive_plots"]:
             if "static_plots" in list(self.block.gen_params.keys()) and self.block.gen_params["static_plots"]:
-                self.__plot_static()
-            self.__plot_dynamic()
+                with timing.timed("static plots", self.new_dir):
+                    self.__plot_static()
+            with timing.timed("interactive plots", self.new_dir):
+                self.__plot_dynamic()
         else: 
-            self.__plot_static()
+            with timing.timed("static plots", self.new_dir):
+                self.__plot_static()
+        if self.block.get_type() in ["pca", "pcoa"] and "bootstrap" in self.block.params:
+            with timing.timed("bootstrap", self.new_dir):
+                self.__add_bootstrap()
         if self.block.get_type() == "enrichment":
-            self.__perform_enrichment()
+            with timing.timed("enrichment", self.new_dir):
+                self.__perform_enrichment()
+        elif self.block.get_type() == "permanova" or self.block.get_type() == "permdisp":
+            with timing.timed(self.block.get_type(), self.new_dir):
+                self.__perform_permutation_test()
+        
+        # made here so that plot blocks make their thumbnails in the rendering pool
+        if self.result is not None:
+            self.result.make_thumbnails()
             
         return self.result
         
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Check the statistics of the comparative analysis against direct computations on a
+small random data set with a fixed seed: the PERMANOVA pseudo-F and PERMDISP F, the
+Mantel correlation, placing samples on a fitted PCoA, the NMDS and the bootstrap.
+
+"""
+
+# General imports
+import shutil
+import sys
+import tempfile
+
+# specific imports that must be pre-installed
+import numpy as np
+import pandas as pd
+from sklearn.metrics.pairwise import pairwise_distances
+
+# Internal imports
+import bootstrap
+import metagenomic_profile as mgp
+import nmds
+import ordination
+import permanova
+
+SEED = 0 # Seed of the data and of every random step, so the checks give the same result each time.
+TOLERANCE = 1e-3 # Relative difference allowed; statistics are written to their tables with 4 decimals.
+
+# Helper methods
+
+def __random_data():
+    """ Abundance data and metadata of 30 samples of 6 features in 3 classes. The
+    classes differ in the mean of two features and in their spread.
+    """
+    rng = np.random.RandomState(SEED)
+    classes = np.repeat([1, 2, 3], 10)
+    values = rng.rand(30, 6) * classes[:, np.newaxis] * 0.5
+    values[:, 0] += classes * 0.3
+    values[:, 3] += classes * 0.1
+    samples = ["sample_" + str(i) for i in range(30)]
+    abundance_data = pd.DataFrame(values, index=samples, columns=["feature_" + str(j) for j in range(6)])
+    metadata = pd.DataFrame({"class": classes}, index=samples)
+    return abundance_data, metadata
+
+def __close(value, expected):
+    """ Return True if value is within TOLERANCE of expected.
+    """
+    return abs(value - expected) <= TOLERANCE * max(1.0, abs(expected))
+
+def __pseudo_f(dist, groups):
+    """ PERMANOVA pseudo-F from the sums of squared distances (Anderson 2001, eq. 1-3).
+    """
+    members = sum(groups, [])
+    n = len(members)
+    ss_total = (np.triu(dist[members][:, members], 1) ** 2).sum() / n
+    ss_within = sum((np.triu(dist[g][:, g], 1) ** 2).sum() / len(g) for g in groups)
+    return ((ss_total - ss_within) / (len(groups) - 1)) / (ss_within / (n - len(groups)))
+
+def __dispersion_f(values, groups):
+    """ PERMDISP F with Euclidean distances: one-way ANOVA of the distances of the samples
+    to the centroid of their class.
+    """
+    z = [np.sqrt(((values[g] - values[g].mean(axis=0)) ** 2).sum(axis=1)) for g in groups]
+    n = sum(len(d) for d in z)
+    grand_mean = np.concatenate(z).mean()
+    ss_among = sum(len(d) * (d.mean() - grand_mean) ** 2 for d in z)
+    ss_within = sum(((d - d.mean()) ** 2).sum() for d in z)
+    return (ss_among / (len(z) - 1)) / (ss_within / (n - len(z)))
+
+def __check_tests():
+    """ Compare the statistics of the PERMANOVA and PERMDISP tables to direct computations,
+    for all classes together and each pair of classes.
+    """
+    abundance_data, metadata = __random_data()
+    profile = mgp.metagenomic_profile(abundance_data, metadata, metadata_header=True)
+    output_dir = tempfile.mkdtemp()
+    success = True
+    try:
+        for test, direct in [("permanova", __pseudo_f), ("permdisp", __dispersion_f)]:
+            fname = getattr(permanova, test)(profile, output_dir, "euclidean", permutations=99, workers=1, seed=SEED)
+            table = pd.read_csv(fname, sep="\t")
+            for name, statistic in zip(table["comparison"], table[table.columns[1]]):
+                groups = [[abundance_data.index.get_loc(s) for s in profile.references[c]] for c in name.split(" vs ")]
+                if direct == __pseudo_f:
+                    expected = __pseudo_f(pairwise_distances(abundance_data.values), groups)
+                else:
+                    expected = __dispersion_f(abundance_data.values, groups)
+                if not __close(statistic, expected):
+                    print((test.upper() + " statistic of " + name + " is " + str(statistic) + ", expected %.4f.\n" % expected))
+                    success = False
+    finally:
+        shutil.rmtree(output_dir)
+    return success
+
+def __check_mantel():
+    """ Compare the Mantel correlation to the Pearson correlation of the distances, and check
+    that the p-value does not depend on the number of processes.
+    """
+    abundance_data = __random_data()[0]
+    a = pairwise_distances(abundance_data.values)
+    b = pairwise_distances(abundance_data.values, metric="cityblock")
+    upper = np.triu_indices(len(a), 1)
+    expected = np.corrcoef(a[upper], b[upper])[0, 1]
+
+    r, p = permanova.mantel(a, b, permutations=199, workers=1, seed=SEED)
+    success = True
+    if not __close(r, expected):
+        print(("Mantel r is " + str(r) + ", expected " + str(expected) + ".\n"))
+        success = False
+    if p > 0.01 or permanova.mantel(a, b, permutations=199, workers=2, seed=SEED)[1] != p:
+        print(("Mantel p-value of two related distance matrices is " + str(p) + ", or changes with the number of processes.\n"))
+        success = False
+    return success
+
+def __check_projection():
+    """ Place samples on a fitted PCoA: the reference samples must land on their own
+    coordinates, for a non-Euclidean metric too, and with Euclidean distances new samples
+    must land where a PCA of the reference samples puts them.
+    """
+    abundance_data = __random_data()[0]
+    reference, new = abundance_data.iloc[:20], abundance_data.iloc[20:]
+    success = True
+
+    for dist_type in ["euclidean", "braycurtis"]:
+        fitted = ordination.fit_pcoa(reference, dist_type)
+        if not np.allclose(fitted.project(reference), fitted.coordinates, atol=1e-8):
+            print(("Reference samples projected onto a " + dist_type + " PCoA moved from their coordinates.\n"))
+            success = False
+
+    pcoa = ordination.fit_pcoa(reference, "euclidean").project(new)[:, :2]
+    pca = ordination.fit_pca(reference).project(new)
+    if not np.allclose(np.abs(pcoa), np.abs(pca), atol=1e-8):
+        print("New samples projected onto a Euclidean PCoA differ from their PCA coordinates.\n")
+        success = False
+    return success
+
+def __check_nmds():
+    """ An NMDS of points in the plane must reproduce their distances, the same way each time.
+    """
+    points = np.random.RandomState(SEED).rand(15, 2)
+    dist = pairwise_distances(points)
+    coords, stress, runs = nmds.fit_nmds(dist, starts=4, workers=1, max_iter=3000, eps=1e-8, seed=SEED)
+    again = nmds.fit_nmds(dist, starts=4, workers=1, max_iter=3000, eps=1e-8, seed=SEED)
+    success = True
+    if stress > 0.01:
+        print(("NMDS stress of points in the plane is " + str(stress) + ", expected close to 0.\n"))
+        success = False
+    if stress != again[1] or not np.array_equal(coords, again[0]):
+        print("NMDS with the same seed gave a different configuration.\n")
+        success = False
+    return success
+
+def __check_bootstrap():
+    """ Bootstrap replicates with the same seed must be the same, and resampling samples
+    with replacement must leave about a third of the samples out of each replicate.
+    """
+    abundance_data = __random_data()[0]
+    values = abundance_data.values
+    dist = pairwise_distances(values)
+    reference = ordination.fit_pcoa(abundance_data, "euclidean").coordinates[:, :2]
+
+    coords, variance = bootstrap.bootstrap(values, dist, reference, "euclidean", replicates=20, workers=1, seed=SEED)
+    again = bootstrap.bootstrap(values, dist, reference, "euclidean", replicates=20, workers=1, seed=SEED)
+    success = True
+    if not (np.array_equal(coords, again[0], equal_nan=True) and np.array_equal(variance, again[1])):
+        print("Bootstrap with the same seed gave different replicates.\n")
+        success = False
+    left_out = np.isnan(coords[:, :, 0]).mean()
+    if not 0.2 < left_out < 0.5:
+        print(("Bootstrap left " + str(left_out) + " of the samples out of each replicate, expected about 0.37.\n"))
+        success = False
+    return success
+
+def main():
+    success = True
+    for check in [__check_tests, __check_mantel, __check_projection, __check_nmds, __check_bootstrap]:
+        success = check() and success
+
+    if success:
+        print("Statistics checked. All results match.")
+    else:
+        print("Statistics check failed.")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
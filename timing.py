@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Timing of the steps of a run: the tests of each block and every plot file that is
+saved or taken from the render cache, with the size of the file, and the profiles
+shared by test blocks, with the memory they saved. Timings recorded in the processes
+of the rendering pool are sent back with the results of their blocks.
+"""
+
+# General imports
+import contextlib
+import os
+import time
+
+# specific imports that must be pre-installed
+import pandas as pd
+
+# (stage, name, seconds, size in bytes or None) in the order the steps finished
+__timings = list()
+
+# Public methods
+
+@contextlib.contextmanager
+def timed(stage, name):
+    """ Time the steps run inside this with-statement.
+
+    Args:
+        stage (str): kind of step, such as "save" or "static plots".
+        name (str): name of the test block, or path of the file written by this step.
+            If the file exists afterwards its size is recorded too.
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        size = os.path.getsize(name) if os.path.isfile(name) else None
+        __timings.append((stage, name, time.time() - start, size))
+
+def shared(name, size):
+    """ Record a test block that was given a profile shared with other blocks instead of its own copy.
+
+    Args:
+        name (str): name of the test block.
+        size (int): bytes held by the shared profile, saved by not copying it.
+    """
+    __timings.append(("shared profile", name, 0.0, size))
+
+def collect():
+    """ Return the timings recorded in this process and clear them.
+    """
+    result = list(__timings)
+    del __timings[:]
+    return result
+
+def add(timings):
+    """ Add timings recorded in another process, as returned by collect().
+    """
+    __timings.extend(timings)
+
+def write(fname):
+    """ Save the timings recorded in this process to a table and clear them, so the next run
+    in this process starts a new table.
+
+    Args:
+        fname (str): path of the table.
+
+    Returns:
+        Total seconds and number of files of the "save" steps, number of files taken
+        from the render cache and bytes saved by sharing profiles.
+    """
+    table = pd.DataFrame(__timings, columns=["stage", "output", "seconds", "size (KB)"])
+    table["size (KB)"] = table["size (KB)"] / 1024.0
+    table.to_csv(fname, sep="\t", index=False, float_format="%.3f")
+    del __timings[:]
+
+    saves = table[table["stage"] == "save"]
+    shared = table[table["stage"] == "shared profile"]
+    return (saves["seconds"].sum(), len(saves), int((table["stage"] == "cached").sum()), 
+            int(shared["size (KB)"].sum() * 1024))